@@ -1,2 +1,3 @@
-# Expose the FastAPI app to Vercel Python Functions as ASGI
-from app.main import app  # noqa: F401
\ No newline at end of file
+# Expose the FastAPI app to Vercel Python Functions as ASGI.
+# Keep WEBHOOK_MODE=sync (the default) here: serverless functions have no long-lived workers to drain a queue.
+from app.main import app  # noqa: F401
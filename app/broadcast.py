@@ -0,0 +1,182 @@
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+import httpx
+from .config import settings
+from .ratelimit import TokenBucket
+from . import whatsapp as wa
+
+logger = logging.getLogger(__name__)
+
+# Shared across all broadcasts in this process so concurrent fan-outs respect one messaging tier.
+_bucket = TokenBucket(rate=settings.wa_rate_limit_per_sec, capacity=settings.wa_rate_limit_burst)
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+@dataclass
+class RecipientResult:
+    phone: str
+    status: str  # sent | failed | throttled
+    status_code: Optional[int] = None
+    attempts: int = 0
+    message_id: Optional[str] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class BroadcastSummary:
+    results: List[RecipientResult] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    def count(self, status: str) -> int:
+        return sum(1 for r in self.results if r.status == status)
+
+    @property
+    def sent(self) -> int:
+        return self.count("sent")
+
+    @property
+    def failed(self) -> int:
+        return self.count("failed")
+
+    @property
+    def throttled(self) -> int:
+        return self.count("throttled")
+
+    def as_dict(self) -> dict:
+        return {
+            "recipients": len(self.results),
+            "sent": self.sent,
+            "failed": self.failed,
+            "throttled": self.throttled,
+            "elapsed": round(self.elapsed, 3),
+        }
+
+
+def _unique(recipients: Iterable[str]) -> List[str]:
+    seen = set()
+    out = []
+    for phone in recipients:
+        if phone and phone not in seen:
+            seen.add(phone)
+            out.append(phone)
+    return out
+
+
+def _retry_delay(resp: Optional[httpx.Response], attempt: int) -> float:
+    # Jitter so throttled workers do not retry in lockstep. The server's Retry-After is a floor:
+    # only upward jitter on top of it, and max_delay caps our own backoff only.
+    if resp is not None:
+        retry_after = resp.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return float(retry_after) * random.uniform(1.0, 1.5)
+            except ValueError:
+                pass
+    delay = min(settings.wa_retry_base_delay * (2 ** attempt), settings.wa_retry_max_delay)
+    return delay * random.uniform(0.5, 1.5)
+
+
+def _message_id(resp: httpx.Response) -> Optional[str]:
+    try:
+        return resp.json()["messages"][0]["id"]
+    except Exception:
+        return None
+
+
+def _classify(phone: str, resp: Optional[httpx.Response], error: Optional[str], attempts: int) -> RecipientResult:
+    if resp is None:
+        return RecipientResult(phone=phone, status="failed", attempts=attempts, error=error)
+    if resp.status_code < 300:
+        return RecipientResult(phone=phone, status="sent", status_code=resp.status_code, attempts=attempts, message_id=_message_id(resp))
+    status = "throttled" if resp.status_code == 429 else "failed"
+    return RecipientResult(phone=phone, status=status, status_code=resp.status_code, attempts=attempts, error=resp.text[:200])
+
+
+def send_with_retry(phone: str, body: str) -> RecipientResult:
+    resp = None
+    error = None
+    attempt = 0
+    while True:
+        _bucket.acquire()
+        try:
+            resp = wa.send_text(phone, body)
+            error = None
+        except httpx.HTTPError as exc:
+            resp, error = None, str(exc)
+        attempt += 1
+        retryable = resp is None or resp.status_code in RETRYABLE_STATUS
+        if not retryable or attempt > settings.wa_send_max_retries:
+            return _classify(phone, resp, error, attempt)
+        time.sleep(_retry_delay(resp, attempt - 1))
+
+
+def send_once(phone: str, body: str, rate_limited: bool = True) -> RecipientResult:
+    # One attempt, for callers that schedule their own retries (the outbox sender)
+    if rate_limited:
+        _bucket.acquire()
+    try:
+        return _classify(phone, wa.send_text(phone, body), None, 1)
+    except httpx.HTTPError as exc:
+        return _classify(phone, None, str(exc), 1)
+
+
+def _record(summary: BroadcastSummary, body: str) -> None:
+    # Link outbound wamids to this broadcast so delivery receipts roll up per broadcast
+    if not settings.delivery_tracking or not summary.results:
+        return
+    try:
+        from .services.delivery import record_broadcast
+
+        record_broadcast(summary, body)
+    except Exception:
+        logger.exception("failed to record broadcast")
+
+
+def broadcast(recipients: Iterable[str], body: str) -> BroadcastSummary:
+    phones = _unique(recipients)
+    started = time.monotonic()
+    summary = BroadcastSummary()
+    if phones:
+        workers = max(1, min(settings.wa_broadcast_concurrency, len(phones)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="wa-broadcast") as pool:
+            summary.results = list(pool.map(lambda p: send_with_retry(p, body), phones))
+    summary.elapsed = time.monotonic() - started
+    logger.info("broadcast finished: %s", summary.as_dict())
+    _record(summary, body)
+    return summary
+
+
+def flush_concurrently(pending: List[Tuple[str, object, str]]) -> None:
+    # Replies collected for a batch of messages: different recipients are sent to in parallel,
+    # each recipient's messages keep their order.
+    chains: Dict[str, List[str]] = {}
+    broadcasts = []
+    for kind, to, body in pending:
+        if kind == "broadcast":
+            broadcasts.append((to, body))
+        else:
+            chains.setdefault(to, []).append(body)
+    pending.clear()
+
+    def _chain(item: Tuple[str, List[str]]) -> None:
+        phone, bodies = item
+        for body in bodies:
+            try:
+                wa.send_text(phone, body)
+            except httpx.HTTPError:
+                logger.exception("failed to send reply to %s", phone)
+
+    if len(chains) > 1:
+        workers = max(1, min(settings.wa_broadcast_concurrency, len(chains)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="wa-replies") as pool:
+            list(pool.map(_chain, chains.items()))
+    else:
+        for item in chains.items():
+            _chain(item)
+    for recipients, body in broadcasts:
+        broadcast(recipients, body)
@@ -1,3 +1,5 @@
+import os
+from typing import Optional
 from pydantic_settings import BaseSettings
 from pydantic import Field
 
@@ -11,6 +13,141 @@ class Settings(BaseSettings):
     database_url: str = Field(default="sqlite:///./app.db", alias="DATABASE_URL")
     admin_init_token: str = Field(default="", alias="ADMIN_INIT_TOKEN")
 
+    # Connection pooling: auto | serverless (NullPool) | pooled (QueuePool)
+    db_pool_profile: str = Field(default="auto", alias="DB_POOL_PROFILE")
+    db_pool_size: int = Field(default=5, alias="DB_POOL_SIZE")
+    db_max_overflow: int = Field(default=10, alias="DB_MAX_OVERFLOW")
+    db_pool_recycle: int = Field(default=1800, alias="DB_POOL_RECYCLE")
+    db_pool_timeout: float = Field(default=30.0, alias="DB_POOL_TIMEOUT")
+    db_pool_pre_ping: bool = Field(default=True, alias="DB_POOL_PRE_PING")
+    # SQLite (local/dev): WAL journaling and tuned pragmas
+    sqlite_tuning: bool = Field(default=True, alias="SQLITE_TUNING")
+    sqlite_wal: bool = Field(default=True, alias="SQLITE_WAL")
+    sqlite_synchronous: str = Field(default="NORMAL", alias="SQLITE_SYNCHRONOUS")
+    sqlite_busy_timeout_ms: int = Field(default=5000, alias="SQLITE_BUSY_TIMEOUT_MS")
+    sqlite_cache_size_kb: int = Field(default=65536, alias="SQLITE_CACHE_SIZE_KB")
+    sqlite_mmap_size: int = Field(default=268435456, alias="SQLITE_MMAP_SIZE")
+    # Vercel Cron sends "Authorization: Bearer <CRON_SECRET>" to /admin/cron/* endpoints
+    cron_secret: str = Field(default="", alias="CRON_SECRET")
+
+    # Graph API HTTP client (pooled, process-wide); point WA_GRAPH_BASE at a local stand-in for load tests
+    wa_graph_base: str = Field(default="https://graph.facebook.com/v20.0", alias="WA_GRAPH_BASE")
+    wa_http_timeout: float = Field(default=20.0, alias="WA_HTTP_TIMEOUT")
+    wa_http_max_connections: int = Field(default=20, alias="WA_HTTP_MAX_CONNECTIONS")
+    wa_http_max_keepalive: int = Field(default=10, alias="WA_HTTP_MAX_KEEPALIVE")
+    wa_http_keepalive_expiry: float = Field(default=60.0, alias="WA_HTTP_KEEPALIVE_EXPIRY")
+    wa_http2: bool = Field(default=True, alias="WA_HTTP2")
+
+    # Broadcast engine: token bucket sized to the Cloud API messaging tier (default 80 msg/s)
+    wa_rate_limit_per_sec: float = Field(default=80.0, alias="WA_RATE_LIMIT_PER_SEC")
+    wa_rate_limit_burst: float = Field(default=80.0, alias="WA_RATE_LIMIT_BURST")
+    wa_broadcast_concurrency: int = Field(default=16, alias="WA_BROADCAST_CONCURRENCY")
+    wa_send_max_retries: int = Field(default=3, alias="WA_SEND_MAX_RETRIES")
+    wa_retry_base_delay: float = Field(default=0.5, alias="WA_RETRY_BASE_DELAY")
+    wa_retry_max_delay: float = Field(default=30.0, alias="WA_RETRY_MAX_DELAY")
+
+    # Run each inbound message in one DB transaction and send replies after commit
+    db_unit_of_work: bool = Field(default=True, alias="DB_UNIT_OF_WORK")
+
+    # In-memory (commodity, region) -> buyers index; re-read from the DB at most this often (seconds, 0 = never)
+    subscription_index_refresh: float = Field(default=300.0, alias="SUBSCRIPTION_INDEX_REFRESH")
+
+    # Conversation state (LIST flow): write-through cache in front of session_states.
+    # Cache TTL defaults to 0 (off) on serverless, where consecutive messages may hit different instances.
+    session_cache_size: int = Field(default=10000, alias="SESSION_CACHE_SIZE")
+    session_cache_ttl: Optional[float] = Field(default=None, alias="SESSION_CACHE_TTL")
+    # "No active flow" is cached only briefly, so a flow started by another instance shows up quickly
+    session_miss_ttl: float = Field(default=5.0, alias="SESSION_MISS_TTL")
+    session_flow_ttl_minutes: float = Field(default=60.0, alias="SESSION_FLOW_TTL_MINUTES")
+
+    # SEARCH: in-memory inverted index over open listings; re-read from the DB at most this often (seconds, 0 = never)
+    search_index_refresh: float = Field(default=300.0, alias="SEARCH_INDEX_REFRESH")
+    search_results: int = Field(default=10, alias="SEARCH_RESULTS")
+
+    # Inbound dispatcher: messages are sharded by sender onto this many ordered worker lanes
+    dispatcher_lanes: int = Field(default=8, alias="DISPATCHER_LANES")
+    dispatcher_max_queue: int = Field(default=1000, alias="DISPATCHER_MAX_QUEUE")
+
+    # LISTINGS pagination and rendered-page cache
+    listings_page_size: int = Field(default=15, alias="LISTINGS_PAGE_SIZE")
+    listings_page_cache_size: int = Field(default=2000, alias="LISTINGS_PAGE_CACHE_SIZE")
+    listings_page_cache_ttl: float = Field(default=60.0, alias="LISTINGS_PAGE_CACHE_TTL")
+
+    # Listing deadlines: in-process scheduler (default on except serverless) or /admin/cron/deadlines
+    deadline_scheduler_enabled: Optional[bool] = Field(default=None, alias="DEADLINE_SCHEDULER")
+    deadline_batch_size: int = Field(default=200, alias="DEADLINE_BATCH_SIZE")
+
+    # BIDS leaderboard: top-K bids kept per listing, for up to this many listings
+    leaderboard_size: int = Field(default=5, alias="LEADERBOARD_SIZE")
+    leaderboard_cache_size: int = Field(default=10000, alias="LEADERBOARD_CACHE_SIZE")
+    # re-read a board from the DB at most this often (seconds, 0 = never), for other processes' bids
+    leaderboard_refresh: float = Field(default=60.0, alias="LEADERBOARD_REFRESH")
+
+    # Seller bid notifications: first bid instantly, then one digest per window (0 = always instant)
+    notify_digest_window: float = Field(default=30.0, alias="NOTIFY_DIGEST_WINDOW")
+    notify_digest_max_bids: int = Field(default=10, alias="NOTIFY_DIGEST_MAX_BIDS")
+    notify_instant_first: bool = Field(default=True, alias="NOTIFY_INSTANT_FIRST")
+
+    # Webhook processing: "sync" handles messages inline (serverless), "queue" persists the payload
+    # and returns at once while a background worker pool drains the inbound queue.
+    webhook_mode: str = Field(default="sync", alias="WEBHOOK_MODE")
+    # Multi-message payloads: resolve senders in bulk, one transaction per sender, replies sent in parallel
+    webhook_batch: bool = Field(default=True, alias="WEBHOOK_BATCH")
+    queue_workers: int = Field(default=1, alias="QUEUE_WORKERS")
+    queue_batch_size: int = Field(default=10, alias="QUEUE_BATCH_SIZE")
+    queue_visibility_timeout: float = Field(default=60.0, alias="QUEUE_VISIBILITY_TIMEOUT")
+    queue_max_attempts: int = Field(default=5, alias="QUEUE_MAX_ATTEMPTS")
+    queue_poll_interval: float = Field(default=0.5, alias="QUEUE_POLL_INTERVAL")
+
+    # Outbound outbox: replies and broadcasts queued inside a transaction are written to the outbox table
+    # in that transaction and sent by a background sender (default on except serverless, where
+    # /admin/cron/outbox drains it). Direct replies and broadcasts have separate lanes.
+    outbox_enabled: Optional[bool] = Field(default=None, alias="OUTBOX")
+    outbox_batch_size: int = Field(default=100, alias="OUTBOX_BATCH_SIZE")
+    outbox_concurrency: int = Field(default=16, alias="OUTBOX_CONCURRENCY")
+    outbox_poll_interval: float = Field(default=1.0, alias="OUTBOX_POLL_INTERVAL")
+    outbox_visibility_timeout: float = Field(default=120.0, alias="OUTBOX_VISIBILITY_TIMEOUT")
+    outbox_max_attempts: int = Field(default=8, alias="OUTBOX_MAX_ATTEMPTS")
+    outbox_retention_hours: float = Field(default=24.0, alias="OUTBOX_RETENTION_HOURS")
+
+    # Per-sender inbound rate limit (token bucket; LISTINGS and publishing a listing cost more) and
+    # load shedding of expensive commands while the dispatcher backlog exceeds INBOUND_SHED_QUEUE_DEPTH
+    inbound_rate_limit: bool = Field(default=True, alias="INBOUND_RATE_LIMIT")
+    inbound_rate_per_min: float = Field(default=20.0, alias="INBOUND_RATE_PER_MIN")
+    inbound_burst: float = Field(default=15.0, alias="INBOUND_BURST")
+    inbound_limit_backend: str = Field(default="memory", alias="INBOUND_LIMIT_BACKEND")  # memory | db
+    inbound_limit_cache_size: int = Field(default=50000, alias="INBOUND_LIMIT_CACHE_SIZE")
+    inbound_cooldown_seconds: float = Field(default=60.0, alias="INBOUND_COOLDOWN_SECONDS")
+    inbound_shed_queue_depth: int = Field(default=500, alias="INBOUND_SHED_QUEUE_DEPTH")
+
+    # Inbound idempotency: Meta redelivers webhooks for up to 7 days
+    dedup_cache_size: int = Field(default=10000, alias="DEDUP_CACHE_SIZE")
+    dedup_ttl_hours: float = Field(default=168.0, alias="DEDUP_TTL_HOURS")
+    dedup_prune_interval: float = Field(default=3600.0, alias="DEDUP_PRUNE_INTERVAL")
+
+    # Delivery receipts: recipients with a permanent error or this many failures in a row are suppressed
+    delivery_tracking: bool = Field(default=True, alias="DELIVERY_TRACKING")
+    delivery_suppress_after: int = Field(default=3, alias="DELIVERY_SUPPRESS_AFTER")
+    delivery_events_ttl_days: float = Field(default=30.0, alias="DELIVERY_EVENTS_TTL_DAYS")
+    delivery_health_refresh: float = Field(default=300.0, alias="DELIVERY_HEALTH_REFRESH")
+
+    # Archival (/admin/cron/archive or python -m app.services.archive): closed and expired listings
+    # that ended more than ARCHIVE_AFTER_DAYS ago move with their bids to *_archive tables, and
+    # abandoned conversation rows are deleted. Runs in batches of ARCHIVE_BATCH_SIZE.
+    archive_after_days: float = Field(default=90.0, alias="ARCHIVE_AFTER_DAYS")
+    archive_batch_size: int = Field(default=500, alias="ARCHIVE_BATCH_SIZE")
+
+    # Admin bulk export (rows fetched per server-side cursor batch) and import (rows per executemany)
+    bulk_batch_size: int = Field(default=1000, alias="BULK_BATCH_SIZE")
+
+    # Built-in instrumentation exposed on /metrics; spans need the optional opentelemetry-api package
+    metrics_enabled: bool = Field(default=True, alias="METRICS_ENABLED")
+    tracing_enabled: bool = Field(default=False, alias="TRACING_ENABLED")
+
+    @property
+    def is_serverless(self) -> bool:
+        return bool(os.environ.get("VERCEL") or os.environ.get("AWS_LAMBDA_FUNCTION_NAME"))
+
     class Config:
         env_file = ".env"
         case_sensitive = False
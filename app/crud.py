@@ -1,8 +1,26 @@
 from __future__ import annotations
-from typing import Optional, List
-from sqlalchemy.orm import Session
-from sqlalchemy import select, and_
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, List
+from sqlalchemy.orm import Session, aliased, make_transient_to_detached
+from sqlalchemy import select, insert, update, delete, func, and_, or_, case, exists, bindparam, literal
 from . import models
+from .db import in_unit_of_work
+
+
+def _save(db: Session, obj):
+    # Inside a unit of work only flush (assigns ids); otherwise keep the commit-per-helper behavior.
+    db.add(obj)
+    if in_unit_of_work(db):
+        db.flush()
+    else:
+        db.commit()
+        db.refresh(obj)
+    return obj
+
+
+def _finish(db: Session) -> None:
+    if not in_unit_of_work(db):
+        db.commit()
 
 
 def get_or_create_user(db: Session, phone: str, default_role: str = "buyer") -> models.User:
@@ -11,26 +29,71 @@ def get_or_create_user(db: Session, phone: str, default_role: str = "buyer") ->
     if user:
         return user
     user = models.User(phone=phone, role=default_role)
+    return _save(db, user)
+
+
+def get_or_create_users(db: Session, phones: Iterable[str], default_role: str = "buyer") -> Dict[str, int]:
+    # Batch variant for multi-message payloads: one SELECT plus one multi-row INSERT, returns phone -> user id
+    phones = list(dict.fromkeys(phones))
+    if not phones:
+        return {}
+    stmt = select(models.User.phone, models.User.id).where(models.User.phone.in_(phones))
+    ids = {phone: user_id for phone, user_id in db.execute(stmt)}
+    missing = [p for p in phones if p not in ids]
+    if missing:
+        # ON CONFLICT DO NOTHING: phones another worker created first are skipped instead of failing
+        # (and rolling back) the whole batch; they are read back below
+        rows = db.execute(
+            _insert_for(db, models.User).on_conflict_do_nothing(index_elements=["phone"])
+            .returning(models.User.phone, models.User.id),
+            [{"phone": p, "role": default_role} for p in missing],
+        )
+        ids.update({phone: user_id for phone, user_id in rows})
+        raced = [p for p in missing if p not in ids]
+        if raced:
+            ids.update({phone: user_id for phone, user_id in db.execute(stmt.where(models.User.phone.in_(raced)))})
+        _finish(db)
+    return ids
+
+
+def _insert_for(db: Session, table):
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    return dialect_insert(table)
+
+
+def attach_user(db: Session, user_id: int, phone: str) -> models.User:
+    # A user resolved by get_or_create_users, attached without another SELECT; the remaining
+    # columns (role, status, ...) load on first access.
+    user = models.User(id=user_id, phone=phone)
+    make_transient_to_detached(user)
     db.add(user)
-    db.commit()
-    db.refresh(user)
     return user
 
 
 def set_user_role(db: Session, user: models.User, role: str) -> models.User:
     user.role = role
-    db.add(user)
-    db.commit()
-    db.refresh(user)
-    return user
+    return _save(db, user)
 
 
 def add_opt_in(db: Session, user_id: int, commodity: str, region: str) -> models.OptIn:
-    opt_in = models.OptIn(user_id=user_id, commodity=commodity.upper(), region=region.upper(), active=1)
-    db.add(opt_in)
-    db.commit()
-    db.refresh(opt_in)
-    return opt_in
+    # Upsert: repeated SUBSCRIBE commands reuse (and reactivate) the existing row
+    commodity, region = commodity.upper(), region.upper()
+    stmt = select(models.OptIn).where(
+        models.OptIn.user_id == user_id,
+        models.OptIn.commodity == commodity,
+        models.OptIn.region == region,
+    )
+    opt_in = db.execute(stmt).scalar_one_or_none()
+    if opt_in is not None:
+        if opt_in.active == 1:
+            return opt_in
+        opt_in.active = 1
+        return _save(db, opt_in)
+    opt_in = models.OptIn(user_id=user_id, commodity=commodity, region=region, active=1)
+    return _save(db, opt_in)
 
 
 def get_session_state(db: Session, user_id: int) -> Optional[models.SessionState]:
@@ -42,15 +105,44 @@ def set_session_state(db: Session, user_id: int, flow: Optional[str], step: Opti
     state = get_session_state(db, user_id)
     if state is None:
         state = models.SessionState(user_id=user_id, flow=flow, step=step, data_json=data_json)
-        db.add(state)
     else:
         state.flow = flow
         state.step = step
         state.data_json = data_json
-        db.add(state)
-    db.commit()
-    db.refresh(state)
-    return state
+    return _save(db, state)
+
+
+def upsert_session_state(db: Session, user_id: int, flow: Optional[str], step: Optional[int], data_json: Optional[str]) -> None:
+    # UPDATE first (the common mid-flow case is one statement), INSERT only when no row exists yet
+    values = {"flow": flow, "step": step, "data_json": data_json, "updated_at": datetime.utcnow()}
+    result = db.execute(
+        update(models.SessionState)
+        .where(models.SessionState.user_id == user_id)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        db.execute(insert(models.SessionState).values(user_id=user_id, **values))
+    _finish(db)
+
+
+def delete_session_state(db: Session, user_id: int) -> None:
+    db.execute(
+        delete(models.SessionState)
+        .where(models.SessionState.user_id == user_id)
+        .execution_options(synchronize_session=False)
+    )
+    _finish(db)
+
+
+def delete_stale_session_states(db: Session, updated_before: datetime) -> int:
+    result = db.execute(
+        delete(models.SessionState)
+        .where(models.SessionState.updated_at < updated_before)
+        .execution_options(synchronize_session=False)
+    )
+    _finish(db)
+    return result.rowcount
 
 
 def create_listing(
@@ -75,10 +167,7 @@ def create_listing(
         deadline=deadline,
         status="open",
     )
-    db.add(listing)
-    db.commit()
-    db.refresh(listing)
-    return listing
+    return _save(db, listing)
 
 
 def get_listing(db: Session, listing_id: int) -> Optional[models.Listing]:
@@ -86,14 +175,26 @@ def get_listing(db: Session, listing_id: int) -> Optional[models.Listing]:
     return db.execute(stmt).scalar_one_or_none()
 
 
+def open_listings_stmt():
+    return select(models.Listing).where(models.Listing.status == "open").order_by(models.Listing.created_at.desc())
+
+
 def list_open_listings(db: Session) -> List[models.Listing]:
-    stmt = select(models.Listing).where(models.Listing.status == "open").order_by(models.Listing.created_at.desc())
-    return db.execute(stmt).scalars().all()
+    return db.execute(open_listings_stmt()).scalars().all()
 
 
-def list_open_listings_for_user(db: Session, user_id: int, limit: Optional[int] = None) -> List[models.Listing]:
+def open_listing_search_rows(db: Session) -> List[tuple]:
+    # Columns only (no ORM objects) for building the SEARCH index over every open listing
+    listing = models.Listing
+    stmt = select(
+        listing.id, listing.commodity, listing.quantity, listing.unit, listing.location, listing.quality, listing.min_price
+    ).where(listing.status == "open")
+    return db.execute(stmt).all()
+
+
+def open_listings_for_user_stmt(user_id: int):
     # Open listings matching user's active opt-ins (commodity + region)
-    stmt = (
+    return (
         select(models.Listing)
         .join(
             models.OptIn,
@@ -107,17 +208,138 @@ def list_open_listings_for_user(db: Session, user_id: int, limit: Optional[int]
         .where(models.Listing.status == "open")
         .order_by(models.Listing.created_at.desc())
     )
+
+
+def list_open_listings_for_user(db: Session, user_id: int, limit: Optional[int] = None) -> List[models.Listing]:
+    stmt = open_listings_for_user_stmt(user_id)
     if limit is not None:
         stmt = stmt.limit(limit)
     return db.execute(stmt).scalars().all()
 
 
-def close_listing(db: Session, listing: models.Listing) -> models.Listing:
-    listing.status = "closed"
-    db.add(listing)
-    db.commit()
-    db.refresh(listing)
-    return listing
+def list_open_listings_page(
+    db: Session,
+    subscriptions: Optional[List[tuple]] = None,
+    after: Optional[tuple] = None,
+    limit: int = 15,
+) -> List[models.Listing]:
+    # Keyset pagination, newest first: `after` is the (created_at, id) of the last row already shown.
+    # `subscriptions` restricts to (commodity, region) pairs; None means every open listing.
+    stmt = select(models.Listing).where(models.Listing.status == "open")
+    if subscriptions is not None:
+        stmt = stmt.where(or_(*[
+            and_(models.Listing.commodity == commodity, models.Listing.location == region)
+            for commodity, region in subscriptions
+        ]))
+    if after is not None:
+        created_at, listing_id = after
+        stmt = stmt.where(or_(
+            models.Listing.created_at < created_at,
+            and_(models.Listing.created_at == created_at, models.Listing.id < listing_id),
+        ))
+    stmt = stmt.order_by(models.Listing.created_at.desc(), models.Listing.id.desc()).limit(limit)
+    return db.execute(stmt).scalars().all()
+
+
+def touch_open_listing(db: Session, listing_id: int) -> bool:
+    # Bump the version of a listing that is still open. Taken before a bid is inserted: it
+    # serializes with a concurrent ACCEPT (row lock), which then fails its version check.
+    result = db.execute(
+        update(models.Listing)
+        .where(models.Listing.id == listing_id, models.Listing.status == "open")
+        .values(version=models.Listing.version + 1)
+    )
+    return result.rowcount == 1
+
+
+def accept_bid(db: Session, listing_id: int, bid_id: int, version: int) -> bool:
+    # Close the listing only if nobody changed it since it was read (another ACCEPT, a new bid,
+    # the deadline sweep), then accept the bid and reject the rest in one UPDATE.
+    # False means the caller lost the race and nothing was written.
+    listing = models.Listing
+    closed = db.execute(
+        update(listing)
+        .where(listing.id == listing_id, listing.status.in_(("open", "expired")), listing.version == version)
+        .values(status="closed", version=listing.version + 1, closed_at=datetime.utcnow())
+    )
+    if closed.rowcount != 1:
+        return False
+    db.execute(
+        update(models.Bid)
+        .where(models.Bid.listing_id == listing_id, models.Bid.status == "placed")
+        .values(status=case((models.Bid.id == bid_id, "accepted"), else_="rejected"))
+    )
+    _finish(db)
+    return True
+
+
+def list_open_deadlines(db: Session) -> List[tuple]:
+    stmt = select(models.Listing.id, models.Listing.deadline).where(
+        models.Listing.status == "open",
+        models.Listing.deadline.is_not(None),
+    )
+    return db.execute(stmt).all()
+
+
+def due_listing_ids(db: Session, now: datetime, limit: int) -> List[int]:
+    stmt = (
+        select(models.Listing.id)
+        .where(models.Listing.status == "open", models.Listing.deadline <= now)
+        .order_by(models.Listing.deadline)
+        .limit(limit)
+    )
+    return db.execute(stmt).scalars().all()
+
+
+def expire_listings(db: Session, listing_ids: List[int]) -> List[tuple]:
+    # Batched close of listings whose deadline passed; only rows still open are touched, so
+    # concurrent sweeps or an ACCEPT in between never double-close. Returns the rows expired.
+    if not listing_ids:
+        return []
+    stmt = (
+        update(models.Listing)
+        .where(models.Listing.id.in_(listing_ids), models.Listing.status == "open")
+        .values(status="expired", version=models.Listing.version + 1, closed_at=datetime.utcnow())
+        .returning(models.Listing.id, models.Listing.seller_id, models.Listing.commodity, models.Listing.location, models.Listing.unit)
+        .execution_options(synchronize_session=False)
+    )
+    rows = db.execute(stmt).all()
+    _finish(db)
+    return rows
+
+
+def best_bids_for_listings(db: Session, listing_ids: List[int]) -> dict:
+    # listing_id -> best placed bid (price, then quantity, then earliest)
+    if not listing_ids:
+        return {}
+    stmt = (
+        select(models.Bid)
+        .where(models.Bid.listing_id.in_(listing_ids), models.Bid.status == "placed")
+        .order_by(models.Bid.listing_id, models.Bid.price_per_unit.desc(), models.Bid.quantity.desc(), models.Bid.created_at, models.Bid.id)
+    )
+    best = {}
+    for bid in db.execute(stmt).scalars():
+        best.setdefault(bid.listing_id, bid)
+    return best
+
+
+def top_bids(db: Session, listing_id: int, limit: int) -> List[tuple]:
+    # (bid id, price, quantity, created_at, buyer phone) of the best placed bids, best first
+    stmt = (
+        select(models.Bid.id, models.Bid.price_per_unit, models.Bid.quantity, models.Bid.created_at, models.User.phone)
+        .join(models.User, models.User.id == models.Bid.buyer_id)
+        .where(models.Bid.listing_id == listing_id, models.Bid.status == "placed")
+        .order_by(models.Bid.price_per_unit.desc(), models.Bid.quantity.desc(), models.Bid.created_at, models.Bid.id)
+        .limit(limit)
+    )
+    return db.execute(stmt).all()
+
+
+def get_phones_by_user_ids(db: Session, user_ids: List[int]) -> dict:
+    if not user_ids:
+        return {}
+    stmt = select(models.User.id, models.User.phone).where(models.User.id.in_(user_ids))
+    return dict(db.execute(stmt).all())
 
 
 def create_bid(db: Session, listing_id: int, buyer_id: int, price_per_unit: float, quantity: float, note: Optional[str]) -> models.Bid:
@@ -129,10 +351,7 @@ def create_bid(db: Session, listing_id: int, buyer_id: int, price_per_unit: floa
         note=note,
         status="placed",
     )
-    db.add(bid)
-    db.commit()
-    db.refresh(bid)
-    return bid
+    return _save(db, bid)
 
 
 def get_bid(db: Session, bid_id: int) -> Optional[models.Bid]:
@@ -140,17 +359,14 @@ def get_bid(db: Session, bid_id: int) -> Optional[models.Bid]:
     return db.execute(stmt).scalar_one_or_none()
 
 
-def set_bid_status(db: Session, bid: models.Bid, status: str) -> models.Bid:
-    bid.status = status
-    db.add(bid)
-    db.commit()
-    db.refresh(bid)
-    return bid
+def _not_suppressed():
+    # Skip numbers whose deliveries keep failing (see app/services/delivery.py)
+    return ~exists().where(models.RecipientHealth.phone == models.User.phone, models.RecipientHealth.suppressed == 1)
 
 
-def get_opted_in_buyers_for_listing(db: Session, listing: models.Listing) -> list[models.User]:
+def opted_in_buyers_stmt(listing: models.Listing):
     # buyers with matching commodity + region (use listing.location as region for MVP)
-    stmt = (
+    return (
         select(models.User)
         .join(models.OptIn, models.OptIn.user_id == models.User.id)
         .where(
@@ -158,16 +374,492 @@ def get_opted_in_buyers_for_listing(db: Session, listing: models.Listing) -> lis
             models.OptIn.active == 1,
             models.OptIn.commodity == listing.commodity.upper(),
             models.OptIn.region == listing.location.upper(),
+            _not_suppressed(),
         )
     )
-    return db.execute(stmt).scalars().all()
+
+
+def get_opted_in_buyers_for_listing(db: Session, listing: models.Listing) -> list[models.User]:
+    return db.execute(opted_in_buyers_stmt(listing)).scalars().all()
+
+
+def all_buyers_stmt():
+    return select(models.User).where(models.User.role == "buyer", models.User.status == "active", _not_suppressed())
 
 
 def get_all_buyers(db: Session) -> List[models.User]:
-    stmt = select(models.User).where(models.User.role == "buyer", models.User.status == "active")
-    return db.execute(stmt).scalars().all()
+    return db.execute(all_buyers_stmt()).scalars().all()
+
+
+def list_active_subscriptions(db: Session) -> list[tuple]:
+    # (phone, role, commodity, region) for every active opt-in; warms the in-memory subscription index
+    stmt = (
+        select(models.User.phone, models.User.role, models.OptIn.commodity, models.OptIn.region)
+        .join(models.OptIn, models.OptIn.user_id == models.User.id)
+        .where(models.OptIn.active == 1)
+    )
+    return db.execute(stmt).all()
 
 
 def get_user_by_id(db: Session, user_id: int) -> Optional[models.User]:
     stmt = select(models.User).where(models.User.id == user_id)
-    return db.execute(stmt).scalar_one_or_none()
\ No newline at end of file
+    return db.execute(stmt).scalar_one_or_none()
+
+
+def has_recent_bid_notification(db: Session, seller_phone: str, since: datetime) -> bool:
+    stmt = (
+        select(models.BidNotification.id)
+        .where(models.BidNotification.seller_phone == seller_phone, models.BidNotification.created_at >= since)
+        .limit(1)
+    )
+    return db.execute(stmt).first() is not None
+
+
+def add_bid_notification(db: Session, **fields) -> models.BidNotification:
+    return _save(db, models.BidNotification(**fields))
+
+
+def count_pending_bid_notifications(db: Session, seller_phone: str) -> int:
+    stmt = select(func.count()).where(
+        models.BidNotification.seller_phone == seller_phone,
+        models.BidNotification.delivered == 0,
+    )
+    return db.execute(stmt).scalar_one()
+
+
+def claim_pending_bid_notifications(db: Session, seller_phone: str) -> List[tuple]:
+    # Mark a seller's pending notifications delivered and return them; concurrent flushers
+    # each get a disjoint set, so a digest is never sent twice.
+    stmt = (
+        update(models.BidNotification)
+        .where(models.BidNotification.seller_phone == seller_phone, models.BidNotification.delivered == 0)
+        .values(delivered=1)
+        .returning(
+            models.BidNotification.listing_id,
+            models.BidNotification.bid_id,
+            models.BidNotification.buyer_phone,
+            models.BidNotification.price_per_unit,
+            models.BidNotification.quantity,
+            models.BidNotification.unit,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    rows = db.execute(stmt).all()
+    _finish(db)
+    return rows
+
+
+def sellers_with_due_bid_notifications(db: Session, oldest_before: datetime) -> List[str]:
+    stmt = (
+        select(models.BidNotification.seller_phone)
+        .where(models.BidNotification.delivered == 0)
+        .group_by(models.BidNotification.seller_phone)
+        .having(func.min(models.BidNotification.created_at) <= oldest_before)
+    )
+    return db.execute(stmt).scalars().all()
+
+
+def delete_delivered_bid_notifications(db: Session, created_before: datetime) -> int:
+    result = db.execute(
+        delete(models.BidNotification)
+        .where(models.BidNotification.delivered == 1, models.BidNotification.created_at < created_before)
+        .execution_options(synchronize_session=False)
+    )
+    _finish(db)
+    return result.rowcount
+
+
+def add_delivery_events(db: Session, rows: List[dict]) -> None:
+    if rows:
+        db.execute(insert(models.DeliveryEvent), rows)
+    _finish(db)
+
+
+def get_recipient_health(db: Session, phones: List[str]) -> dict:
+    stmt = select(models.RecipientHealth).where(models.RecipientHealth.phone.in_(phones))
+    return {row.phone: row for row in db.execute(stmt).scalars()}
+
+
+def save_recipient_health(db: Session, updated: List[dict], created: List[dict]) -> None:
+    # Two executemany round trips for a whole batch of receipts
+    if updated:
+        db.execute(
+            update(models.RecipientHealth)
+            .where(models.RecipientHealth.phone == bindparam("b_phone"))
+            .values(
+                delivered=bindparam("delivered"),
+                failed=bindparam("failed"),
+                consecutive_failures=bindparam("consecutive_failures"),
+                last_error_code=bindparam("last_error_code"),
+                suppressed=bindparam("suppressed"),
+                updated_at=bindparam("updated_at"),
+            )
+            .execution_options(synchronize_session=False),
+            [dict(row, b_phone=row["phone"]) for row in updated],
+        )
+    if created:
+        db.execute(insert(models.RecipientHealth), created)
+    _finish(db)
+
+
+def list_suppressed_phones(db: Session) -> List[str]:
+    stmt = select(models.RecipientHealth.phone).where(models.RecipientHealth.suppressed == 1)
+    return db.execute(stmt).scalars().all()
+
+
+def set_recipient_suppressed(db: Session, phone: str, suppressed: bool) -> int:
+    result = db.execute(
+        update(models.RecipientHealth)
+        .where(models.RecipientHealth.phone == phone)
+        .values(suppressed=1 if suppressed else 0, consecutive_failures=0, updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    _finish(db)
+    return result.rowcount
+
+
+def add_broadcast(db: Session, preview: str, recipients: int, sent: int, failed: int, messages: List[tuple]) -> int:
+    # messages: (wamid, recipient) for every accepted send
+    broadcast_id = db.execute(
+        insert(models.Broadcast)
+        .values(preview=preview, recipients=recipients, sent=sent, failed=failed, created_at=datetime.utcnow())
+        .returning(models.Broadcast.id)
+    ).scalar_one()
+    if messages:
+        db.execute(
+            insert(models.BroadcastMessage),
+            [{"wamid": wamid, "broadcast_id": broadcast_id, "recipient": phone} for wamid, phone in messages],
+        )
+    _finish(db)
+    return broadcast_id
+
+
+def broadcast_delivery_rates(db: Session, limit: int) -> List[tuple]:
+    # Most recent broadcasts with distinct delivered / read / failed receipts
+    recent = select(models.Broadcast).order_by(models.Broadcast.id.desc()).limit(limit).subquery()
+    event = models.DeliveryEvent
+
+    def _count(*statuses):
+        return func.count(func.distinct(case((event.status.in_(statuses), event.wamid))))
+
+    stmt = (
+        select(
+            recent.c.id,
+            recent.c.created_at,
+            recent.c.preview,
+            recent.c.recipients,
+            recent.c.sent,
+            recent.c.failed,
+            _count("delivered", "read").label("delivered"),
+            _count("read").label("read"),
+            _count("failed").label("undelivered"),
+        )
+        .select_from(recent)
+        .outerjoin(models.BroadcastMessage, models.BroadcastMessage.broadcast_id == recent.c.id)
+        .outerjoin(event, event.wamid == models.BroadcastMessage.wamid)
+        .group_by(recent.c.id, recent.c.created_at, recent.c.preview, recent.c.recipients, recent.c.sent, recent.c.failed)
+        .order_by(recent.c.id.desc())
+    )
+    return db.execute(stmt).all()
+
+
+def delete_old_delivery_records(db: Session, created_before: datetime) -> int:
+    old = select(models.Broadcast.id).where(models.Broadcast.created_at < created_before)
+    db.execute(delete(models.BroadcastMessage).where(models.BroadcastMessage.broadcast_id.in_(old)).execution_options(synchronize_session=False))
+    db.execute(delete(models.Broadcast).where(models.Broadcast.created_at < created_before).execution_options(synchronize_session=False))
+    result = db.execute(
+        delete(models.DeliveryEvent).where(models.DeliveryEvent.created_at < created_before).execution_options(synchronize_session=False)
+    )
+    _finish(db)
+    return result.rowcount
+
+
+def get_inbound_rate_limits(db: Session, phones: List[str]) -> dict:
+    stmt = select(models.InboundRateLimit).where(models.InboundRateLimit.phone.in_(phones))
+    return {row.phone: (row.tokens, row.updated, row.cooldown_until) for row in db.execute(stmt).scalars()}
+
+
+def save_inbound_rate_limits(db: Session, updated: List[dict], created: List[dict]) -> None:
+    if updated:
+        db.execute(
+            update(models.InboundRateLimit)
+            .where(models.InboundRateLimit.phone == bindparam("b_phone"))
+            .values(tokens=bindparam("tokens"), updated=bindparam("updated"), cooldown_until=bindparam("cooldown_until"))
+            .execution_options(synchronize_session=False),
+            [dict(row, b_phone=row["phone"]) for row in updated],
+        )
+    if created:
+        db.execute(insert(models.InboundRateLimit), created)
+    _finish(db)
+
+
+def add_outbox_messages(db: Session, rows: List[dict]) -> None:
+    # rows: recipient, body, priority, broadcast_id; one executemany INSERT
+    if rows:
+        now = datetime.utcnow()
+        db.execute(
+            insert(models.OutboundMessage),
+            [dict(row, status="pending", attempts=0, visible_at=now, created_at=now) for row in rows],
+        )
+    _finish(db)
+
+
+def claim_outbox_messages(db: Session, priorities: Iterable[int], limit: int, visibility_timeout: float) -> List[tuple]:
+    # One conditional UPDATE ... RETURNING for the whole batch. Rows another sender claimed in the
+    # meantime no longer match the WHERE and are skipped; a sender that dies leaves its rows
+    # 'sending' until the visibility timeout passes. A row waits while an older one to the same
+    # recipient in its lane is backing off or being sent, so a retry is never overtaken.
+    out = models.OutboundMessage
+    older = aliased(models.OutboundMessage)
+    now = datetime.utcnow()
+    held = (
+        select(older.id)
+        .where(
+            older.recipient == out.recipient,
+            older.priority == out.priority,
+            older.id < out.id,
+            older.status.in_(("pending", "sending")),
+            older.visible_at > now,
+        )
+        .exists()
+    )
+    claimable = and_(out.status.in_(("pending", "sending")), out.visible_at <= now, out.priority.in_(list(priorities)), ~held)
+    candidates = select(out.id).where(claimable).order_by(out.priority, out.id).limit(limit)
+    ids = db.execute(candidates).scalars().all()
+    if not ids:
+        return []
+    rows = db.execute(
+        update(out)
+        .where(out.id.in_(ids), claimable)
+        .values(status="sending", attempts=out.attempts + 1, visible_at=now + timedelta(seconds=visibility_timeout))
+        .returning(out.id, out.recipient, out.body, out.priority, out.broadcast_id, out.attempts)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.commit()
+    return sorted(rows, key=lambda r: r.id)
+
+
+def finish_outbox_messages(db: Session, sent: List[dict], failed: List[dict], released: List[dict]) -> None:
+    # sent: b_id, wamid, sent_at; failed: b_id, status (pending | dead), visible_at, last_error;
+    # released: b_id, visible_at (claimed but not attempted, so the attempt is given back)
+    # Core table, not the ORM entity: executemany with a WHERE on b_id (ORM bulk UPDATE wants the PK)
+    out = models.OutboundMessage.__table__
+    if sent:
+        db.execute(
+            update(out)
+            .where(out.c.id == bindparam("b_id"))
+            .values(status="sent", wamid=bindparam("wamid"), sent_at=bindparam("sent_at"), last_error=None),
+            sent,
+        )
+    if failed:
+        db.execute(
+            update(out)
+            .where(out.c.id == bindparam("b_id"))
+            .values(status=bindparam("status"), visible_at=bindparam("visible_at"), last_error=bindparam("last_error")),
+            failed,
+        )
+    if released:
+        db.execute(
+            update(out)
+            .where(out.c.id == bindparam("b_id"))
+            .values(status="pending", visible_at=bindparam("visible_at"), attempts=out.c.attempts - 1),
+            released,
+        )
+    _finish(db)
+
+
+def add_broadcast_results(db: Session, messages: List[dict], counts: Dict[int, tuple]) -> None:
+    # messages: wamid, broadcast_id, recipient; counts: broadcast id -> (sent, failed) to add
+    if messages:
+        db.execute(insert(models.BroadcastMessage), messages)
+    if counts:
+        broadcasts = models.Broadcast.__table__
+        db.execute(
+            update(broadcasts)
+            .where(broadcasts.c.id == bindparam("b_id"))
+            .values(sent=broadcasts.c.sent + bindparam("b_sent"), failed=broadcasts.c.failed + bindparam("b_failed")),
+            [{"b_id": bid, "b_sent": s, "b_failed": f} for bid, (s, f) in counts.items()],
+        )
+    _finish(db)
+
+
+def outbox_stats(db: Session) -> Dict[str, Dict[int, int]]:
+    out = models.OutboundMessage
+    stats: Dict[str, Dict[int, int]] = {}
+    for status, priority, count in db.execute(select(out.status, out.priority, func.count()).group_by(out.status, out.priority)):
+        stats.setdefault(status, {})[priority] = count
+    return stats
+
+
+def requeue_dead_outbox(db: Session) -> int:
+    out = models.OutboundMessage
+    result = db.execute(
+        update(out).where(out.status == "dead").values(status="pending", attempts=0, visible_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    _finish(db)
+    return result.rowcount
+
+
+def delete_sent_outbox(db: Session, sent_before: datetime) -> int:
+    out = models.OutboundMessage
+    result = db.execute(
+        delete(out).where(out.status == "sent", out.sent_at < sent_before).execution_options(synchronize_session=False)
+    )
+    _finish(db)
+    return result.rowcount
+
+
+def _move_rows(db: Session, source, archive, condition, archived_at: datetime) -> int:
+    # INSERT ... SELECT into the archive table, then DELETE the same rows from the hot table
+    columns = list(source.__table__.columns)
+    db.execute(
+        insert(archive).from_select(
+            [c.name for c in columns] + ["archived_at"], select(*columns, literal(archived_at)).where(condition)
+        )
+    )
+    result = db.execute(delete(source).where(condition).execution_options(synchronize_session=False))
+    return result.rowcount
+
+
+def archivable_listing_ids(db: Session, closed_before: datetime, limit: int) -> List[int]:
+    # Closed (accepted) and expired listings, aged by when they stopped taking bids. Rows from
+    # before closed_at existed fall back to the deadline, then to the creation time.
+    listing = models.Listing
+    closed_at = func.coalesce(listing.closed_at, listing.deadline, listing.created_at)
+    stmt = (
+        select(listing.id)
+        .where(listing.status.in_(("closed", "expired")), closed_at < closed_before)
+        .order_by(models.Listing.id)
+        .limit(limit)
+    )
+    return db.execute(stmt).scalars().all()
+
+
+def archive_listings(db: Session, listing_ids: List[int]) -> tuple:
+    # Listings and all their bids move together; returns (listings, bids) moved
+    now = datetime.utcnow()
+    bids = _move_rows(db, models.Bid, models.ArchivedBid, models.Bid.listing_id.in_(listing_ids), now)
+    listings = _move_rows(db, models.Listing, models.ArchivedListing, models.Listing.id.in_(listing_ids), now)
+    _finish(db)
+    return listings, bids
+
+
+def delete_idle_session_states(db: Session, updated_before: datetime, limit: int) -> int:
+    # Bounded variant of delete_stale_session_states for the archival job
+    ids = db.execute(
+        select(models.SessionState.id).where(models.SessionState.updated_at < updated_before).limit(limit)
+    ).scalars().all()
+    if not ids:
+        return 0
+    result = db.execute(
+        delete(models.SessionState).where(models.SessionState.id.in_(ids)).execution_options(synchronize_session=False)
+    )
+    _finish(db)
+    return result.rowcount
+
+
+def export_listings_stmt():
+    seller = models.User
+    return (
+        select(
+            models.Listing.id,
+            seller.phone.label("seller"),
+            models.Listing.commodity,
+            models.Listing.quantity,
+            models.Listing.unit,
+            models.Listing.quality,
+            models.Listing.location,
+            models.Listing.min_price,
+            models.Listing.deadline,
+            models.Listing.status,
+            models.Listing.created_at,
+        )
+        .join(seller, seller.id == models.Listing.seller_id)
+        .order_by(models.Listing.id)
+    )
+
+
+def export_bids_stmt():
+    buyer = models.User
+    return (
+        select(
+            models.Bid.id,
+            models.Bid.listing_id,
+            buyer.phone.label("buyer"),
+            models.Bid.price_per_unit,
+            models.Bid.quantity,
+            models.Bid.status,
+            models.Bid.created_at,
+        )
+        .join(buyer, buyer.id == models.Bid.buyer_id)
+        .order_by(models.Bid.id)
+    )
+
+
+def export_opt_ins_stmt():
+    return (
+        select(
+            models.OptIn.id,
+            models.User.phone,
+            models.OptIn.commodity,
+            models.OptIn.region,
+            models.OptIn.active,
+            models.OptIn.created_at,
+        )
+        .join(models.User, models.User.id == models.OptIn.user_id)
+        .order_by(models.OptIn.id)
+    )
+
+
+def set_users_role(db: Session, phones: List[str], role: str) -> int:
+    result = db.execute(
+        update(models.User)
+        .where(models.User.phone.in_(phones), models.User.role != role)
+        .values(role=role)
+        .execution_options(synchronize_session=False)
+    )
+    _finish(db)
+    return result.rowcount
+
+
+def add_listings(db: Session, rows: List[dict]) -> List[tuple]:
+    # Bulk variant of create_listing: one executemany INSERT, returns (id, commodity, location, deadline)
+    if not rows:
+        return []
+    now = datetime.utcnow()
+    listing = models.Listing
+    created = db.execute(
+        insert(listing).returning(listing.id, listing.commodity, listing.location, listing.deadline, sort_by_parameter_order=True),
+        [dict(row, status="open", version=0, created_at=now) for row in rows],
+    ).all()
+    _finish(db)
+    return created
+
+
+def add_opt_ins(db: Session, keys: List[tuple]) -> int:
+    # Bulk variant of add_opt_in for (user_id, commodity, region) keys: existing rows are reactivated,
+    # missing ones inserted. Returns how many subscriptions became active.
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return 0
+    opt_in = models.OptIn
+    existing = {
+        (row.user_id, row.commodity, row.region): (row.id, row.active)
+        for row in db.execute(
+            select(opt_in.id, opt_in.user_id, opt_in.commodity, opt_in.region, opt_in.active)
+            .where(opt_in.user_id.in_({k[0] for k in keys}))
+        )
+    }
+    inactive = [existing[k][0] for k in keys if k in existing and not existing[k][1]]
+    missing = [k for k in keys if k not in existing]
+    if inactive:
+        db.execute(update(opt_in).where(opt_in.id.in_(inactive)).values(active=1).execution_options(synchronize_session=False))
+    if missing:
+        now = datetime.utcnow()
+        db.execute(
+            insert(opt_in),
+            [{"user_id": u, "commodity": c, "region": r, "active": 1, "created_at": now} for u, c, r in missing],
+        )
+    _finish(db)
+    return len(inactive) + len(missing)
@@ -1,19 +1,128 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+import threading
+from contextlib import contextmanager
+from typing import Callable, Optional
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker, declarative_base, Session
 from .config import settings
+from . import metrics, timing
+
+POOL_PROFILES = ("serverless", "pooled")
+
+
+def resolve_pool_profile(profile: Optional[str] = None) -> str:
+    # "auto": NullPool on serverless (rely on external pooling, e.g. Supabase pgbouncer),
+    # a persistent QueuePool for long-running servers.
+    profile = (profile or settings.db_pool_profile).lower()
+    if profile == "auto":
+        return "serverless" if settings.is_serverless else "pooled"
+    if profile not in POOL_PROFILES:
+        raise ValueError(f"unknown DB_POOL_PROFILE {profile!r}")
+    return profile
+
+
+def _sqlite_pragmas(dbapi_conn, connection_record) -> None:
+    cursor = dbapi_conn.cursor()
+    try:
+        if settings.sqlite_wal:
+            # WAL lets readers run alongside the single writer
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}")
+        cursor.execute(f"PRAGMA cache_size=-{int(settings.sqlite_cache_size_kb)}")
+        cursor.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}")
+    finally:
+        cursor.close()
+
+
+def build_engine(url: Optional[str] = None, profile: Optional[str] = None, sqlite_tuning: Optional[bool] = None) -> Engine:
+    url = url or settings.database_url
+    engine_kwargs = {"future": True}
+    if url.startswith("sqlite"):
+        engine_kwargs["connect_args"] = {"check_same_thread": False, "timeout": settings.sqlite_busy_timeout_ms / 1000}
+        eng = create_engine(url, **engine_kwargs)
+        tuning = settings.sqlite_tuning if sqlite_tuning is None else sqlite_tuning
+        if tuning and ":memory:" not in url and url not in ("sqlite://", "sqlite:///"):
+            event.listen(eng, "connect", _sqlite_pragmas)
+        return eng
+    if resolve_pool_profile(profile) == "serverless":
+        from sqlalchemy.pool import NullPool
+
+        engine_kwargs["poolclass"] = NullPool
+    else:
+        engine_kwargs.update(
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_recycle=settings.db_pool_recycle,
+            pool_timeout=settings.db_pool_timeout,
+            pool_pre_ping=settings.db_pool_pre_ping,
+        )
+    return create_engine(url, **engine_kwargs)
+
 
 is_sqlite = settings.database_url.startswith("sqlite")
-engine_kwargs = {"future": True}
 
-if is_sqlite:
-    engine_kwargs["connect_args"] = {"check_same_thread": False}
-else:
-    # In serverless environments, avoid persistent pools; rely on external pooling (e.g., Supabase pgbouncer)
-    from sqlalchemy.pool import NullPool
+# The engine is built on first use, not at import: cold serverless invocations that never touch
+# the DB (health checks, webhook verification) skip it entirely.
+_engine: Optional[Engine] = None
+_engine_lock = threading.Lock()
+_session_factory = sessionmaker(autoflush=False, autocommit=False, future=True)
+Base = declarative_base()
+
+
+def get_engine() -> Engine:
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = build_engine()
+                metrics.instrument_engine(_engine)
+                _session_factory.configure(bind=_engine)
+                timing.mark("engine built")
+    return _engine
+
+
+def SessionLocal(**kwargs) -> Session:
+    if _engine is None:
+        get_engine()
+    return _session_factory(**kwargs)
+
+
+def __getattr__(name: str):
+    # Keep `from app.db import engine` working while building it lazily
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(name)
+
+
+def in_unit_of_work(db: Session) -> bool:
+    return bool(db.info.get("unit_of_work"))
+
 
-    engine_kwargs["poolclass"] = NullPool
+@contextmanager
+def unit_of_work(db: Session):
+    # One transaction for the whole block: crud helpers only flush, we commit (or roll back) once at the end.
+    if in_unit_of_work(db):
+        yield db
+        return
+    db.info["unit_of_work"] = True
+    try:
+        yield db
+        db.commit()
+    except BaseException:
+        db.rollback()
+        db.info.pop("after_commit", None)
+        raise
+    finally:
+        db.info.pop("unit_of_work", None)
+    for callback in db.info.pop("after_commit", []):
+        callback()
 
-engine = create_engine(settings.database_url, **engine_kwargs)
 
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
-Base = declarative_base()
\ No newline at end of file
+def on_commit(db: Session, callback: Callable[[], None]) -> None:
+    # Update in-process caches/indexes only once the change is durable; outside a unit of work
+    # the crud helpers have already committed, so run right away.
+    if in_unit_of_work(db):
+        db.info.setdefault("after_commit", []).append(callback)
+    else:
+        callback()
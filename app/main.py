@@ -1,12 +1,74 @@
+import asyncio
+import sys
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import PlainTextResponse, JSONResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import PlainTextResponse, JSONResponse, StreamingResponse
+from . import metrics, timing
 from .config import settings
-from .db import Base, engine, SessionLocal
-from .services.flows import handle_text_message
 
-app = FastAPI(title="WhatsApp Bid App")
+# Only FastAPI and settings are imported eagerly. SQLAlchemy, httpx and the services load on first
+# use, so a cold serverless start that serves /health or webhook verification never pays for them.
+_workers = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _workers
+    _digest_task = None
+    # Serverless cold starts skip warming (the indexes fill lazily on first use), but a SQLite
+    # database still gets its schema
+    on_startup(warm=not settings.is_serverless)
+    if settings.webhook_mode == "queue":
+        from .services import inbound_queue
+
+        _workers = inbound_queue.WorkerPool(settings.queue_workers, settings.queue_poll_interval)
+        _workers.start()
+    if _deadline_scheduler_enabled():
+        from .services.deadlines import deadline_scheduler
+
+        if settings.is_serverless:
+            # on_startup() skipped warming, so load the open deadlines here
+            from .db import SessionLocal
+
+            db = SessionLocal()
+            try:
+                deadline_scheduler.load(db)
+            finally:
+                db.close()
+        deadline_scheduler.start()
+    if _outbox_sender_enabled():
+        from .services.outbox import outbox_sender
+
+        outbox_sender.start()
+    if not settings.is_serverless and settings.notify_digest_window > 0:
+        from .services.background import PeriodicTask
+        from .services.notify import flush_due
+
+        _digest_task = PeriodicTask("notify-digests", max(1.0, settings.notify_digest_window / 3), flush_due)
+        _digest_task.start()
+    timing.mark("startup complete")
+    try:
+        yield
+    finally:
+        if _digest_task is not None:
+            _digest_task.stop()
+        if "app.services.deadlines" in sys.modules:
+            sys.modules["app.services.deadlines"].deadline_scheduler.stop()
+        if _workers is not None:
+            _workers.stop()
+            _workers = None
+        if "app.services.dispatcher" in sys.modules:
+            sys.modules["app.services.dispatcher"].dispatcher.shutdown()
+        if "app.services.outbox" in sys.modules:
+            # After the producers: rows staged until now are picked up by the next instance otherwise
+            sys.modules["app.services.outbox"].outbox_sender.stop()
+        if "app.whatsapp" in sys.modules:
+            # Close pooled Graph API connections cleanly
+            sys.modules["app.whatsapp"].close_clients()
+
+
+app = FastAPI(title="WhatsApp Bid App", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,6 +80,8 @@ app.add_middleware(
 
 
 def get_db():
+    from .db import SessionLocal
+
     db = SessionLocal()
     try:
         yield db
@@ -25,16 +89,46 @@ def get_db():
         db.close()
 
 
-@app.on_event("startup")
-def on_startup():
+def on_startup(warm: bool = True):
     # Avoid writing to read-only FS on serverless. Only auto-create for local sqlite.
+    if settings.database_url.startswith("sqlite"):
+        from .db import get_engine
+        from .migrations import run_migrations
+
+        try:
+            run_migrations(get_engine())
+        except Exception:
+            # Suppress startup errors to keep webhook verification working
+            pass
+    if not warm:
+        return
+    from .db import SessionLocal
+    from .services.deadlines import deadline_scheduler
+    from .services.search import search_index
+    from .services.subscriptions import subscription_index
+
+    # Warm in-memory indexes; they also warm lazily on first use
+    db = SessionLocal()
     try:
-        from .config import settings as _s
-        if _s.database_url.startswith("sqlite"):
-            Base.metadata.create_all(bind=engine)
+        subscription_index.load(db)
+        search_index.load(db)
+        if _deadline_scheduler_enabled():
+            deadline_scheduler.load(db)
     except Exception:
-        # Suppress startup errors to keep webhook verification working
         pass
+    finally:
+        db.close()
+
+
+def _deadline_scheduler_enabled() -> bool:
+    if settings.deadline_scheduler_enabled is not None:
+        return settings.deadline_scheduler_enabled
+    return not settings.is_serverless
+
+
+def _outbox_sender_enabled() -> bool:
+    # Serverless instances freeze between requests; there /admin/cron/outbox drains the outbox
+    return settings.outbox_enabled is not False and not settings.is_serverless
 
 
 @app.get("/health")
@@ -56,47 +150,237 @@ def whatsapp_verify(request: Request):
 
 
 @app.post("/webhook/whatsapp")
-async def whatsapp_webhook(request: Request, db: Session = Depends(get_db)):
-    payload = await request.json()
-    # Parse messages: entry -> changes -> value -> messages
-    for entry in payload.get("entry", []):
-        for change in entry.get("changes", []):
-            value = change.get("value", {})
-            messages = value.get("messages", [])
-            for m in messages:
-                from_phone = m.get("from")
-                mtype = m.get("type")
-                if mtype == "text":
-                    text = m.get("text", {}).get("body", "")
-                    if from_phone:
-                        handle_text_message(db, from_phone, text)
-                elif mtype == "button":
-                    # Handle interactive button postbacks if used later
-                    text = m.get("button", {}).get("text", "")
-                    if from_phone:
-                        handle_text_message(db, from_phone, text)
-                elif mtype == "interactive":
-                    # List/Reply selections can be mapped to text commands
-                    interactive = m.get("interactive", {})
-                    button_reply = interactive.get("button_reply")
-                    list_reply = interactive.get("list_reply")
-                    text = None
-                    if button_reply:
-                        text = button_reply.get("title")
-                    if list_reply:
-                        text = list_reply.get("title")
-                    if text and from_phone:
-                        handle_text_message(db, from_phone, text)
+async def whatsapp_webhook(request: Request, db=Depends(get_db)):
+    try:
+        payload = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid json")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="invalid payload")
+    with metrics.span("webhook"):
+        return await _process_webhook(payload, db)
+
+
+async def _process_webhook(payload: dict, db):
+    from .services.dispatcher import DispatcherFull
+    from .services.webhook import process_payload_async
+
+    if settings.webhook_mode == "queue":
+        from .services import inbound_queue
+
+        # Ack fast: persist the raw payload and let the worker pool process it; the insert runs
+        # off the event loop
+        await asyncio.to_thread(inbound_queue.enqueue, db, payload)
+        return {"success": True, "queued": True}
+    try:
+        await process_payload_async(payload)
+    except DispatcherFull:
+        # Backpressure: Meta retries non-2xx deliveries later
+        raise HTTPException(status_code=503, detail="busy")
     return {"success": True}
 
 
-@app.post("/admin/init-db")
-def admin_init_db(request: Request):
+def _require_admin(request: Request) -> None:
     token = request.query_params.get("token") or request.headers.get("x-admin-token") or ""
     if not token or token != settings.admin_init_token:
         raise HTTPException(status_code=403, detail="forbidden")
+
+
+def _require_cron(request: Request) -> None:
+    # Accept the admin token or Vercel Cron's bearer secret
+    auth = request.headers.get("authorization") or ""
+    if settings.cron_secret and auth == f"Bearer {settings.cron_secret}":
+        return
+    _require_admin(request)
+
+
+@app.post("/admin/init-db")
+def admin_init_db(request: Request):
+    _require_admin(request)
+    from .db import Base, get_engine
+
     try:
-        Base.metadata.create_all(bind=engine)
+        Base.metadata.create_all(bind=get_engine())
         return {"ok": True}
     except Exception as exc:
-        return JSONResponse({"ok": False, "error": str(exc)}, status_code=500)
\ No newline at end of file
+        return JSONResponse({"ok": False, "error": str(exc)}, status_code=500)
+
+
+@app.post("/admin/migrate")
+def admin_migrate(request: Request):
+    # Creates missing tables and applies pending schema migrations (indexes, columns) to existing databases
+    _require_admin(request)
+    from .db import get_engine
+    from .migrations import run_migrations
+
+    try:
+        return {"ok": True, "applied": run_migrations(get_engine())}
+    except Exception as exc:
+        return JSONResponse({"ok": False, "error": str(exc)}, status_code=500)
+
+
+@app.get("/admin/explain")
+def admin_explain(request: Request):
+    _require_admin(request)
+    from .db import get_engine
+    from .migrations import explain_hot_queries
+
+    return {"queries": explain_hot_queries(get_engine())}
+
+
+@app.api_route("/admin/cron/deadlines", methods=["GET", "POST"])
+def admin_cron_deadlines(request: Request, db=Depends(get_db)):
+    # Expire open listings whose deadline passed (for serverless deploys without the in-process scheduler)
+    _require_cron(request)
+    from .services.deadlines import sweep_due
+
+    return {"expired": sweep_due(db)}
+
+
+@app.api_route("/admin/cron/notifications", methods=["GET", "POST"])
+def admin_cron_notifications(request: Request, db=Depends(get_db)):
+    # Send bid digests whose window elapsed (serverless deploys have no background thread)
+    _require_cron(request)
+    from .services.notify import flush_due
+
+    return {"digests_sent": flush_due(db)}
+
+
+@app.api_route("/admin/cron/outbox", methods=["GET", "POST"])
+def admin_cron_outbox(request: Request, budget: float = 20.0):
+    # Send due outbox rows, replies first, for up to `budget` seconds (serverless deploys)
+    _require_cron(request)
+    from .services import outbox
+
+    return {"drained": outbox.drain(min(max(budget, 1.0), 55.0))}
+
+
+@app.api_route("/admin/cron/archive", methods=["GET", "POST"])
+def admin_cron_archive(request: Request, budget: float = 20.0, db=Depends(get_db)):
+    # Move old closed and expired listings and their bids to the archive tables, and delete abandoned
+    # conversation rows. Stops after `budget` seconds; call again while "done" is false.
+    _require_cron(request)
+    from .services.archive import run
+
+    return run(db, budget_seconds=min(max(budget, 1.0), 55.0)).as_dict()
+
+
+@app.get("/admin/queue")
+def admin_queue_stats(request: Request, db=Depends(get_db)):
+    _require_admin(request)
+    from .services import inbound_queue
+
+    return {"mode": settings.webhook_mode, "counts": inbound_queue.stats(db)}
+
+
+@app.post("/admin/queue/requeue-dead")
+def admin_queue_requeue_dead(request: Request, db=Depends(get_db)):
+    _require_admin(request)
+    from .services import inbound_queue
+
+    return {"requeued": inbound_queue.requeue_dead(db)}
+
+
+@app.get("/admin/outbox")
+def admin_outbox_stats(request: Request, db=Depends(get_db)):
+    _require_admin(request)
+    from .services import outbox
+
+    return {"enabled": outbox.enabled(), "counts": outbox.stats(db)}
+
+
+@app.post("/admin/outbox/requeue-dead")
+def admin_outbox_requeue_dead(request: Request, db=Depends(get_db)):
+    _require_admin(request)
+    from . import crud
+
+    return {"requeued": crud.requeue_dead_outbox(db)}
+
+
+@app.get("/admin/dispatcher")
+def admin_dispatcher_stats(request: Request):
+    _require_admin(request)
+    from .services.dispatcher import dispatcher
+
+    return dispatcher.stats()
+
+
+@app.get("/admin/limits")
+def admin_limits_stats(request: Request):
+    _require_admin(request)
+    from .services.inbound_limits import inbound_limiter
+
+    return inbound_limiter.stats()
+
+
+@app.get("/admin/dedup")
+def admin_dedup_stats(request: Request):
+    _require_admin(request)
+    from .services.dedup import deduper
+
+    return deduper.stats()
+
+
+@app.get("/admin/delivery")
+def admin_delivery(request: Request, limit: int = 20, db=Depends(get_db)):
+    # Delivery / read rates of recent broadcasts and how many recipients are suppressed
+    _require_admin(request)
+    from .services.delivery import delivery_report
+
+    return delivery_report(db, limit=min(max(limit, 1), 200))
+
+
+@app.post("/admin/delivery/unsuppress")
+def admin_delivery_unsuppress(request: Request, phone: str, db=Depends(get_db)):
+    _require_admin(request)
+    from . import crud
+    from .services.delivery import recipient_health
+
+    updated = crud.set_recipient_suppressed(db, phone, False)
+    recipient_health.apply([], [phone])
+    return {"updated": updated}
+
+
+@app.get("/admin/export/{table}")
+def admin_export(request: Request, table: str, format: str = "ndjson"):
+    # Streams listings, bids or opt_ins as NDJSON or CSV with constant memory
+    _require_admin(request)
+    from .services.bulk import EXPORTS, MEDIA_TYPES, stream_export
+
+    if table not in EXPORTS:
+        raise HTTPException(status_code=404, detail="unknown table")
+    if format not in MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+    return StreamingResponse(
+        stream_export(table, format),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{table}.{format}"'},
+    )
+
+
+@app.post("/admin/import")
+async def admin_import(request: Request):
+    # NDJSON body of listing / opt_in records (see app/services/bulk.py), written in batches
+    _require_admin(request)
+    from .services.bulk import import_ndjson
+
+    return await import_ndjson(request.stream())
+
+
+@app.get("/admin/startup")
+def admin_startup(request: Request):
+    # Cold-start timeline and which heavy modules this instance has loaded so far
+    _require_admin(request)
+    return timing.report()
+
+
+@app.get("/metrics")
+def metrics_endpoint(request: Request):
+    # Prometheus text format; scrape with ?token=<ADMIN_INIT_TOKEN> or the x-admin-token header
+    _require_admin(request)
+    if not settings.metrics_enabled:
+        raise HTTPException(status_code=404, detail="metrics disabled")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+timing.mark("app imported")
@@ -0,0 +1,229 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+from .config import settings
+
+# Process-local Prometheus-style metrics. Stdlib only, so importing this stays cheap on cold starts.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+COMMANDS = ("HELP", "LISTINGS", "JOIN", "SUBSCRIBE", "SEARCH", "LIST", "BIDS", "BID", "ACCEPT")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(str(labels[n]) for n in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(str(labels[n]) for n in self.label_names), 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> (per-bucket counts incl. +Inf, sum, count)
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels[n]) for n in self.label_names)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels) -> int:
+        series = self._series.get(tuple(str(labels[n]) for n in self.label_names))
+        return series[2] if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, n) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, c in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += c
+                    le = "+Inf" if bound == float("inf") else repr(float(bound))
+                    bucket_labels = _labels(self.label_names, key, f'le="{le}"')
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.label_names, key)} {n}")
+        return lines
+
+
+command_seconds = Histogram("wa_command_duration_seconds", "Inbound command handling time, including replies sent after commit.", ["command"])
+command_db_queries = Histogram("wa_command_db_queries", "DB queries issued while handling one inbound message.", ["command"], QUERY_COUNT_BUCKETS)
+command_db_seconds = Histogram("wa_command_db_seconds", "DB time spent while handling one inbound message.", ["command"])
+db_queries_total = Counter("wa_db_queries_total", "SQL statements executed.")
+db_query_seconds_total = Counter("wa_db_query_seconds_total", "Time spent executing SQL statements.")
+graph_seconds = Histogram("wa_graph_request_duration_seconds", "Graph API request latency.", ["status"])
+graph_responses_total = Counter("wa_graph_responses_total", "Graph API responses by status code.", ["status"])
+inbound_limited_total = Counter("wa_inbound_limited_total", "Inbound messages refused by the per-sender limit or load shedding.", ["reason"])
+outbox_messages_total = Counter("wa_outbox_messages_total", "Outbox send attempts by lane and outcome.", ["lane", "result"])
+
+REGISTRY = (
+    command_seconds,
+    command_db_queries,
+    command_db_seconds,
+    db_queries_total,
+    db_query_seconds_total,
+    graph_seconds,
+    graph_responses_total,
+    inbound_limited_total,
+    outbox_messages_total,
+)
+
+# [queries, seconds] for the inbound message being handled on this thread/task
+_db_usage: ContextVar[Optional[list]] = ContextVar("wa_db_usage", default=None)
+# Mutable [label] so handlers can refine the command (e.g. "LIST step 3") once they know it
+_command: ContextVar[Optional[list]] = ContextVar("wa_command", default=None)
+
+
+def command_of(text: str) -> str:
+    word = (text or "").strip().split(maxsplit=1)[0].upper() if (text or "").strip() else ""
+    if word == "?":
+        return "HELP"
+    return word if word in COMMANDS else "OTHER"
+
+
+def set_command(label: str) -> None:
+    current = _command.get()
+    if current is not None:
+        current[0] = label
+
+
+@contextmanager
+def command_scope(command: str):
+    if not settings.metrics_enabled:
+        yield
+        return
+    label = [command]
+    usage = [0, 0.0]
+    tokens = (_command.set(label), _db_usage.set(usage))
+    started = time.perf_counter()
+    try:
+        with span("command") as sp:
+            yield
+            if sp is not None:
+                sp.set_attribute("wa.command", label[0])
+                sp.set_attribute("db.queries", usage[0])
+    finally:
+        command_seconds.observe(time.perf_counter() - started, command=label[0])
+        command_db_queries.observe(usage[0], command=label[0])
+        command_db_seconds.observe(usage[1], command=label[0])
+        _db_usage.reset(tokens[1])
+        _command.reset(tokens[0])
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info.setdefault("wa_query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    stack = conn.info.get("wa_query_started")
+    if not stack:
+        return
+    elapsed = time.perf_counter() - stack.pop()
+    db_queries_total.inc()
+    db_query_seconds_total.inc(elapsed)
+    usage = _db_usage.get()
+    if usage is not None:
+        usage[0] += 1
+        usage[1] += elapsed
+
+
+def instrument_engine(engine) -> None:
+    if not settings.metrics_enabled:
+        return
+    from sqlalchemy import event
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _on_graph_request(request) -> None:
+    request.extensions["wa_started"] = time.perf_counter()
+
+
+def _on_graph_response(response) -> None:
+    started = response.request.extensions.get("wa_started")
+    status = str(response.status_code)
+    graph_responses_total.inc(status=status)
+    if started is not None:
+        graph_seconds.observe(time.perf_counter() - started, status=status)
+
+
+def http_event_hooks() -> dict:
+    # Time to response headers, per status code, for every Graph API call (replies and broadcasts)
+    if not settings.metrics_enabled:
+        return {}
+    return {"request": [_on_graph_request], "response": [_on_graph_response]}
+
+
+_tracer = None
+
+
+def _get_tracer():
+    global _tracer
+    if _tracer is None:
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            _tracer = False
+        else:
+            _tracer = trace.get_tracer("whatsapp-bid")
+    return _tracer or None
+
+
+def span(name: str):
+    # OpenTelemetry span when TRACING_ENABLED and opentelemetry-api is installed; yields None otherwise
+    if not settings.tracing_enabled:
+        return nullcontext()
+    tracer = _get_tracer()
+    if tracer is None:
+        return nullcontext()
+    return tracer.start_as_current_span(name)
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,151 @@
+import argparse
+import json
+from datetime import datetime
+from typing import Callable, List, Tuple
+from sqlalchemy import inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from . import models
+from .db import Base
+
+
+# Schema changes to tables that already exist in deployed databases. New tables (and their
+# indexes) are created by Base.metadata.create_all; everything else goes here, append-only.
+def _create_indexes(*names: str) -> Callable[[Connection], None]:
+    def apply(conn: Connection) -> None:
+        for name in names:
+            index = _find_index(name)
+            index.create(bind=conn, checkfirst=True)
+
+    return apply
+
+
+def _add_column(table: str, column: str, ddl: str) -> Callable[[Connection], None]:
+    # Databases created after the model gained the column already have it
+    def apply(conn: Connection) -> None:
+        if column not in {c["name"] for c in inspect(conn).get_columns(table)}:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+    return apply
+
+
+def _drop_indexes(*names: str) -> Callable[[Connection], None]:
+    # Indexes superseded by a wider one; dropped from the models, so only present in older databases
+    def apply(conn: Connection) -> None:
+        for name in names:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+    return apply
+
+
+def _add_listing_closed_at(conn: Connection) -> None:
+    for table in ("listings", "listings_archive"):
+        _add_column(table, "closed_at", "TIMESTAMP")(conn)
+
+
+def _dedupe_opt_ins(conn: Connection) -> None:
+    # Keep the oldest row per (user, commodity, region), active if any duplicate was active
+    conn.execute(text(
+        "UPDATE opt_ins SET active = 1 WHERE id IN ("
+        " SELECT MIN(id) FROM opt_ins GROUP BY user_id, commodity, region HAVING MAX(active) = 1)"
+    ))
+    conn.execute(text(
+        "DELETE FROM opt_ins WHERE id NOT IN ("
+        " SELECT keep_id FROM (SELECT MIN(id) AS keep_id FROM opt_ins GROUP BY user_id, commodity, region) AS keep)"
+    ))
+    _create_indexes("uq_opt_ins_user_commodity_region")(conn)
+
+
+def _find_index(name: str):
+    for table in Base.metadata.tables.values():
+        for index in table.indexes:
+            if index.name == name:
+                return index
+    raise KeyError(name)
+
+
+MIGRATIONS: List[Tuple[str, Callable[[Connection], None]]] = [
+    (
+        "0001_hot_query_indexes",
+        _create_indexes(
+            "ix_users_role_status",
+            "ix_opt_ins_commodity_region_active",
+            "ix_listings_status_created_at",
+            "ix_listings_commodity_location_status",
+        ),
+    ),
+    ("0002_unique_opt_ins", _dedupe_opt_ins),
+    ("0003_listing_deadline_index", _create_indexes("ix_listings_status_deadline")),
+    ("0004_bid_ranking_index", _create_indexes("ix_bids_listing_status_price")),
+    ("0005_listing_version", _add_column("listings", "version", "INTEGER NOT NULL DEFAULT 0")),
+    ("0006_drop_opt_ins_user_index", _drop_indexes("ix_opt_ins_user_id_active")),
+    ("0007_drop_bids_listing_status_index", _drop_indexes("ix_bids_listing_id_status")),
+    ("0008_outbox_recipient_index", _create_indexes("ix_outbox_recipient_status")),
+    ("0009_listing_closed_at", _add_listing_closed_at),
+]
+
+
+def applied_migrations(conn: Connection) -> set:
+    return set(conn.execute(select(models.SchemaMigration.id)).scalars().all())
+
+
+def run_migrations(engine: Engine) -> List[str]:
+    # Idempotent: safe to run on every deploy and on fresh databases.
+    Base.metadata.create_all(bind=engine)
+    applied = []
+    with engine.begin() as conn:
+        done = applied_migrations(conn)
+    for migration_id, apply in MIGRATIONS:
+        if migration_id in done:
+            continue
+        with engine.begin() as conn:
+            apply(conn)
+            conn.execute(models.SchemaMigration.__table__.insert().values(id=migration_id, applied_at=datetime.utcnow()))
+        applied.append(migration_id)
+    return applied
+
+
+def _hot_queries() -> List[Tuple[str, object, str]]:
+    from . import crud
+
+    listing = models.Listing(commodity="MAIZE", location="NAIROBI")
+    return [
+        ("opted_in_buyers_for_listing", crud.opted_in_buyers_stmt(listing), "ix_opt_ins_commodity_region_active"),
+        ("open_listings_for_user", crud.open_listings_for_user_stmt(1), "uq_opt_ins_user_commodity_region"),
+        ("open_listings", crud.open_listings_stmt(), "ix_listings_status_created_at"),
+        ("bids_for_listing", select(models.Bid).where(models.Bid.listing_id == 1, models.Bid.status == "placed"), "ix_bids_listing_status_price"),
+        ("all_buyers", crud.all_buyers_stmt(), "ix_users_role_status"),
+    ]
+
+
+def explain_hot_queries(engine: Engine) -> List[dict]:
+    # EXPLAIN each hot query shape from crud.py and report whether the planner picked the expected index.
+    # Postgres may still prefer a seq scan on tiny tables; run against production-sized data.
+    prefix = "EXPLAIN QUERY PLAN " if engine.dialect.name == "sqlite" else "EXPLAIN "
+    report = []
+    with engine.connect() as conn:
+        for name, stmt, expected in _hot_queries():
+            sql = str(stmt.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+            rows = conn.execute(text(prefix + sql)).all()
+            plan = [" ".join(str(col) for col in row) for row in rows]
+            report.append({
+                "query": name,
+                "expected_index": expected,
+                "uses_index": any(expected in line for line in plan),
+                "plan": plan,
+            })
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Apply schema migrations")
+    parser.add_argument("--explain", action="store_true", help="print EXPLAIN plans for the hot queries")
+    args = parser.parse_args()
+    from .db import engine
+
+    print(json.dumps({"applied": run_migrations(engine)}))
+    if args.explain:
+        print(json.dumps(explain_hot_queries(engine), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 from datetime import datetime
 from typing import Optional
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Float, Text
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Float, Text, Index
 from sqlalchemy.orm import relationship
 from .db import Base
 
@@ -18,6 +18,10 @@ class User(Base):
     listings = relationship("Listing", back_populates="seller", cascade="all, delete-orphan")
     bids = relationship("Bid", back_populates="buyer", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ix_users_role_status", "role", "status"),
+    )
+
 
 class OptIn(Base):
     __tablename__ = "opt_ins"
@@ -30,6 +34,14 @@ class OptIn(Base):
 
     user = relationship("User", back_populates="opt_ins")
 
+    __table_args__ = (
+        # listing fan-out: commodity + region + active
+        Index("ix_opt_ins_commodity_region_active", "commodity", "region", "active"),
+        # one row per subscription; SUBSCRIBE is an upsert. Also serves a user's own subscriptions
+        # (LISTINGS) through its leading user_id
+        Index("uq_opt_ins_user_commodity_region", "user_id", "commodity", "region", unique=True),
+    )
+
 
 class Listing(Base):
     __tablename__ = "listings"
@@ -42,12 +54,25 @@ class Listing(Base):
     location = Column(String(128), nullable=False)
     min_price = Column(Float, nullable=True)
     deadline = Column(DateTime, nullable=True)
-    status = Column(String(16), nullable=False, default="open")  # open | closed
+    status = Column(String(16), nullable=False, default="open")  # open | expired (deadline passed, awaiting ACCEPT) | closed
+    # Bumped by every bid and status change; ACCEPT only succeeds against the version it read
+    version = Column(Integer, nullable=False, default=0, server_default="0")
     created_at = Column(DateTime, default=datetime.utcnow)
+    # When the listing stopped taking bids (expired or closed); archival ages listings by it
+    closed_at = Column(DateTime, nullable=True)
 
     seller = relationship("User", back_populates="listings")
     bids = relationship("Bid", back_populates="listing", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # open listings, newest first
+        Index("ix_listings_status_created_at", "status", "created_at"),
+        # open listings matching a commodity + region subscription
+        Index("ix_listings_commodity_location_status", "commodity", "location", "status"),
+        # deadline sweeps
+        Index("ix_listings_status_deadline", "status", "deadline"),
+    )
+
 
 class Bid(Base):
     __tablename__ = "bids"
@@ -63,6 +88,11 @@ class Bid(Base):
     listing = relationship("Listing", back_populates="bids")
     buyer = relationship("User", back_populates="bids")
 
+    __table_args__ = (
+        # a listing's bids by status, and best bids per listing (BIDS leaderboard cold load)
+        Index("ix_bids_listing_status_price", "listing_id", "status", "price_per_unit"),
+    )
+
 
 class SessionState(Base):
     __tablename__ = "session_states"
@@ -71,4 +101,159 @@ class SessionState(Base):
     flow = Column(String(32), nullable=True)  # e.g., 'list'
     step = Column(Integer, nullable=True)
     data_json = Column(Text, nullable=True)  # JSON-encoded state data
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
\ No newline at end of file
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class InboundMessage(Base):
+    # Durable queue of raw webhook payloads (ack-fast mode)
+    __tablename__ = "inbound_queue"
+    id = Column(Integer, primary_key=True, index=True)
+    payload_json = Column(Text, nullable=False)
+    status = Column(String(16), nullable=False, default="pending")  # pending | processing | dead
+    attempts = Column(Integer, nullable=False, default=0)
+    visible_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class SeenMessage(Base):
+    # Inbound WhatsApp message ids (wamid) already processed; pruned after a TTL
+    __tablename__ = "seen_messages"
+    wamid = Column(String(128), primary_key=True)
+    seen_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+
+class SchemaMigration(Base):
+    # Applied migrations (see app/migrations.py)
+    __tablename__ = "schema_migrations"
+    id = Column(String(64), primary_key=True)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+
+class BidNotification(Base):
+    # Seller bid notifications; pending rows are coalesced into one digest per window
+    __tablename__ = "bid_notifications"
+    id = Column(Integer, primary_key=True, index=True)
+    seller_phone = Column(String(32), nullable=False)
+    listing_id = Column(Integer, nullable=False)
+    bid_id = Column(Integer, nullable=False)
+    buyer_phone = Column(String(32), nullable=True)
+    price_per_unit = Column(Float, nullable=False)
+    quantity = Column(Float, nullable=False)
+    unit = Column(String(32), nullable=True)
+    delivered = Column(Integer, nullable=False, default=0)  # 1 once sent (instantly or in a digest)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_bid_notifications_seller_delivered", "seller_phone", "delivered", "created_at"),
+    )
+
+
+class DeliveryEvent(Base):
+    # Delivery receipts from webhook `statuses` (sent | delivered | read | failed), pruned after a TTL
+    __tablename__ = "delivery_events"
+    id = Column(Integer, primary_key=True)
+    wamid = Column(String(128), nullable=False)
+    recipient = Column(String(32), nullable=True)
+    status = Column(String(10), nullable=False)
+    error_code = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+    __table_args__ = (
+        Index("ix_delivery_events_wamid_status", "wamid", "status"),
+    )
+
+
+class RecipientHealth(Base):
+    # Per-recipient delivery record; suppressed numbers are skipped by broadcasts
+    __tablename__ = "recipient_health"
+    phone = Column(String(32), primary_key=True)
+    delivered = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    consecutive_failures = Column(Integer, nullable=False, default=0)
+    last_error_code = Column(Integer, nullable=True)
+    suppressed = Column(Integer, nullable=False, default=0)  # 1 true, 0 false
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class Broadcast(Base):
+    # One fan-out (e.g. a new-listing announcement) and its send results
+    __tablename__ = "broadcasts"
+    id = Column(Integer, primary_key=True, index=True)
+    preview = Column(String(160), nullable=True)
+    recipients = Column(Integer, nullable=False, default=0)
+    sent = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class BroadcastMessage(Base):
+    # Outbound wamid -> broadcast, to join delivery receipts back to their broadcast
+    __tablename__ = "broadcast_messages"
+    wamid = Column(String(128), primary_key=True)
+    broadcast_id = Column(Integer, ForeignKey("broadcasts.id"), nullable=False, index=True)
+    recipient = Column(String(32), nullable=False)
+
+
+class InboundRateLimit(Base):
+    # Per-sender token bucket state when INBOUND_LIMIT_BACKEND=db (shared by serverless instances)
+    __tablename__ = "inbound_rate_limits"
+    phone = Column(String(32), primary_key=True)
+    tokens = Column(Float, nullable=False)
+    updated = Column(Float, nullable=False)  # epoch seconds
+    cooldown_until = Column(Float, nullable=False, default=0.0)  # no further cooldown replies before this
+
+
+class OutboundMessage(Base):
+    # Transactional outbox: sends written with the state change that caused them, delivered by the outbox sender
+    __tablename__ = "outbox"
+    id = Column(Integer, primary_key=True, index=True)
+    recipient = Column(String(32), nullable=False)
+    body = Column(Text, nullable=False)
+    priority = Column(Integer, nullable=False, default=0)  # 0 direct reply | 1 broadcast
+    broadcast_id = Column(Integer, nullable=True)
+    status = Column(String(16), nullable=False, default="pending")  # pending | sending | sent | dead
+    attempts = Column(Integer, nullable=False, default=0)
+    visible_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    wamid = Column(String(128), nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_outbox_status_priority_visible", "status", "priority", "visible_at"),
+        # per-recipient ordering check when claiming
+        Index("ix_outbox_recipient_status", "recipient", "status"),
+    )
+
+
+class ArchivedListing(Base):
+    # Closed and expired listings past ARCHIVE_AFTER_DAYS, moved out of the hot table (see app/services/archive.py)
+    __tablename__ = "listings_archive"
+    id = Column(Integer, primary_key=True)
+    seller_id = Column(Integer, nullable=False, index=True)
+    commodity = Column(String(64), nullable=False)
+    quantity = Column(Float, nullable=False)
+    unit = Column(String(32), nullable=False)
+    quality = Column(String(64), nullable=True)
+    location = Column(String(128), nullable=False)
+    min_price = Column(Float, nullable=True)
+    deadline = Column(DateTime, nullable=True)
+    status = Column(String(16), nullable=False)
+    version = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=True)
+    closed_at = Column(DateTime, nullable=True)
+    archived_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class ArchivedBid(Base):
+    __tablename__ = "bids_archive"
+    id = Column(Integer, primary_key=True)
+    listing_id = Column(Integer, nullable=False, index=True)
+    buyer_id = Column(Integer, nullable=False, index=True)
+    price_per_unit = Column(Float, nullable=False)
+    quantity = Column(Float, nullable=False)
+    note = Column(Text, nullable=True)
+    status = Column(String(16), nullable=False)
+    created_at = Column(DateTime, nullable=True)
+    archived_at = Column(DateTime, nullable=False, default=datetime.utcnow)
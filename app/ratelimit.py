@@ -0,0 +1,50 @@
+import threading
+import time
+
+
+def refill(tokens: float, updated: float, now: float, rate: float, capacity: float) -> float:
+    elapsed = now - updated
+    if elapsed <= 0:
+        return tokens
+    return min(capacity, tokens + elapsed * rate)
+
+
+class TokenBucket:
+    # Classic token bucket: `rate` tokens refill per second up to `capacity`.
+    def __init__(self, rate: float, capacity: float):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        if now > self._updated:
+            self._tokens = refill(self._tokens, self._updated, now, self.rate, self.capacity)
+            self._updated = now
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        # Take tokens now (possibly going into debt) and return how long the caller must wait.
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
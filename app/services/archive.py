@@ -0,0 +1,106 @@
+import argparse
+import json
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy.orm import Session
+from .. import crud
+from ..config import settings
+from ..db import SessionLocal, on_commit, unit_of_work
+from .leaderboard import bid_leaderboard
+from .sessions import session_store
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ArchiveReport:
+    listings: int = 0
+    bids: int = 0
+    sessions: int = 0
+    batches: int = 0
+    elapsed: float = 0.0
+    done: bool = False
+
+    @property
+    def rows(self) -> int:
+        return self.listings + self.bids + self.sessions
+
+    def as_dict(self) -> dict:
+        return {
+            "listings": self.listings,
+            "bids": self.bids,
+            "sessions": self.sessions,
+            "batches": self.batches,
+            "elapsed": round(self.elapsed, 3),
+            "rows_per_sec": round(self.rows / self.elapsed, 1) if self.elapsed > 0 else None,
+            "done": self.done,
+        }
+
+
+def _listings_batch(db: Session, cutoff: datetime, batch_size: int, report: ArchiveReport) -> int:
+    with unit_of_work(db):
+        ids = crud.archivable_listing_ids(db, cutoff, batch_size)
+        if not ids:
+            return 0
+        listings, bids = crud.archive_listings(db, ids)
+        on_commit(db, lambda: [bid_leaderboard.drop(i) for i in ids])
+    report.listings += listings
+    report.bids += bids
+    return len(ids)
+
+
+def _sessions_batch(db: Session, cutoff: datetime, batch_size: int, report: ArchiveReport) -> int:
+    deleted = crud.delete_idle_session_states(db, cutoff, batch_size)
+    report.sessions += deleted
+    return deleted
+
+
+def run(db: Session, budget_seconds: Optional[float] = None, batch_size: Optional[int] = None) -> ArchiveReport:
+    # Each batch is its own transaction and only touches rows still in the hot tables, so a run cut
+    # short (time budget, crash, deploy) loses nothing: the next run picks up where it stopped.
+    batch_size = batch_size or settings.archive_batch_size
+    now = datetime.utcnow()
+    cutoff = now - timedelta(days=settings.archive_after_days)
+    phases = (
+        (_listings_batch, cutoff),
+        (_sessions_batch, now - session_store.flow_ttl),
+    )
+    report = ArchiveReport()
+    started = time.monotonic()
+    out_of_time = False
+    for batch, phase_cutoff in phases:
+        while True:
+            if budget_seconds is not None and time.monotonic() - started >= budget_seconds:
+                out_of_time = True
+                break
+            moved = batch(db, phase_cutoff, batch_size, report)
+            if moved:
+                report.batches += 1
+            if moved < batch_size:
+                break
+        if out_of_time:
+            break
+    report.done = not out_of_time
+    report.elapsed = time.monotonic() - started
+    logger.info("archive run: %s", report.as_dict())
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Move closed and expired listings and their bids to archive tables")
+    parser.add_argument("--budget", type=float, help="stop after this many seconds (run again to resume)")
+    parser.add_argument("--batch-size", type=int, help=f"rows per batch (default {settings.archive_batch_size})")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        print(json.dumps(run(db, budget_seconds=args.budget, batch_size=args.batch_size).as_dict()))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import logging
+import threading
+from typing import Callable, Optional
+from ..db import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    # Runs fn(db) every `interval` seconds on a daemon thread with a fresh DB session.
+    def __init__(self, name: str, interval: float, fn: Callable):
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            db = SessionLocal()
+            try:
+                self.fn(db)
+            except Exception:
+                logger.exception("periodic task %s failed", self.name)
+            finally:
+                db.close()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
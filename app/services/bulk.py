@@ -0,0 +1,171 @@
+import asyncio
+import csv
+import io
+import json
+from datetime import datetime
+from typing import AsyncIterator, Iterator, List
+from .. import crud
+from ..config import settings
+from ..db import SessionLocal, on_commit, unit_of_work
+
+EXPORTS = {
+    "listings": crud.export_listings_stmt,
+    "bids": crud.export_bids_stmt,
+    "opt_ins": crud.export_opt_ins_stmt,
+}
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+MAX_IMPORT_ERRORS = 20
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"not JSON serializable: {type(value).__name__}")
+
+
+def stream_export(table: str, fmt: str) -> Iterator[str]:
+    # Server-side cursor (yield_per) and one chunk per fetched batch: memory stays flat however
+    # many rows the table has. Opens its own session since the response outlives the request's.
+    db = SessionLocal()
+    try:
+        result = db.execute(EXPORTS[table]().execution_options(yield_per=settings.bulk_batch_size))
+        columns = list(result.keys())
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        if fmt == "csv":
+            writer.writerow(columns)
+        for rows in result.partitions():
+            if fmt == "csv":
+                writer.writerows(rows)
+            else:
+                for row in rows:
+                    buf.write(json.dumps(dict(zip(columns, row)), default=_json_default))
+                    buf.write("\n")
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+        if buf.tell():
+            yield buf.getvalue()
+    finally:
+        db.close()
+
+
+class Importer:
+    # Seeds listings and opt-ins from NDJSON records, one transaction and a few executemany
+    # statements per batch instead of a commit per row:
+    #   {"type": "listing", "seller": "2547...", "commodity": "MAIZE", "quantity": 10, "unit": "KG",
+    #    "location": "NAIROBI", "quality": null, "min_price": null, "deadline": "2026-11-01T12:00:00"}
+    #   {"type": "opt_in", "phone": "2547...", "commodity": "MAIZE", "region": "NAIROBI"}
+    # Imported listings are not announced to subscribers.
+    def __init__(self):
+        self.listings: List[dict] = []
+        self.opt_ins: List[dict] = []
+        self.counts = {"listings": 0, "opt_ins": 0, "skipped": 0}
+        self.errors: List[dict] = []
+
+    def add(self, line_no: int, record: dict) -> bool:
+        # Returns True when a batch is full and should be flushed
+        try:
+            kind = record.get("type")
+            if kind == "listing":
+                self.listings.append({
+                    "seller": str(record["seller"]),
+                    "commodity": str(record["commodity"]).strip().upper(),
+                    "quantity": float(record["quantity"]),
+                    "unit": str(record["unit"]).strip().upper(),
+                    "location": str(record["location"]).strip().upper(),
+                    "quality": record.get("quality"),
+                    "min_price": float(record["min_price"]) if record.get("min_price") is not None else None,
+                    "deadline": datetime.fromisoformat(record["deadline"]) if record.get("deadline") else None,
+                })
+            elif kind == "opt_in":
+                self.opt_ins.append({
+                    "phone": str(record["phone"]),
+                    "commodity": str(record["commodity"]).strip().upper(),
+                    "region": str(record["region"]).strip().upper(),
+                })
+            else:
+                raise ValueError(f"unknown type {kind!r}")
+        except (AttributeError, KeyError, TypeError, ValueError) as exc:
+            self.skip(line_no, f"{type(exc).__name__}: {exc}")
+            return False
+        return len(self.listings) + len(self.opt_ins) >= settings.bulk_batch_size
+
+    def skip(self, line_no: int, error: str) -> None:
+        self.counts["skipped"] += 1
+        if len(self.errors) < MAX_IMPORT_ERRORS:
+            self.errors.append({"line": line_no, "error": error})
+
+    def flush(self) -> None:
+        listings, opt_ins = self.listings, self.opt_ins
+        self.listings, self.opt_ins = [], []
+        if not listings and not opt_ins:
+            return
+        from .deadlines import deadline_scheduler
+        from .listing_pages import listing_pages
+        from .search import IndexedListing, search_index
+        from .subscriptions import subscription_index
+
+        db = SessionLocal()
+        try:
+            # Users first, each lookup committing on its own (safe against concurrent creators)
+            sellers = list({row["seller"] for row in listings})
+            ids = crud.get_or_create_users(db, [row["phone"] for row in opt_ins])
+            ids.update(crud.get_or_create_users(db, sellers, default_role="seller"))
+            with unit_of_work(db):
+                crud.set_users_role(db, sellers, "seller")
+                rows = [dict({k: v for k, v in row.items() if k != "seller"}, seller_id=ids[row["seller"]]) for row in listings]
+                created = crud.add_listings(db, rows)
+                activated = crud.add_opt_ins(db, [(ids[row["phone"]], row["commodity"], row["region"]) for row in opt_ins])
+
+                def _publish() -> None:
+                    for (listing_id, commodity, location, deadline), row in zip(created, rows):
+                        listing_pages.invalidate(commodity, location)
+                        deadline_scheduler.schedule(listing_id, deadline)
+                        search_index.add(IndexedListing(
+                            listing_id, row["commodity"], row["quantity"], row["unit"], row["location"], row["quality"], row["min_price"]
+                        ))
+                    if opt_ins or sellers:
+                        subscription_index.invalidate()
+
+                on_commit(db, _publish)
+        finally:
+            db.close()
+        self.counts["listings"] += len(created)
+        self.counts["opt_ins"] += activated
+
+    def report(self) -> dict:
+        return dict(self.counts, errors=self.errors)
+
+
+async def import_ndjson(chunks: AsyncIterator[bytes]) -> dict:
+    # Reads the request body as it arrives; each full batch is written from a worker thread
+    importer = Importer()
+    line_no = 0
+
+    async def _lines():
+        pending = b""
+        async for chunk in chunks:
+            pending += chunk
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                yield line
+        if pending:
+            yield pending
+
+    async for line in _lines():
+        line_no += 1
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            importer.skip(line_no, f"invalid JSON: {exc}")
+            continue
+        if not isinstance(record, dict):
+            importer.skip(line_no, "expected a JSON object")
+            continue
+        if importer.add(line_no, record):
+            await asyncio.to_thread(importer.flush)
+    await asyncio.to_thread(importer.flush)
+    return importer.report()
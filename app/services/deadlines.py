@@ -0,0 +1,151 @@
+import heapq
+import logging
+import threading
+from datetime import datetime
+from typing import List, Optional, Tuple
+from sqlalchemy.orm import Session
+from .. import crud
+from .. import whatsapp as wa
+from ..config import settings
+from ..db import SessionLocal, unit_of_work
+from . import outbox
+from .listing_pages import listing_pages
+from .search import search_index
+
+logger = logging.getLogger(__name__)
+
+
+def _expiry_notice(listing_id: int, unit: str, bid) -> str:
+    if bid is None:
+        return f"Bidding on your listing {listing_id} has closed (deadline passed). No bids were placed."
+    return (
+        f"Bidding on your listing {listing_id} has closed (deadline passed). "
+        f"Best bid #{bid.id}: {bid.price_per_unit} per {unit}, qty {bid.quantity}.\n"
+        f"To accept: ACCEPT {bid.id}"
+    )
+
+
+def expire_batch(db: Session, listing_ids: List[int]) -> int:
+    # One UPDATE for the batch, one query for best bids. Seller notices are written to the outbox in
+    # the same transaction or, with the outbox off, sent after commit.
+    with wa.deferred_sends() as pending:
+        with unit_of_work(db):
+            expired = crud.expire_listings(db, listing_ids)
+            if expired:
+                ids = [row.id for row in expired]
+                best = crud.best_bids_for_listings(db, ids)
+                phones = crud.get_phones_by_user_ids(db, list({row.seller_id for row in expired}))
+                for row in expired:
+                    phone = phones.get(row.seller_id)
+                    if phone:
+                        wa.send_text(phone, _expiry_notice(row.id, row.unit, best.get(row.id)))
+            outbox.stage(db, pending)
+    if not expired:
+        return 0
+    for row in expired:
+        listing_pages.invalidate(row.commodity, row.location)
+    search_index.remove([row.id for row in expired])
+    for _, phone, body in pending:
+        try:
+            wa.send_text(phone, body)
+        except Exception:
+            logger.exception("failed to notify seller %s of expiry", phone)
+    return len(expired)
+
+
+def sweep_due(db: Session, now: Optional[datetime] = None, batch_size: Optional[int] = None) -> int:
+    # DB-driven sweep for cron/serverless: no in-memory state needed.
+    now = now or datetime.utcnow()
+    batch_size = batch_size or settings.deadline_batch_size
+    total = 0
+    while True:
+        ids = crud.due_listing_ids(db, now, batch_size)
+        if not ids:
+            return total
+        total += expire_batch(db, ids)
+        if len(ids) < batch_size:
+            return total
+
+
+class DeadlineScheduler:
+    # Min-heap of (deadline, listing_id) for open listings. A background thread sleeps until the
+    # earliest deadline (or until an earlier one is scheduled) and expires due listings in batches.
+    def __init__(self, batch_size: int, max_sleep: float = 60.0):
+        self.batch_size = batch_size
+        self.max_sleep = max_sleep
+        self._heap: List[Tuple[datetime, int]] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def load(self, db: Session) -> None:
+        heap = [(deadline, listing_id) for listing_id, deadline in crud.list_open_deadlines(db)]
+        heapq.heapify(heap)
+        with self._lock:
+            self._heap = heap
+        self._wake.set()
+
+    def schedule(self, listing_id: int, deadline: Optional[datetime]) -> None:
+        if deadline is None:
+            return
+        with self._lock:
+            earliest = self._heap[0][0] if self._heap else None
+            heapq.heappush(self._heap, (deadline, listing_id))
+        if earliest is None or deadline < earliest:
+            self._wake.set()
+
+    def pop_due(self, now: datetime) -> List[int]:
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+                due.append(heapq.heappop(self._heap)[1])
+        return due
+
+    def seconds_until_next(self, now: datetime) -> float:
+        with self._lock:
+            if not self._heap:
+                return self.max_sleep
+            return max(0.0, min(self.max_sleep, (self._heap[0][0] - now).total_seconds()))
+
+    def run_due(self, now: Optional[datetime] = None) -> int:
+        total = 0
+        while True:
+            ids = self.pop_due(now or datetime.utcnow())
+            if not ids:
+                return total
+            db = SessionLocal()
+            try:
+                total += expire_batch(db, ids)
+            finally:
+                db.close()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_due()
+            except Exception:
+                logger.exception("deadline scheduler error")
+            self._wake.clear()
+            self._wake.wait(self.seconds_until_next(datetime.utcnow()))
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="deadline-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"scheduled": len(self._heap), "next_deadline": self._heap[0][0].isoformat() if self._heap else None}
+
+
+deadline_scheduler = DeadlineScheduler(batch_size=settings.deadline_batch_size)
@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Set
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from ..config import settings
+from ..db import on_commit
+from ..models import SeenMessage
+
+
+class DuplicateMessage(Exception):
+    pass
+
+
+class MessageDeduper:
+    # Bounded in-process LRU of recent wamids in front of the persisted seen_messages table.
+    # The table catches redeliveries that land on another process or after a restart.
+    def __init__(self, capacity: int, ttl: timedelta, prune_interval: float):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.prune_interval = prune_interval
+        self.suppressed = 0
+        self._recent: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_prune = time.monotonic()
+
+    def _remember(self, wamid: str) -> None:
+        with self._lock:
+            self._recent[wamid] = None
+            self._recent.move_to_end(wamid)
+            while len(self._recent) > self.capacity:
+                self._recent.popitem(last=False)
+
+    def _count_duplicate(self) -> None:
+        with self._lock:
+            self.suppressed += 1
+
+    def is_duplicate(self, db: Session, wamid: Optional[str]) -> bool:
+        # Without a unit of work: returns True for a redelivery, otherwise commits the wamid as seen.
+        if not wamid:
+            return False
+        with self._lock:
+            if wamid in self._recent:
+                self._recent.move_to_end(wamid)
+                self.suppressed += 1
+                return True
+        db.add(SeenMessage(wamid=wamid, seen_at=datetime.utcnow()))
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            self._remember(wamid)
+            self._count_duplicate()
+            return True
+        self._remember(wamid)
+        self.maybe_prune(db)
+        return False
+
+    def claim(self, db: Session, wamids: Iterable[Optional[str]]) -> None:
+        # Records the wamids as seen inside the caller's unit of work, so the claim commits or rolls
+        # back together with the handler's writes: a crash mid-handle leaves nothing behind and the
+        # redelivery (or queue retry) goes through. Raises DuplicateMessage for a redelivery.
+        wamids = [w for w in dict.fromkeys(wamids) if w]
+        if not wamids:
+            return
+        with self._lock:
+            if any(w in self._recent for w in wamids):
+                self.suppressed += 1
+                raise DuplicateMessage()
+        now = datetime.utcnow()
+        try:
+            db.execute(insert(SeenMessage), [{"wamid": w, "seen_at": now} for w in wamids])
+        except IntegrityError:
+            # Already committed by an earlier delivery (or one still in flight, once it commits)
+            self._count_duplicate()
+            raise DuplicateMessage() from None
+        on_commit(db, lambda: [self._remember(w) for w in wamids])
+
+    def unseen(self, db: Session, wamids: Iterable[Optional[str]]) -> Set[str]:
+        # Read-only pre-filter for a whole payload (one SELECT); the handlers claim what they process
+        fresh: List[str] = []
+        with self._lock:
+            for wamid in wamids:
+                if not wamid:
+                    continue
+                if wamid in self._recent or wamid in fresh:
+                    self.suppressed += 1
+                else:
+                    fresh.append(wamid)
+        if not fresh:
+            return set()
+        seen = set(db.scalars(select(SeenMessage.wamid).where(SeenMessage.wamid.in_(fresh))))
+        for wamid in seen:
+            self._remember(wamid)
+            self._count_duplicate()
+        self.maybe_prune(db)
+        return {w for w in fresh if w not in seen}
+
+    def forget(self, db: Session, wamid: Optional[str]) -> None:
+        # Processing failed (DB_UNIT_OF_WORK off, where is_duplicate committed the claim up front):
+        # let the redelivery (or queue retry) through.
+        if not wamid:
+            return
+        with self._lock:
+            self._recent.pop(wamid, None)
+        db.rollback()
+        db.execute(delete(SeenMessage).where(SeenMessage.wamid == wamid))
+        db.commit()
+
+    def prune(self, db: Session) -> int:
+        result = db.execute(delete(SeenMessage).where(SeenMessage.seen_at < datetime.utcnow() - self.ttl))
+        db.commit()
+        return result.rowcount
+
+    def maybe_prune(self, db: Session) -> None:
+        now = time.monotonic()
+        if now - self._last_prune < self.prune_interval:
+            return
+        self._last_prune = now
+        self.prune(db)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"suppressed": self.suppressed, "cached": len(self._recent)}
+
+
+deduper = MessageDeduper(
+    capacity=settings.dedup_cache_size,
+    ttl=timedelta(hours=settings.dedup_ttl_hours),
+    prune_interval=settings.dedup_prune_interval,
+)
@@ -0,0 +1,175 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, List, Optional, Set
+from sqlalchemy.orm import Session
+from .. import crud
+from ..config import settings
+from ..db import SessionLocal, on_commit, unit_of_work
+
+logger = logging.getLogger(__name__)
+
+STATUSES = ("sent", "delivered", "read", "failed")
+# Cloud API errors that will not go away by retrying later: undeliverable (not on WhatsApp,
+# blocked us), stopped marketing messages, recipient is the sender.
+PERMANENT_ERRORS = {131026, 131050, 131021}
+
+
+def iter_statuses(payload: dict) -> Iterator[dict]:
+    # Parse receipts: entry -> changes -> value -> statuses
+    for entry in payload.get("entry", []):
+        for change in entry.get("changes", []):
+            for s in change.get("value", {}).get("statuses", []):
+                status = s.get("status")
+                if not s.get("id") or status not in STATUSES:
+                    continue
+                errors = s.get("errors") or []
+                code = errors[0].get("code") if errors else None
+                yield {
+                    "wamid": s["id"],
+                    "recipient": s.get("recipient_id"),
+                    "status": status,
+                    "error_code": int(code) if isinstance(code, (int, str)) and str(code).isdigit() else None,
+                }
+
+
+class RecipientHealthIndex:
+    # In-memory set of suppressed phones so fan-out filtering is a set lookup. Updated after each
+    # ingest commit and re-read every refresh_interval when several processes ingest receipts.
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self._suppressed: Set[str] = set()
+        self._loaded_at: Optional[float] = None
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def load(self, db: Session) -> None:
+        suppressed = set(crud.list_suppressed_phones(db))
+        with self._lock:
+            self._suppressed = suppressed
+            self._loaded_at = time.monotonic()
+
+    def ensure_warm(self, db: Session) -> None:
+        loaded_at = self._loaded_at
+        if loaded_at is None or (self.refresh_interval > 0 and time.monotonic() - loaded_at > self.refresh_interval):
+            self.load(db)
+
+    def apply(self, suppress: Iterable[str], release: Iterable[str]) -> None:
+        with self._lock:
+            self._suppressed.update(suppress)
+            self._suppressed.difference_update(release)
+
+    def filter(self, phones: Iterable[str]) -> List[str]:
+        phones = list(phones)
+        with self._lock:
+            kept = [p for p in phones if p not in self._suppressed]
+            self.skipped += len(phones) - len(kept)
+        return kept
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"suppressed": len(self._suppressed), "skipped": self.skipped}
+
+
+recipient_health = RecipientHealthIndex(refresh_interval=settings.delivery_health_refresh)
+_last_prune = time.monotonic()
+
+
+def _fold(row: dict, status: str, error_code: Optional[int], now: datetime) -> None:
+    if status in ("delivered", "read"):
+        if status == "delivered":
+            row["delivered"] += 1
+        row["consecutive_failures"] = 0
+        # It got through, so the number is reachable again
+        row["suppressed"] = 0
+    elif status == "failed":
+        row["failed"] += 1
+        row["consecutive_failures"] += 1
+        row["last_error_code"] = error_code
+        if error_code in PERMANENT_ERRORS or row["consecutive_failures"] >= settings.delivery_suppress_after:
+            row["suppressed"] = 1
+    row["updated_at"] = now
+
+
+def ingest_statuses(db: Session, statuses: List[dict]) -> int:
+    # One multi-row INSERT for the receipts, one SELECT plus two executemany for recipient health
+    if not statuses:
+        return 0
+    now = datetime.utcnow()
+    with unit_of_work(db):
+        crud.add_delivery_events(db, [dict(s, created_at=now) for s in statuses])
+        phones = list(dict.fromkeys(s["recipient"] for s in statuses if s["recipient"] and s["status"] != "sent"))
+        if phones:
+            existing = crud.get_recipient_health(db, phones)
+            rows = {}
+            for phone in phones:
+                h = existing.get(phone)
+                rows[phone] = {
+                    "phone": phone,
+                    "delivered": h.delivered if h else 0,
+                    "failed": h.failed if h else 0,
+                    "consecutive_failures": h.consecutive_failures if h else 0,
+                    "last_error_code": h.last_error_code if h else None,
+                    "suppressed": h.suppressed if h else 0,
+                    "updated_at": now,
+                }
+            for s in statuses:
+                if s["recipient"] in rows:
+                    _fold(rows[s["recipient"]], s["status"], s["error_code"], now)
+            crud.save_recipient_health(
+                db,
+                updated=[r for p, r in rows.items() if p in existing],
+                created=[r for p, r in rows.items() if p not in existing],
+            )
+            suppress = [p for p, r in rows.items() if r["suppressed"]]
+            release = [p for p, r in rows.items() if not r["suppressed"]]
+            on_commit(db, lambda: recipient_health.apply(suppress, release))
+    maybe_prune(db)
+    return len(statuses)
+
+
+def maybe_prune(db: Session, interval: float = 3600.0) -> None:
+    global _last_prune
+    now = time.monotonic()
+    if now - _last_prune < interval:
+        return
+    _last_prune = now
+    crud.delete_old_delivery_records(db, datetime.utcnow() - timedelta(days=settings.delivery_events_ttl_days))
+
+
+def record_broadcast(summary, body: str) -> Optional[int]:
+    # Remember which outbound wamids belong to this broadcast, for per-broadcast delivery rates
+    db = SessionLocal()
+    try:
+        messages = [(r.message_id, r.phone) for r in summary.results if r.message_id]
+        return crud.add_broadcast(
+            db,
+            preview=body[:160],
+            recipients=len(summary.results),
+            sent=summary.sent,
+            failed=summary.failed + summary.throttled,
+            messages=messages,
+        )
+    finally:
+        db.close()
+
+
+def delivery_report(db: Session, limit: int = 20) -> dict:
+    broadcasts = []
+    for row in crud.broadcast_delivery_rates(db, limit):
+        broadcasts.append({
+            "id": row.id,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+            "preview": row.preview,
+            "recipients": row.recipients,
+            "sent": row.sent,
+            "send_failed": row.failed,
+            "delivered": row.delivered,
+            "read": row.read,
+            "undelivered": row.undelivered,
+            "delivery_rate": round(row.delivered / row.sent, 3) if row.sent else None,
+            "read_rate": round(row.read / row.sent, 3) if row.sent else None,
+        })
+    recipient_health.ensure_warm(db)
+    return {"broadcasts": broadcasts, "recipients": recipient_health.stats()}
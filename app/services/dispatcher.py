@@ -0,0 +1,101 @@
+import contextvars
+import logging
+import queue
+import threading
+import zlib
+from concurrent.futures import Future
+from typing import Callable, List, Optional
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class DispatcherFull(Exception):
+    pass
+
+
+class Dispatcher:
+    # Shards work by key (sender phone) onto single-threaded lanes: messages from one user run
+    # in arrival order, different users run in parallel on different lanes.
+    def __init__(self, lanes: int, max_queue: int):
+        self.lane_count = max(1, lanes)
+        self.max_queue = max_queue
+        self._queues: List[queue.Queue] = []
+        self._threads: List[threading.Thread] = []
+        self._in_flight = 0
+        self._completed = 0
+        self._lock = threading.Lock()
+
+    def _ensure_started(self) -> None:
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            queues = [queue.Queue(maxsize=self.max_queue) for _ in range(self.lane_count)]
+            threads = []
+            for i, q in enumerate(queues):
+                t = threading.Thread(target=self._run, args=(q,), name=f"dispatch-lane-{i}", daemon=True)
+                t.start()
+                threads.append(t)
+            self._queues = queues
+            self._threads = threads
+
+    def _run(self, q: queue.Queue) -> None:
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            future, ctx, fn, args = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            with self._lock:
+                self._in_flight += 1
+            try:
+                future.set_result(ctx.run(fn, *args))
+            except BaseException as exc:
+                future.set_exception(exc)
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                    self._completed += 1
+
+    def lane_for(self, key: str) -> int:
+        return zlib.crc32(key.encode("utf-8")) % self.lane_count
+
+    def submit(self, key: str, fn: Callable, *args) -> Future:
+        self._ensure_started()
+        future: Future = Future()
+        try:
+            # Run in the submitter's context so tracing spans nest under the webhook request
+            self._queues[self.lane_for(key)].put_nowait((future, contextvars.copy_context(), fn, args))
+        except queue.Full:
+            raise DispatcherFull(f"dispatch lane for {key} is full")
+        return future
+
+    def queue_depth(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    def stats(self) -> dict:
+        depths = [q.qsize() for q in self._queues]
+        with self._lock:
+            in_flight, completed = self._in_flight, self._completed
+        return {
+            "lanes": self.lane_count,
+            "queued": sum(depths),
+            "max_lane_depth": max(depths) if depths else 0,
+            "in_flight": in_flight,
+            "completed": completed,
+        }
+
+    def shutdown(self, timeout: Optional[float] = 10.0) -> None:
+        with self._lock:
+            queues, threads = self._queues, self._threads
+            self._queues, self._threads = [], []
+        for q in queues:
+            q.put(None)
+        for t in threads:
+            t.join(timeout)
+
+
+dispatcher = Dispatcher(lanes=settings.dispatcher_lanes, max_queue=settings.dispatcher_max_queue)
@@ -1,9 +1,22 @@
-import json
 from datetime import datetime, timedelta
+from typing import Optional
 from sqlalchemy.orm import Session
 from .. import crud
 from ..models import Listing, Bid, User
+from .. import metrics
 from .. import whatsapp as wa
+from ..config import settings
+from ..db import on_commit
+from .transaction import transaction
+from .subscriptions import subscription_index
+from .sessions import session_store
+from .listing_pages import listing_pages, render_listing
+from .deadlines import deadline_scheduler
+from .leaderboard import bid_leaderboard, RankedBid
+from .search import index_entry, parse_query, search_index
+from .notify import notify_new_bid
+from .delivery import recipient_health
+from .inbound_limits import inbound_limiter, LIST_PUBLISH_COST
 
 
 HELP_TEXT = (
@@ -11,15 +24,120 @@ HELP_TEXT = (
     "- HELP\n"
     "- JOIN buyer | JOIN seller\n"
     "- SUBSCRIBE <commodity> <region>\n"
-    "- LISTINGS (see open listings)\n"
+    "- LISTINGS (see open listings), LISTINGS MORE (next page)\n"
+    "- SEARCH <terms> [min qty] [max price]\n"
     "- LIST (seller listing flow)\n"
     "- BID <listingId> <pricePerUnit> <quantity>\n"
+    "- BIDS <listingId> (seller: best bids)\n"
     "- ACCEPT <bidId> (seller)\n"
 )
 
 
-def handle_text_message(db: Session, from_phone: str, text: str) -> None:
-    user = crud.get_or_create_user(db, phone=from_phone)
+def _save_listings_cursor(db: Session, user: User, state, cursor) -> None:
+    # The cursor lives in the user's session state; an in-progress LIST flow keeps its step and data.
+    if state is not None and state.flow not in (None, "listings"):
+        data = dict(state.data)
+        data["listings_cursor"] = cursor
+        session_store.set(db, user.id, flow=state.flow, step=state.step, data=data)
+    elif cursor is not None:
+        session_store.set(db, user.id, flow="listings", step=0, data={"listings_cursor": cursor})
+    elif state is not None:
+        session_store.clear(db, user.id)
+
+
+def _handle_listings(db: Session, user: User, from_phone: str, msg: str) -> None:
+    # LISTINGS shows the first page of open listings matching the user's opt-ins (falling back to
+    # all open listings); LISTINGS MORE continues from the cursor saved with the previous page.
+    more = msg.upper().split()[1:2] == ["MORE"]
+    state = session_store.get(db, user.id)
+    if more:
+        saved = (state.data.get("listings_cursor") if state else None)
+        if not saved:
+            wa.send_text(from_phone, "No more listings. Send LISTINGS to start again.")
+            return
+        filter_key = tuple(tuple(pair) for pair in saved["filter"]) if saved["filter"] is not None else None
+        cursor = tuple(saved["after"])
+        page_no = saved["page"] + 1
+        lines, next_cursor = listing_pages.get_page(db, filter_key, cursor)
+    else:
+        subscription_index.ensure_warm(db)
+        filter_key = tuple(subscription_index.subscriptions_for(from_phone)) or None
+        page_no = 1
+        lines, next_cursor = listing_pages.get_page(db, filter_key, None)
+        if not lines and filter_key is not None:
+            filter_key = None
+            lines, next_cursor = listing_pages.get_page(db, None, None)
+    if not lines:
+        wa.send_text(from_phone, "No open listings right now.")
+        _save_listings_cursor(db, user, state, None)
+        return
+    footer = "To bid: BID <listingId> <pricePerUnit> <quantity>"
+    if next_cursor is not None:
+        footer += "\nSend LISTINGS MORE for the next page."
+        saved = {"filter": [list(pair) for pair in filter_key] if filter_key is not None else None, "after": list(next_cursor), "page": page_no}
+    else:
+        saved = None
+    _save_listings_cursor(db, user, state, saved)
+    wa.send_text(from_phone, f"Open listings (page {page_no}):\n" + "\n".join(lines) + "\n\n" + footer)
+
+
+def _handle_search(db: Session, from_phone: str, msg: str) -> None:
+    # Answered from the in-memory index; the DB is only read to warm it
+    terms, min_qty, max_price = parse_query(msg.split()[1:])
+    if not terms and min_qty is None:
+        wa.send_text(from_phone, "Usage: SEARCH <terms> [min qty] [max price], e.g. SEARCH maize nairobi 100 40")
+        return
+    search_index.ensure_warm(db)
+    found, more = search_index.search(terms, min_qty, max_price, limit=settings.search_results)
+    if not found:
+        wa.send_text(from_phone, "No open listings match your search.")
+        return
+    footer = "To bid: BID <listingId> <pricePerUnit> <quantity>"
+    if more:
+        footer += "\nShowing the newest matches; add terms or filters to narrow down."
+    lines = [render_listing(entry) for entry in found]
+    wa.send_text(from_phone, "Search results:\n" + "\n".join(lines) + "\n\n" + footer)
+
+
+def _handle_bids(db: Session, user: User, from_phone: str, msg: str) -> None:
+    parts = msg.split()
+    try:
+        listing_id = int(parts[1])
+    except (IndexError, ValueError):
+        wa.send_text(from_phone, "Usage: BIDS <listingId>")
+        return
+    listing = crud.get_listing(db, listing_id)
+    if not listing or listing.seller_id != user.id:
+        wa.send_text(from_phone, "You can only view bids on your listings.")
+        return
+    top = bid_leaderboard.top(db, listing_id)
+    if not top:
+        wa.send_text(from_phone, f"No bids yet on listing {listing_id}.")
+        return
+    lines = [
+        f"{rank}. Bid #{b.bid_id}: {b.price_per_unit} per {listing.unit}, qty {b.quantity} from {b.buyer_phone}"
+        for rank, b in enumerate(top, start=1)
+    ]
+    wa.send_text(
+        from_phone,
+        f"Top bids on listing {listing_id} ({listing.status}):\n" + "\n".join(lines) + "\nTo accept: ACCEPT <bidId>",
+    )
+
+
+def handle_text_message(db: Session, from_phone: str, text: str, user: Optional[User] = None) -> None:
+    # `user` is passed by the batch path, which resolved all senders of a payload up front
+    with metrics.command_scope(metrics.command_of(text)):
+        if not settings.db_unit_of_work:
+            _handle_text_message(db, from_phone, text, user)
+            return
+        # One transaction per inbound message; replies go out only once it has committed
+        with transaction(db):
+            _handle_text_message(db, from_phone, text, user)
+
+
+def _handle_text_message(db: Session, from_phone: str, text: str, user: Optional[User] = None) -> None:
+    if user is None:
+        user = crud.get_or_create_user(db, phone=from_phone)
     msg = (text or "").strip()
 
     if msg.upper().startswith("HELP") or msg == "?":
@@ -27,32 +145,15 @@ def handle_text_message(db: Session, from_phone: str, text: str) -> None:
         return
 
     if msg.upper().startswith("LISTINGS"):
-        # Show ALL relevant open listings based on user's opt-ins; fallback to all open listings
-        listings = crud.list_open_listings_for_user(db, user_id=user.id, limit=None)
-        if not listings:
-            listings = crud.list_open_listings(db)
-        if not listings:
-            wa.send_text(from_phone, "No open listings right now.")
-            return
-        # Chunk results to avoid overly long WhatsApp messages
-        header = f"Open listings ({len(listings)}):"
-        chunk_size = 15
-        lines_chunk: list[str] = []
-        for idx, lst in enumerate(listings, start=1):
-            minp = "N/A" if lst.min_price is None else f"{lst.min_price}"
-            lines_chunk.append(f"- ID {lst.id}: {lst.commodity} {lst.quantity} {lst.unit} @ {lst.location} | Min: {minp}")
-            if len(lines_chunk) >= chunk_size:
-                wa.send_text(from_phone, header + "\n" + "\n".join(lines_chunk))
-                lines_chunk = []
-        if lines_chunk:
-            wa.send_text(from_phone, header + "\n" + "\n".join(lines_chunk))
-        wa.send_text(from_phone, "To bid: BID <listingId> <pricePerUnit> <quantity>")
+        _handle_listings(db, user, from_phone, msg)
         return
 
     if msg.upper().startswith("JOIN"):
         parts = msg.split()
         if len(parts) >= 2 and parts[1].lower() in ("buyer", "seller"):
-            crud.set_user_role(db, user, parts[1].lower())
+            role = parts[1].lower()
+            crud.set_user_role(db, user, role)
+            on_commit(db, lambda: subscription_index.set_role(from_phone, role))
             wa.send_text(from_phone, f"You are registered as {parts[1].lower()}. Send HELP for commands.")
         else:
             wa.send_text(from_phone, "Usage: JOIN buyer | JOIN seller")
@@ -64,30 +165,37 @@ def handle_text_message(db: Session, from_phone: str, text: str) -> None:
             commodity = parts[1]
             region = " ".join(parts[2:])
             crud.add_opt_in(db, user.id, commodity=commodity, region=region)
+            role = user.role
+            on_commit(db, lambda: subscription_index.subscribe(from_phone, role, commodity, region))
             wa.send_text(from_phone, f"Subscribed to {commodity.upper()} in {region.upper()}.")
         else:
             wa.send_text(from_phone, "Usage: SUBSCRIBE <commodity> <region>")
         return
 
+    if msg.upper().startswith("SEARCH"):
+        _handle_search(db, from_phone, msg)
+        return
+
     if msg.upper().startswith("LIST"):
         # start seller flow
         if user.role != "seller":
             wa.send_text(from_phone, "Only sellers can list. Send 'JOIN seller' to switch.")
             return
         data = {"commodity": None, "quantity": None, "unit": None, "location": None, "quality": None, "min_price": None, "deadline_hours": None}
-        crud.set_session_state(db, user_id=user.id, flow="list", step=0, data_json=json.dumps(data))
+        session_store.set(db, user.id, flow="list", step=0, data=data)
         wa.send_text(from_phone, "Listing flow started.\n1) Commodity? (e.g., MAIZE)")
         return
 
     # Check if in listing flow
-    state = crud.get_session_state(db, user_id=user.id)
+    state = session_store.get(db, user.id)
     if state and state.flow == "list":
-        data = json.loads(state.data_json or "{}")
+        data = dict(state.data)
         step = state.step or 0
+        metrics.set_command(f"LIST step {step}")
 
         if step == 0:
             data["commodity"] = msg.strip().upper()
-            crud.set_session_state(db, user_id=user.id, flow="list", step=1, data_json=json.dumps(data))
+            session_store.set(db, user.id, flow="list", step=1, data=data)
             wa.send_text(from_phone, "2) Quantity? (number)")
             return
 
@@ -97,25 +205,25 @@ def handle_text_message(db: Session, from_phone: str, text: str) -> None:
             except ValueError:
                 wa.send_text(from_phone, "Please enter a number for quantity.")
                 return
-            crud.set_session_state(db, user_id=user.id, flow="list", step=2, data_json=json.dumps(data))
+            session_store.set(db, user.id, flow="list", step=2, data=data)
             wa.send_text(from_phone, "3) Unit? (e.g., KG, TON, CRATE)")
             return
 
         if step == 2:
             data["unit"] = msg.strip().upper()
-            crud.set_session_state(db, user_id=user.id, flow="list", step=3, data_json=json.dumps(data))
+            session_store.set(db, user.id, flow="list", step=3, data=data)
             wa.send_text(from_phone, "4) Location/Region? (e.g., NAIROBI)")
             return
 
         if step == 3:
             data["location"] = msg.strip().upper()
-            crud.set_session_state(db, user_id=user.id, flow="list", step=4, data_json=json.dumps(data))
+            session_store.set(db, user.id, flow="list", step=4, data=data)
             wa.send_text(from_phone, "5) Quality grade? (or type 'skip')")
             return
 
         if step == 4:
             data["quality"] = None if msg.lower() == "skip" else msg.strip()
-            crud.set_session_state(db, user_id=user.id, flow="list", step=5, data_json=json.dumps(data))
+            session_store.set(db, user.id, flow="list", step=5, data=data)
             wa.send_text(from_phone, "6) Minimum price per unit? (number or 'skip')")
             return
 
@@ -128,7 +236,7 @@ def handle_text_message(db: Session, from_phone: str, text: str) -> None:
                 except ValueError:
                     wa.send_text(from_phone, "Please enter a number or 'skip'.")
                     return
-            crud.set_session_state(db, user_id=user.id, flow="list", step=6, data_json=json.dumps(data))
+            session_store.set(db, user.id, flow="list", step=6, data=data)
             wa.send_text(from_phone, "7) Bidding deadline in hours from now? (number, or 'skip')")
             return
 
@@ -142,6 +250,11 @@ def handle_text_message(db: Session, from_phone: str, text: str) -> None:
                     wa.send_text(from_phone, "Please enter a number or 'skip'.")
                     return
 
+            # Publishing fans out to every subscriber, so it costs more of the sender's rate budget
+            if not inbound_limiter.charge(db, from_phone, LIST_PUBLISH_COST):
+                wa.send_text(from_phone, "You're sending messages too quickly. Please send the deadline again in a minute.")
+                return
+
             listing = crud.create_listing(
                 db,
                 seller_id=user.id,
@@ -155,7 +268,12 @@ def handle_text_message(db: Session, from_phone: str, text: str) -> None:
             )
 
             # clear state
-            crud.set_session_state(db, user_id=user.id, flow=None, step=None, data_json=None)
+            session_store.clear(db, user.id)
+            listing_id, commodity, location = listing.id, listing.commodity, listing.location
+            on_commit(db, lambda: listing_pages.invalidate(commodity, location))
+            on_commit(db, lambda: deadline_scheduler.schedule(listing_id, deadline))
+            entry = index_entry(listing)
+            on_commit(db, lambda: search_index.add(entry))
 
             wa.send_text(
                 from_phone,
@@ -164,13 +282,15 @@ def handle_text_message(db: Session, from_phone: str, text: str) -> None:
             )
 
             # Broadcast announcement to opted-in buyers
-            buyers = crud.get_opted_in_buyers_for_listing(db, listing)
+            subscription_index.ensure_warm(db)
+            buyer_phones = subscription_index.buyers_for(listing.commodity, listing.location)
             body = (
                 f"New listing #{listing.id}: {listing.commodity} {listing.quantity} {listing.unit} at {listing.location}.\n"
                 f"To bid: BID {listing.id} <pricePerUnit> <quantity>"
             )
-            if buyers:
-                wa.broadcast_text([b.phone for b in buyers if b.phone != from_phone], body)
+            if buyer_phones:
+                recipient_health.ensure_warm(db)
+                wa.broadcast_text(recipient_health.filter(p for p in buyer_phones if p != from_phone), body)
             else:
                 # Fallback: broadcast to all active buyers
                 all_buyers = crud.get_all_buyers(db)
@@ -180,6 +300,11 @@ def handle_text_message(db: Session, from_phone: str, text: str) -> None:
                     wa.send_text(from_phone, "No buyers registered yet.")
             return
 
+    # Seller views the best bids on a listing
+    if msg.upper().startswith("BIDS"):
+        _handle_bids(db, user, from_phone, msg)
+        return
+
     # Bidding
     if msg.upper().startswith("BID"):
         parts = msg.split()
@@ -195,16 +320,24 @@ def handle_text_message(db: Session, from_phone: str, text: str) -> None:
             if not listing or listing.status != "open":
                 wa.send_text(from_phone, "Listing not found or closed.")
                 return
+            if listing.deadline is not None and listing.deadline <= datetime.utcnow():
+                wa.send_text(from_phone, "Bidding on this listing has closed.")
+                return
+            if listing.min_price is not None and price < listing.min_price:
+                wa.send_text(from_phone, f"Bid rejected: minimum price for listing {listing.id} is {listing.min_price} per {listing.unit}.")
+                return
+            if not crud.touch_open_listing(db, listing_id):
+                # Accepted or expired since it was read
+                wa.send_text(from_phone, "Listing not found or closed.")
+                return
             bid = crud.create_bid(db, listing_id=listing_id, buyer_id=user.id, price_per_unit=price, quantity=qty, note=None)
+            ranked = RankedBid(bid_id=bid.id, price_per_unit=price, quantity=qty, created_at=bid.created_at, buyer_phone=from_phone)
+            on_commit(db, lambda: bid_leaderboard.record(listing_id, ranked))
             wa.send_text(from_phone, f"Bid placed. ID {bid.id}.")
-            # Notify seller about new bid
+            # Notify seller about new bid (coalesced into digests on busy listings)
             seller = crud.get_user_by_id(db, listing.seller_id)
             if seller and seller.phone:
-                wa.send_text(
-                    seller.phone,
-                    f"New bid #{bid.id} on your listing {listing.id}: {price} per {listing.unit}, qty {qty} from {from_phone}.\n"
-                    f"To accept: ACCEPT {bid.id}"
-                )
+                notify_new_bid(db, seller.phone, listing, bid, from_phone)
         else:
             wa.send_text(from_phone, "Usage: BID <listingId> <pricePerUnit> <quantity>")
         return
@@ -229,12 +362,21 @@ def handle_text_message(db: Session, from_phone: str, text: str) -> None:
             if listing.seller_id != user.id:
                 wa.send_text(from_phone, "You can only accept bids on your listings.")
                 return
-            crud.set_bid_status(db, bid, "accepted")
-            # mark others rejected
-            for other in listing.bids:
-                if other.id != bid.id and other.status == "placed":
-                    crud.set_bid_status(db, other, "rejected")
-            crud.close_listing(db, listing)
+            # Expired listings (deadline passed) can still accept one of their bids
+            if listing.status == "closed" or bid.status != "placed":
+                wa.send_text(from_phone, "This listing is already closed.")
+                return
+            listing_id, commodity, location = listing.id, listing.commodity, listing.location
+            if not crud.accept_bid(db, listing_id, bid.id, listing.version):
+                wa.send_text(
+                    from_phone,
+                    f"Listing {listing_id} changed while you were accepting (a new bid, or it was closed). "
+                    f"Send BIDS {listing_id} to review and try again.",
+                )
+                return
+            on_commit(db, lambda: listing_pages.invalidate(commodity, location))
+            on_commit(db, lambda: bid_leaderboard.drop(listing_id))
+            on_commit(db, lambda: search_index.remove([listing_id]))
             wa.send_text(from_phone, f"Accepted bid {bid.id} for listing {listing.id}. Listing closed.")
             # notify buyer
             wa.send_text(bid.buyer.phone, f"Your bid {bid.id} for listing {listing.id} was accepted. Seller will contact you.")
@@ -0,0 +1,161 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from .. import crud, metrics
+from ..config import settings
+from ..db import SessionLocal, on_commit
+from ..ratelimit import refill
+
+# Tokens per command; anything not listed costs 1. LISTINGS renders a page of listings and
+# BIDS a leaderboard; publishing a listing (the last LIST step) fans out to every subscriber.
+COMMAND_COSTS = {"LISTINGS": 3, "BIDS": 2}
+LIST_PUBLISH_COST = 5
+COOLDOWN_TEXT = "You're sending messages too quickly. Please wait a minute and try again."
+
+# (tokens, updated, cooldown_until)
+State = Tuple[float, float, float]
+
+
+def command_cost(text: str) -> int:
+    return COMMAND_COSTS.get(metrics.command_of(text), 1)
+
+
+class InboundLimiter:
+    # Per-sender token bucket (INBOUND_RATE_PER_MIN refill, INBOUND_BURST capacity), kept in a
+    # bounded LRU or, with INBOUND_LIMIT_BACKEND=db, in inbound_rate_limits so every instance
+    # shares it. Over-limit messages are dropped; the sender gets one cooldown reply per window.
+    def __init__(self, rate_per_min: float, burst: float, capacity: int, cooldown: float, backend: str):
+        self.rate = rate_per_min / 60.0
+        self.burst = burst
+        self.capacity = capacity
+        self.cooldown = cooldown
+        self.backend = backend
+        self.shedding = False
+        self.limited = 0
+        self.shed = 0
+        self._states: "OrderedDict[str, State]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _clock(self) -> float:
+        # Wall clock for the shared DB state, monotonic in-process
+        return time.time() if self.backend == "db" else time.monotonic()
+
+    def _take(self, state: Optional[State], cost: float, now: float, shedding: bool) -> Tuple[bool, bool, State]:
+        # Returns (admitted, send_cooldown_reply, new_state)
+        tokens, updated, cooldown_until = state or (self.burst, now, 0.0)
+        tokens = refill(tokens, updated, now, self.rate, self.burst)
+        if not (shedding and cost > 1) and tokens >= cost:
+            return True, False, (tokens - cost, now, cooldown_until)
+        reply = now >= cooldown_until
+        return False, reply, (tokens, now, now + self.cooldown if reply else cooldown_until)
+
+    def _load(self, db: Optional[Session], phones: List[str]) -> Dict[str, State]:
+        if db is not None:
+            return crud.get_inbound_rate_limits(db, phones)
+        with self._lock:
+            return {p: self._states[p] for p in phones if p in self._states}
+
+    def _store(self, db: Optional[Session], states: Dict[str, State], existing: Dict[str, State]) -> None:
+        if db is None:
+            with self._lock:
+                for phone, state in states.items():
+                    self._states[phone] = state
+                    self._states.move_to_end(phone)
+                while len(self._states) > self.capacity:
+                    self._states.popitem(last=False)
+            return
+        rows = {p: {"phone": p, "tokens": s[0], "updated": s[1], "cooldown_until": s[2]} for p, s in states.items()}
+        try:
+            crud.save_inbound_rate_limits(
+                db,
+                updated=[r for p, r in rows.items() if p in existing],
+                created=[r for p, r in rows.items() if p not in existing],
+            )
+        except IntegrityError:
+            # Another instance created the row first; the limit is approximate anyway
+            db.rollback()
+
+    def admit(self, messages: List[dict], queue_depth: int = 0) -> Tuple[List[dict], List[str]]:
+        # Returns the admitted messages (in order) and the senders owed a cooldown reply
+        threshold = settings.inbound_shed_queue_depth
+        self.shedding = threshold > 0 and queue_depth >= threshold
+        phones = list(dict.fromkeys(m["from"] for m in messages))
+        db = SessionLocal() if self.backend == "db" else None
+        # In-process state is updated atomically; the shared DB state is best effort
+        guard = self._lock if db is None else nullcontext()
+        try:
+            with guard:
+                existing = self._load(db, phones)
+                states = dict(existing)
+                now = self._clock()
+                admitted, replies = [], []
+                for m in messages:
+                    cost = command_cost(m["text"])
+                    ok, reply, states[m["from"]] = self._take(states.get(m["from"]), cost, now, self.shedding)
+                    if ok:
+                        admitted.append(m)
+                        continue
+                    reason = "shed" if self.shedding and cost > 1 else "rate"
+                    metrics.inbound_limited_total.inc(reason=reason)
+                    if reason == "shed":
+                        self.shed += 1
+                    else:
+                        self.limited += 1
+                    if reply:
+                        replies.append(m["from"])
+                self._store(db, states, existing)
+            return admitted, replies
+        finally:
+            if db is not None:
+                db.close()
+
+    def charge(self, db: Session, phone: str, cost: float) -> bool:
+        # Extra cost decided mid-command (publishing a listing); False means refuse it for now
+        if not settings.inbound_rate_limit:
+            return True
+        store_db = db if self.backend == "db" else None
+        existing = self._load(store_db, [phone])
+        ok, _, state = self._take(existing.get(phone), cost, self._clock(), self.shedding)
+        if store_db is not None:
+            if phone in existing:
+                # Only UPDATE inside the caller's transaction (undone if it rolls back); admit() creates the row
+                self._store(store_db, {phone: state}, existing)
+        elif ok:
+            # In-process tokens are taken only once the caller's transaction has committed
+            on_commit(db, lambda: self._debit(phone, cost))
+        else:
+            self._store(None, {phone: state}, existing)
+        if not ok:
+            metrics.inbound_limited_total.inc(reason="shed" if self.shedding else "rate")
+        return ok
+
+    def _debit(self, phone: str, cost: float) -> None:
+        with self._lock:
+            existing = self._load(None, [phone])
+            now = self._clock()
+            tokens, updated, cooldown_until = existing.get(phone) or (self.burst, now, 0.0)
+            tokens = refill(tokens, updated, now, self.rate, self.burst)
+            self._store(None, {phone: (max(tokens - cost, 0.0), now, cooldown_until)}, existing)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": self.backend,
+                "tracked": len(self._states),
+                "limited": self.limited,
+                "shed": self.shed,
+                "shedding": self.shedding,
+            }
+
+
+inbound_limiter = InboundLimiter(
+    rate_per_min=settings.inbound_rate_per_min,
+    burst=settings.inbound_burst,
+    capacity=settings.inbound_limit_cache_size,
+    cooldown=settings.inbound_cooldown_seconds,
+    backend=settings.inbound_limit_backend,
+)
@@ -0,0 +1,154 @@
+import json
+import logging
+import threading
+from concurrent.futures import wait
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.orm import Session
+from ..config import settings
+from ..db import SessionLocal
+from ..models import InboundMessage
+from .webhook import dispatch_payload
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(db: Session, payload: dict) -> InboundMessage:
+    item = InboundMessage(payload_json=json.dumps(payload), status="pending", attempts=0, visible_at=datetime.utcnow())
+    db.add(item)
+    db.commit()
+    return item
+
+
+def claim(db: Session, limit: int, visibility_timeout: float) -> List[InboundMessage]:
+    # Claim with a conditional UPDATE so concurrent workers (or processes) never take the same row.
+    # A worker that dies mid-message leaves the row 'processing'; it becomes visible again after the timeout.
+    now = datetime.utcnow()
+    candidates = db.execute(
+        select(InboundMessage.id)
+        .where(InboundMessage.status.in_(("pending", "processing")), InboundMessage.visible_at <= now)
+        .order_by(InboundMessage.id)
+        .limit(limit)
+    ).scalars().all()
+    claimed_ids = []
+    for item_id in candidates:
+        result = db.execute(
+            update(InboundMessage)
+            .where(
+                InboundMessage.id == item_id,
+                InboundMessage.status.in_(("pending", "processing")),
+                InboundMessage.visible_at <= now,
+            )
+            .values(
+                status="processing",
+                attempts=InboundMessage.attempts + 1,
+                visible_at=now + timedelta(seconds=visibility_timeout),
+            )
+        )
+        if result.rowcount == 1:
+            claimed_ids.append(item_id)
+    db.commit()
+    if not claimed_ids:
+        return []
+    return db.execute(select(InboundMessage).where(InboundMessage.id.in_(claimed_ids)).order_by(InboundMessage.id)).scalars().all()
+
+
+def complete(db: Session, item_id: int) -> None:
+    db.execute(delete(InboundMessage).where(InboundMessage.id == item_id))
+    db.commit()
+
+
+def fail(db: Session, item_id: int, attempts: int, error: str) -> None:
+    # Retry with exponential backoff; poisoned payloads are parked as 'dead' after max attempts.
+    if attempts >= settings.queue_max_attempts:
+        values = {"status": "dead", "last_error": error[:2000]}
+    else:
+        backoff = min(300, 2 ** attempts)
+        values = {"status": "pending", "last_error": error[:2000], "visible_at": datetime.utcnow() + timedelta(seconds=backoff)}
+    db.execute(update(InboundMessage).where(InboundMessage.id == item_id).values(**values))
+    db.commit()
+
+
+def requeue_dead(db: Session) -> int:
+    result = db.execute(
+        update(InboundMessage)
+        .where(InboundMessage.status == "dead")
+        .values(status="pending", attempts=0, visible_at=datetime.utcnow())
+    )
+    db.commit()
+    return result.rowcount
+
+
+def stats(db: Session) -> dict:
+    rows = db.execute(select(InboundMessage.status, func.count()).group_by(InboundMessage.status)).all()
+    return {status: count for status, count in rows}
+
+
+def _finish_item(item_id: int, attempts: int, error: Optional[str]) -> bool:
+    db = SessionLocal()
+    try:
+        if error is None:
+            complete(db, item_id)
+        else:
+            fail(db, item_id, attempts, error)
+    finally:
+        db.close()
+    return error is None
+
+
+def drain_once(limit: Optional[int] = None) -> int:
+    db = SessionLocal()
+    try:
+        items = [(i.id, i.payload_json, i.attempts) for i in claim(db, limit or settings.queue_batch_size, settings.queue_visibility_timeout)]
+    finally:
+        db.close()
+    # Submit the whole batch before waiting: the dispatcher keeps each sender's messages in claim
+    # order while different senders run in parallel. Use QUEUE_WORKERS=1 for strict global ordering.
+    submitted = []
+    for item_id, payload_json, attempts in items:
+        try:
+            submitted.append((item_id, attempts, dispatch_payload(json.loads(payload_json)), None))
+        except Exception as exc:
+            submitted.append((item_id, attempts, [], repr(exc)))
+    for item_id, attempts, futures, error in submitted:
+        wait(futures)
+        for f in futures:
+            if error is None and f.exception() is not None:
+                logger.error("inbound payload %s failed (attempt %s)", item_id, attempts, exc_info=f.exception())
+                error = repr(f.exception())
+        _finish_item(item_id, attempts, error)
+    return len(items)
+
+
+class WorkerPool:
+    def __init__(self, workers: int, poll_interval: float):
+        self.workers = max(1, workers)
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                drained = drain_once()
+            except Exception:
+                logger.exception("inbound queue worker error")
+                drained = 0
+            if not drained:
+                self._stop.wait(self.poll_interval)
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        self._stop.clear()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"inbound-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
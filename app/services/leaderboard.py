@@ -0,0 +1,81 @@
+import bisect
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List, Optional, Tuple
+from sqlalchemy.orm import Session
+from .. import crud
+from ..config import settings
+
+
+@dataclass(order=True)
+class RankedBid:
+    # Sorts best-first: highest price, then highest quantity, then earliest
+    sort_key: tuple = field(init=False, repr=False)
+    bid_id: int = field(compare=False)
+    price_per_unit: float = field(compare=False)
+    quantity: float = field(compare=False)
+    created_at: datetime = field(compare=False)
+    buyer_phone: Optional[str] = field(compare=False, default=None)
+
+    def __post_init__(self):
+        self.sort_key = (-self.price_per_unit, -self.quantity, self.created_at, self.bid_id)
+
+
+class BidLeaderboard:
+    # Top-K placed bids per listing, loaded once with a LIMIT K query and then maintained
+    # incrementally on new bids and status changes, so BIDS never scans the bids table.
+    # refresh_interval bounds staleness when several processes write: an older board is reloaded.
+    def __init__(self, k: int, capacity: int, refresh_interval: float):
+        self.k = k
+        self.capacity = capacity
+        self.refresh_interval = refresh_interval
+        self._boards: "OrderedDict[int, Tuple[float, List[RankedBid]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _stale(self, loaded_at: float) -> bool:
+        return self.refresh_interval > 0 and time.monotonic() - loaded_at > self.refresh_interval
+
+    def top(self, db: Session, listing_id: int) -> List[RankedBid]:
+        with self._lock:
+            cached = self._boards.get(listing_id)
+            if cached is not None and not self._stale(cached[0]):
+                self._boards.move_to_end(listing_id)
+                return list(cached[1])
+        return self.load(db, listing_id)
+
+    def load(self, db: Session, listing_id: int) -> List[RankedBid]:
+        loaded_at = time.monotonic()
+        rows = crud.top_bids(db, listing_id, self.k)
+        entries = [RankedBid(bid_id=r[0], price_per_unit=r[1], quantity=r[2], created_at=r[3], buyer_phone=r[4]) for r in rows]
+        with self._lock:
+            self._boards[listing_id] = (loaded_at, entries)
+            self._boards.move_to_end(listing_id)
+            while len(self._boards) > self.capacity:
+                self._boards.popitem(last=False)
+        return list(entries)
+
+    def record(self, listing_id: int, entry: RankedBid) -> None:
+        # Boards not loaded yet pick the bid up from the DB on first use
+        with self._lock:
+            cached = self._boards.get(listing_id)
+            if cached is None:
+                return
+            board = cached[1]
+            bisect.insort(board, entry)
+            if len(board) > self.k:
+                board.pop()
+
+    def drop(self, listing_id: int) -> None:
+        # Bid statuses changed (ACCEPT closes the listing and rejects the rest)
+        with self._lock:
+            self._boards.pop(listing_id, None)
+
+
+bid_leaderboard = BidLeaderboard(
+    k=settings.leaderboard_size,
+    capacity=settings.leaderboard_cache_size,
+    refresh_interval=settings.leaderboard_refresh,
+)
@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Optional, Tuple
+from sqlalchemy.orm import Session
+from .. import crud
+from ..config import settings
+
+# A subscription filter is a sorted tuple of (commodity, region) pairs, or None for all open listings.
+Filter = Optional[Tuple[Tuple[str, str], ...]]
+Cursor = Optional[Tuple[str, int]]  # (created_at ISO, id) of the last listing on the previous page
+
+
+def render_listing(lst) -> str:
+    minp = "N/A" if lst.min_price is None else f"{lst.min_price}"
+    return f"- ID {lst.id}: {lst.commodity} {lst.quantity} {lst.unit} @ {lst.location} | Min: {minp}"
+
+
+class ListingPageCache:
+    # Rendered LISTINGS pages keyed by (filter, cursor). A new or closed listing only affects the
+    # "all" filter and filters containing its (commodity, location), so only those pages are dropped.
+    # That only covers this process: pages also expire after `ttl` seconds (0 = never) so listings
+    # created or closed by other processes show up.
+    def __init__(self, page_size: int, capacity: int, ttl: float):
+        self.page_size = page_size
+        self.capacity = capacity
+        self.ttl = ttl
+        self._pages: "OrderedDict[Tuple[Filter, Cursor], Tuple[float, Tuple[List[str], Cursor]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_page(self, db: Session, filter_key: Filter, cursor: Cursor) -> Tuple[List[str], Cursor]:
+        key = (filter_key, cursor)
+        with self._lock:
+            cached = self._pages.get(key)
+            if cached is not None and (self.ttl <= 0 or time.monotonic() - cached[0] <= self.ttl):
+                self._pages.move_to_end(key)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+        rendered_at = time.monotonic()
+        after = None
+        if cursor is not None:
+            after = (datetime.fromisoformat(cursor[0]), cursor[1])
+        # Fetch one extra row to know whether there is a next page
+        rows = crud.list_open_listings_page(
+            db,
+            subscriptions=list(filter_key) if filter_key is not None else None,
+            after=after,
+            limit=self.page_size + 1,
+        )
+        next_cursor: Cursor = None
+        if len(rows) > self.page_size:
+            rows = rows[: self.page_size]
+            last = rows[-1]
+            next_cursor = (last.created_at.isoformat(), last.id)
+        page = ([render_listing(lst) for lst in rows], next_cursor)
+        with self._lock:
+            self._pages[key] = (rendered_at, page)
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.capacity:
+                self._pages.popitem(last=False)
+        return page
+
+    def invalidate(self, commodity: Optional[str] = None, location: Optional[str] = None) -> None:
+        with self._lock:
+            if commodity is None:
+                self._pages.clear()
+                return
+            affected = (commodity.upper(), (location or "").upper())
+            for key in [k for k in self._pages if k[0] is None or affected in k[0]]:
+                del self._pages[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"pages": len(self._pages), "hits": self.hits, "misses": self.misses}
+
+
+listing_pages = ListingPageCache(
+    page_size=settings.listings_page_size,
+    capacity=settings.listings_page_cache_size,
+    ttl=settings.listings_page_cache_ttl,
+)
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlalchemy.orm import Session
+from .. import crud
+from .. import whatsapp as wa
+from ..config import settings
+from .transaction import transaction
+
+DIGEST_TOP = 3
+
+
+def _instant_text(listing_id: int, bid_id: int, price: float, unit: str, qty: float, buyer_phone: str) -> str:
+    return (
+        f"New bid #{bid_id} on your listing {listing_id}: {price} per {unit}, qty {qty} from {buyer_phone}.\n"
+        f"To accept: ACCEPT {bid_id}"
+    )
+
+
+def _digest_text(rows: List[tuple]) -> str:
+    ranked = sorted(rows, key=lambda r: (-r.price_per_unit, -r.quantity, r.bid_id))
+    best = ranked[0]
+    listings = sorted({r.listing_id for r in rows})
+    lines = [
+        f"- Bid #{r.bid_id} on listing {r.listing_id}: {float(r.price_per_unit)} per {r.unit}, qty {float(r.quantity)} from {r.buyer_phone}"
+        for r in ranked[:DIGEST_TOP]
+    ]
+    return (
+        f"{len(rows)} new bid(s) on listing(s) {', '.join(str(i) for i in listings)}. "
+        f"Best: {float(best.price_per_unit)} per {best.unit} (bid #{best.bid_id}).\n"
+        + "\n".join(lines)
+        + "\nTo accept: ACCEPT <bidId>"
+    )
+
+
+def notify_new_bid(db: Session, seller_phone: str, listing, bid, buyer_phone: str) -> None:
+    # Instant for the first bid in a window, otherwise buffered in bid_notifications (durable across
+    # restarts) and sent as one digest after NOTIFY_DIGEST_WINDOW seconds or NOTIFY_DIGEST_MAX_BIDS bids.
+    window = settings.notify_digest_window
+    instant_text = _instant_text(listing.id, bid.id, bid.price_per_unit, listing.unit, bid.quantity, buyer_phone)
+    if window <= 0:
+        wa.send_text(seller_phone, instant_text)
+        return
+    now = datetime.utcnow()
+    instant = settings.notify_instant_first and not crud.has_recent_bid_notification(db, seller_phone, now - timedelta(seconds=window))
+    crud.add_bid_notification(
+        db,
+        seller_phone=seller_phone,
+        listing_id=listing.id,
+        bid_id=bid.id,
+        buyer_phone=buyer_phone,
+        price_per_unit=bid.price_per_unit,
+        quantity=bid.quantity,
+        unit=listing.unit,
+        delivered=1 if instant else 0,
+        created_at=now,
+    )
+    if instant:
+        wa.send_text(seller_phone, instant_text)
+    elif crud.count_pending_bid_notifications(db, seller_phone) >= settings.notify_digest_max_bids:
+        flush_seller(db, seller_phone)
+
+
+def flush_seller(db: Session, seller_phone: str) -> int:
+    rows = crud.claim_pending_bid_notifications(db, seller_phone)
+    if rows:
+        wa.send_text(seller_phone, _digest_text(rows))
+    return len(rows)
+
+
+def flush_due(db: Session, now: Optional[datetime] = None) -> int:
+    # Send digests whose window has elapsed; run periodically or from /admin/cron/notifications
+    now = now or datetime.utcnow()
+    window = timedelta(seconds=max(settings.notify_digest_window, 0))
+    sent = 0
+    for seller_phone in crud.sellers_with_due_bid_notifications(db, now - window):
+        with transaction(db):
+            if flush_seller(db, seller_phone):
+                sent += 1
+    with transaction(db):
+        crud.delete_delivered_bid_notifications(db, now - window)
+    return sent
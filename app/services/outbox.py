@@ -0,0 +1,212 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from .. import crud, metrics
+from ..broadcast import RETRYABLE_STATUS, RecipientResult, send_once
+from ..config import settings
+from ..db import SessionLocal, on_commit, unit_of_work
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_REPLY = 0
+PRIORITY_BROADCAST = 1
+# Each lane has its own sender thread, so a long broadcast never holds up direct replies.
+# Broadcasts go through the shared messaging-tier token bucket; replies are not throttled.
+LANES = {"reply": (PRIORITY_REPLY,), "broadcast": (PRIORITY_BROADCAST,)}
+
+
+def enabled() -> bool:
+    if settings.outbox_enabled is not None:
+        return settings.outbox_enabled
+    return not settings.is_serverless
+
+
+def stage(db: Session, pending: List[Tuple[str, object, str]]) -> None:
+    # Called inside the caller's unit of work: the collected sends are written to the outbox in the
+    # same transaction as the state change, so they commit (or roll back) together.
+    if not pending or not enabled():
+        return
+    rows = []
+    for kind, to, body in pending:
+        if kind != "broadcast":
+            rows.append({"recipient": to, "body": body, "priority": PRIORITY_REPLY, "broadcast_id": None})
+            continue
+        phones = list(dict.fromkeys(p for p in to if p))
+        if not phones:
+            continue
+        broadcast_id = None
+        if settings.delivery_tracking:
+            broadcast_id = crud.add_broadcast(db, preview=body[:160], recipients=len(phones), sent=0, failed=0, messages=[])
+        rows += [{"recipient": p, "body": body, "priority": PRIORITY_BROADCAST, "broadcast_id": broadcast_id} for p in phones]
+    pending.clear()
+    crud.add_outbox_messages(db, rows)
+    on_commit(db, outbox_sender.wake)
+
+
+def _backoff(attempts: int) -> float:
+    delay = min(settings.wa_retry_max_delay, settings.wa_retry_base_delay * (2 ** attempts))
+    return delay * random.uniform(0.5, 1.5)
+
+
+def _send(rows: List[tuple], rate_limited: bool) -> List[Tuple[tuple, Optional[RecipientResult]]]:
+    # Recipients in parallel, each recipient's messages in order. After a failed send the rest of
+    # that recipient's messages are released unsent, to wait behind the retry (see _finish).
+    chains: Dict[str, List[tuple]] = {}
+    for row in rows:
+        chains.setdefault(row.recipient, []).append(row)
+
+    def _chain(chain: List[tuple]) -> List[Tuple[tuple, Optional[RecipientResult]]]:
+        outcomes = []
+        for i, row in enumerate(chain):
+            result = send_once(row.recipient, row.body, rate_limited=rate_limited)
+            outcomes.append((row, result))
+            if result.status != "sent":
+                outcomes += [(later, None) for later in chain[i + 1:]]
+                break
+        return outcomes
+
+    workers = max(1, min(settings.outbox_concurrency, len(chains)))
+    if workers == 1:
+        return [o for chain in chains.values() for o in _chain(chain)]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="wa-outbox") as pool:
+        return [o for outcomes in pool.map(_chain, chains.values()) for o in outcomes]
+
+
+def _finish(db: Session, lane: str, outcomes: List[Tuple[tuple, Optional[RecipientResult]]]) -> None:
+    now = datetime.utcnow()
+    sent, failed, released = [], [], []
+    broadcast_messages, broadcast_counts = [], {}
+    # Released rows follow their recipient's failed row in `outcomes` and become visible with it
+    held_until: Dict[str, datetime] = {}
+    for row, result in outcomes:
+        if result is None:
+            released.append({"b_id": row.id, "visible_at": held_until.get(row.recipient, now)})
+            continue
+        if result.status == "sent":
+            sent.append({"b_id": row.id, "wamid": result.message_id, "sent_at": now})
+            metrics.outbox_messages_total.inc(lane=lane, result="sent")
+            if row.broadcast_id is not None:
+                if result.message_id:
+                    broadcast_messages.append({"wamid": result.message_id, "broadcast_id": row.broadcast_id, "recipient": row.recipient})
+                s, f = broadcast_counts.get(row.broadcast_id, (0, 0))
+                broadcast_counts[row.broadcast_id] = (s + 1, f)
+            continue
+        retryable = result.status_code is None or result.status_code in RETRYABLE_STATUS
+        if retryable and row.attempts < settings.outbox_max_attempts:
+            status, visible_at = "pending", now + timedelta(seconds=_backoff(row.attempts))
+        else:
+            status, visible_at = "dead", now
+            logger.warning("outbox message %s to %s dead after %s attempts: %s", row.id, row.recipient, row.attempts, result.error)
+            if row.broadcast_id is not None:
+                s, f = broadcast_counts.get(row.broadcast_id, (0, 0))
+                broadcast_counts[row.broadcast_id] = (s, f + 1)
+        held_until[row.recipient] = visible_at
+        failed.append({"b_id": row.id, "status": status, "visible_at": visible_at, "last_error": (result.error or "")[:2000]})
+        metrics.outbox_messages_total.inc(lane=lane, result="retry" if status == "pending" else "dead")
+    with unit_of_work(db):
+        crud.finish_outbox_messages(db, sent, failed, released)
+        if settings.delivery_tracking and (broadcast_messages or broadcast_counts):
+            crud.add_broadcast_results(db, broadcast_messages, broadcast_counts)
+
+
+def drain_once(lane: str, limit: Optional[int] = None) -> int:
+    db = SessionLocal()
+    try:
+        rows = crud.claim_outbox_messages(db, LANES[lane], limit or settings.outbox_batch_size, settings.outbox_visibility_timeout)
+    finally:
+        db.close()
+    if not rows:
+        return 0
+    outcomes = _send(rows, rate_limited=lane == "broadcast")
+    db = SessionLocal()
+    try:
+        _finish(db, lane, outcomes)
+    finally:
+        db.close()
+    return len(rows)
+
+
+def drain(budget_seconds: float) -> Dict[str, int]:
+    # Serverless (/admin/cron/outbox): replies first, then broadcasts, until empty or out of time
+    deadline = time.monotonic() + budget_seconds
+    drained = {lane: 0 for lane in LANES}
+    for lane in LANES:
+        while time.monotonic() < deadline:
+            n = drain_once(lane)
+            drained[lane] += n
+            if not n:
+                break
+    return drained
+
+
+def prune(db: Session) -> int:
+    return crud.delete_sent_outbox(db, datetime.utcnow() - timedelta(hours=settings.outbox_retention_hours))
+
+
+def stats(db: Session) -> dict:
+    names = {p: lane for lane, priorities in LANES.items() for p in priorities}
+    counts = crud.outbox_stats(db)
+    return {status: {names.get(p, str(p)): n for p, n in by_priority.items()} for status, by_priority in counts.items()}
+
+
+class OutboxSender:
+    # One thread per lane. Commits that staged messages wake the lanes at once; otherwise they
+    # poll for retries that became due and rows written by other processes.
+    def __init__(self, poll_interval: float):
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._wake = {lane: threading.Event() for lane in LANES}
+        self._threads: List[threading.Thread] = []
+        self._last_prune = time.monotonic()
+
+    def wake(self) -> None:
+        for event in self._wake.values():
+            event.set()
+
+    def _maybe_prune(self, interval: float = 3600.0) -> None:
+        if time.monotonic() - self._last_prune < interval:
+            return
+        self._last_prune = time.monotonic()
+        db = SessionLocal()
+        try:
+            prune(db)
+        finally:
+            db.close()
+
+    def _run(self, lane: str) -> None:
+        wake = self._wake[lane]
+        while not self._stop.is_set():
+            try:
+                drained = drain_once(lane)
+                if lane == "reply":
+                    self._maybe_prune()
+            except Exception:
+                logger.exception("outbox sender error (%s)", lane)
+                drained = 0
+            if not drained:
+                wake.wait(self.poll_interval)
+                wake.clear()
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        self._stop.clear()
+        for lane in LANES:
+            t = threading.Thread(target=self._run, args=(lane,), name=f"outbox-{lane}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        self.wake()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+
+outbox_sender = OutboxSender(poll_interval=settings.outbox_poll_interval)
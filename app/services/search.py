@@ -0,0 +1,323 @@
+import heapq
+import logging
+import re
+import threading
+import time
+from functools import lru_cache
+from bisect import bisect_left, bisect_right, insort
+from typing import Dict, FrozenSet, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+from sqlalchemy.orm import Session
+from .. import crud
+from ..config import settings
+from ..db import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Synonyms and common spellings, applied to listing tokens and query terms alike
+ALIASES = {
+    "CORN": "MAIZE",
+    "MAHINDI": "MAIZE",
+    "MAHARAGWE": "BEANS",
+    "NDENGU": "GRAMS",
+    "MCHELE": "RICE",
+    "VIAZI": "POTATOES",
+    "NRB": "NAIROBI",
+    "MSA": "MOMBASA",
+    "KSM": "KISUMU",
+    "KGS": "KG",
+    "KILO": "KG",
+    "KILOS": "KG",
+    "KILOGRAM": "KG",
+    "KILOGRAMS": "KG",
+    "TONNE": "TON",
+    "TONNES": "TON",
+    "TONS": "TON",
+    "BAGS": "BAG",
+    "GUNIA": "BAG",
+}
+_WORD = re.compile(r"[A-Z0-9]+")
+# Relative cost of probing a set / sorting an id in C, in per-listing checks done in Python
+_PROBE_COST = 0.05
+_SORT_COST = 0.1
+
+
+class IndexedListing(NamedTuple):
+    id: int
+    commodity: str
+    quantity: float
+    unit: str
+    location: str
+    quality: Optional[str]
+    min_price: Optional[float]
+
+
+def index_entry(listing) -> IndexedListing:
+    # Snapshot of a Listing, safe to hand to on_commit
+    return IndexedListing(
+        listing.id, listing.commodity, listing.quantity, listing.unit, listing.location, listing.quality, listing.min_price
+    )
+
+
+@lru_cache(maxsize=4096)
+def tokenize(text: Optional[str]) -> Tuple[str, ...]:
+    return tuple(ALIASES.get(word, word) for word in _WORD.findall((text or "").upper()))
+
+
+@lru_cache(maxsize=65536)
+def _listing_tokens(commodity: str, location: str, quality: Optional[str], unit: str) -> FrozenSet[str]:
+    # Few distinct combinations: listings share one frozenset each
+    return frozenset(t for field in (commodity, location, quality, unit) for t in tokenize(field))
+
+
+def parse_query(args: Iterable[str]) -> Tuple[List[str], Optional[float], Optional[float]]:
+    # SEARCH <terms> [min qty] [max price]: words are terms, the first number is the minimum
+    # quantity and the second the maximum price
+    terms, numbers = [], []
+    for word in args:
+        try:
+            numbers.append(float(word))
+        except ValueError:
+            terms.extend(tokenize(word))
+    min_qty = numbers[0] if numbers else None
+    max_price = numbers[1] if len(numbers) > 1 else None
+    return terms, min_qty, max_price
+
+
+def _price_key(min_price: Optional[float]) -> float:
+    # No minimum price fits any budget
+    return 0.0 if min_price is None else min_price
+
+
+class SearchIndex:
+    # Inverted index over open listings: token -> ascending listing ids (plus the same ids as a
+    # set), a sorted vocabulary for prefix terms, and (value, id) arrays sorted by quantity and by
+    # min price for the numeric filters. A query picks the cheapest plan from the source sizes
+    # (walk one source newest-first checking the rest per listing, or intersect the term sets
+    # first) and stops after `limit` matches. Warmed from the DB, then updated after commit;
+    # refresh_interval bounds staleness when several processes write. Reloads are built off the
+    # query path and swapped in, so queries never wait on the DB once the index is warm.
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self._listings: Dict[int, IndexedListing] = {}
+        self._tokens: Dict[int, FrozenSet[str]] = {}
+        self._postings: Dict[str, List[int]] = {}
+        self._sets: Dict[str, Set[int]] = {}
+        self._vocab: List[str] = []
+        self._ids: List[int] = []
+        self._by_qty: List[Tuple[float, int]] = []
+        self._by_price: List[Tuple[float, int]] = []
+        self._warmed_at: Optional[float] = None
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+        self._refreshing = False
+        # add/remove calls made while a load reads the DB, replayed on the new copy
+        self._changes: Optional[List[Tuple[str, object]]] = None
+        self.queries = 0
+
+    @property
+    def warm(self) -> bool:
+        return self._warmed_at is not None
+
+    def load(self, db: Session) -> None:
+        with self._load_lock:
+            with self._lock:
+                self._changes = []
+            try:
+                entries = sorted(map(IndexedListing._make, crud.open_listing_search_rows(db)))
+                listings = {e.id: e for e in entries}
+                tokens = {e.id: _listing_tokens(e.commodity, e.location, e.quality, e.unit) for e in entries}
+                postings: Dict[str, List[int]] = {}
+                for listing_id, listing_tokens in tokens.items():
+                    for token in listing_tokens:
+                        postings.setdefault(token, []).append(listing_id)
+                sets = {token: set(ids) for token, ids in postings.items()}
+                by_qty = sorted((e.quantity, e.id) for e in entries)
+                by_price = sorted((_price_key(e.min_price), e.id) for e in entries)
+            except BaseException:
+                with self._lock:
+                    self._changes = None
+                raise
+            with self._lock:
+                self._listings = listings
+                self._tokens = tokens
+                self._postings = postings
+                self._sets = sets
+                self._vocab = sorted(postings)
+                self._ids = [e.id for e in entries]
+                self._by_qty = by_qty
+                self._by_price = by_price
+                self._warmed_at = time.monotonic()
+                changes, self._changes = self._changes, None
+                for op, arg in changes:
+                    if op == "add":
+                        self._add(arg)
+                    else:
+                        self._remove(arg)
+
+    def ensure_warm(self, db: Session) -> None:
+        # Cold (first query on a fresh instance): load now. Stale: keep answering from the current
+        # copy while a background thread rebuilds it.
+        if not self.warm:
+            self.load(db)
+            return
+        with self._lock:
+            stale = self.refresh_interval > 0 and time.monotonic() - self._warmed_at > self.refresh_interval
+            if not stale or self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, name="search-index-refresh", daemon=True).start()
+
+    def _refresh(self) -> None:
+        db = SessionLocal()
+        try:
+            self.load(db)
+        except Exception:
+            logger.exception("search index refresh failed")
+        finally:
+            db.close()
+            with self._lock:
+                self._refreshing = False
+
+    def add(self, entry: IndexedListing) -> None:
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append(("add", entry))
+            if self.warm:
+                self._add(entry)
+
+    def remove(self, listing_ids: Iterable[int]) -> None:
+        listing_ids = list(listing_ids)
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append(("remove", listing_ids))
+            self._remove(listing_ids)
+
+    def _add(self, entry: IndexedListing) -> None:
+        if entry.id in self._listings:
+            return
+        tokens = _listing_tokens(entry.commodity, entry.location, entry.quality, entry.unit)
+        self._listings[entry.id] = entry
+        self._tokens[entry.id] = tokens
+        for token in tokens:
+            posting = self._postings.get(token)
+            if posting is None:
+                posting = self._postings[token] = []
+                self._sets[token] = set()
+                insort(self._vocab, token)
+            insort(posting, entry.id)
+            self._sets[token].add(entry.id)
+        insort(self._ids, entry.id)
+        insort(self._by_qty, (entry.quantity, entry.id))
+        insort(self._by_price, (_price_key(entry.min_price), entry.id))
+
+    def _remove(self, listing_ids: List[int]) -> None:
+        for listing_id in listing_ids:
+            entry = self._listings.pop(listing_id, None)
+            if entry is None:
+                continue
+            for token in self._tokens.pop(listing_id):
+                posting = self._postings[token]
+                del posting[bisect_left(posting, listing_id)]
+                self._sets[token].discard(listing_id)
+                if not posting:
+                    del self._postings[token]
+                    del self._sets[token]
+                    del self._vocab[bisect_left(self._vocab, token)]
+            del self._ids[bisect_left(self._ids, listing_id)]
+            del self._by_qty[bisect_left(self._by_qty, (entry.quantity, listing_id))]
+            del self._by_price[bisect_left(self._by_price, (_price_key(entry.min_price), listing_id))]
+
+    def _expand(self, term: str) -> List[str]:
+        # Vocabulary tokens starting with `term` (a contiguous run of the sorted vocabulary)
+        start = bisect_left(self._vocab, term)
+        end = start
+        while end < len(self._vocab) and self._vocab[end].startswith(term):
+            end += 1
+        return self._vocab[start:end]
+
+    def _ids_having(self, tokens: List[str]) -> Set[int]:
+        if len(tokens) == 1:
+            return self._sets[tokens[0]]
+        return set().union(*(self._sets[t] for t in tokens))
+
+    def _walk(self, tokens: List[str]) -> Iterator[int]:
+        # Ids of listings having any of `tokens`, newest first, without duplicates
+        if len(tokens) == 1:
+            yield from reversed(self._postings[tokens[0]])
+            return
+        last = None
+        for listing_id in heapq.merge(*(reversed(self._postings[t]) for t in tokens), reverse=True):
+            if listing_id != last:
+                last = listing_id
+                yield listing_id
+
+    def search(
+        self, terms: List[str], min_qty: Optional[float] = None, max_price: Optional[float] = None, limit: int = 10
+    ) -> Tuple[List[IndexedListing], bool]:
+        # Top `limit` matches, newest first, and whether there are more
+        with self._lock:
+            self.queries += 1
+            groups = [self._expand(term) for term in dict.fromkeys(terms)]
+            n = len(self._ids)
+            if not n or any(not g for g in groups):
+                return [], False
+            qty_from = bisect_left(self._by_qty, (min_qty,)) if min_qty is not None else 0
+            price_to = bisect_right(self._by_price, (max_price, float("inf"))) if max_price is not None else n
+            sizes = [sum(len(self._postings[t]) for t in g) for g in groups]
+            numeric = [(n - qty_from, "qty")] if min_qty is not None else []
+            if max_price is not None:
+                numeric.append((price_to, "price"))
+            # Expected matches assuming independent conditions; walking a source of `size` ids
+            # newest-first finds `limit` of them after about limit * size / matches checks
+            term_matches = float(n)
+            for size in sizes:
+                term_matches *= size / n
+            matches = term_matches
+            for size, _ in numeric:
+                matches *= size / n
+            matches = max(matches, 1.0)
+
+            def scan(size: float) -> float:
+                return min(size, limit * size / matches)
+
+            plans = [(scan(n), "all", None)]
+            plans += [(scan(size), "terms", i) for i, size in enumerate(sizes)]
+            plans += [(size * _SORT_COST + scan(size), kind, None) for size, kind in numeric]
+            if len(groups) > 1:
+                # Prefix terms are unioned first; the smallest set is then probed against the others
+                probes = sum(size for size, g in zip(sizes, groups) if len(g) > 1) + min(sizes) * (len(groups) - 1)
+                plans.append((probes * _PROBE_COST + term_matches * _SORT_COST + scan(term_matches), "intersect", None))
+            _, plan, source = min(plans, key=lambda p: p[0])
+            checks = [set(g) for g in groups]
+            if plan == "all":
+                driver: Iterable[int] = reversed(self._ids)
+            elif plan == "terms":
+                driver = self._walk(groups[source])
+            elif plan == "qty":
+                driver = sorted((i for _, i in self._by_qty[qty_from:]), reverse=True)
+            elif plan == "price":
+                driver = sorted((i for _, i in self._by_price[:price_to]), reverse=True)
+            else:
+                id_sets = sorted((self._ids_having(g) for g in groups), key=len)
+                driver = sorted(id_sets[0].intersection(*id_sets[1:]), reverse=True)
+                checks = []
+            found: List[IndexedListing] = []
+            for listing_id in driver:
+                entry = self._listings[listing_id]
+                if min_qty is not None and entry.quantity < min_qty:
+                    continue
+                if max_price is not None and _price_key(entry.min_price) > max_price:
+                    continue
+                tokens = self._tokens[listing_id]
+                if all(not tokens.isdisjoint(check) for check in checks):
+                    found.append(entry)
+                    if len(found) > limit:
+                        return found[:limit], True
+            return found, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"listings": len(self._listings), "tokens": len(self._vocab), "queries": self.queries, "warm": self.warm}
+
+
+search_index = SearchIndex(refresh_interval=settings.search_index_refresh)
@@ -0,0 +1,131 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+from sqlalchemy.orm import Session
+from .. import crud
+from ..config import settings
+from ..db import on_commit
+
+
+@dataclass
+class FlowState:
+    flow: Optional[str]
+    step: Optional[int]
+    data: dict = field(default_factory=dict)
+    updated_at: Optional[datetime] = None
+
+
+class SessionStore:
+    # Write-through LRU/TTL cache of per-user conversation state. Misses (no active flow) are cached
+    # too, since most messages come from users who are not in a flow, but only for miss_ttl seconds,
+    # so a flow another instance started is not hidden for the full cache_ttl. Flows idle longer
+    # than flow_ttl are treated as abandoned and deleted.
+    def __init__(
+        self,
+        capacity: int,
+        cache_ttl: float,
+        flow_ttl: timedelta,
+        miss_ttl: float = 5.0,
+        prune_interval: float = 3600.0,
+    ):
+        self.capacity = capacity
+        self.cache_ttl = cache_ttl
+        self.miss_ttl = min(miss_ttl, cache_ttl)
+        self.flow_ttl = flow_ttl
+        self.prune_interval = prune_interval
+        self._last_prune = time.monotonic()
+        self._cache: "OrderedDict[int, Tuple[float, Optional[FlowState]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, user_id: int):
+        if self.cache_ttl <= 0:
+            return False, None
+        with self._lock:
+            entry = self._cache.get(user_id)
+            if entry is None:
+                return False, None
+            expires, state = entry
+            if expires < time.monotonic():
+                del self._cache[user_id]
+                return False, None
+            self._cache.move_to_end(user_id)
+            return True, state
+
+    def _put(self, user_id: int, state: Optional[FlowState]) -> None:
+        ttl = self.cache_ttl if state is not None else self.miss_ttl
+        if ttl <= 0:
+            self._drop(user_id)
+            return
+        with self._lock:
+            self._cache[user_id] = (time.monotonic() + ttl, state)
+            self._cache.move_to_end(user_id)
+            while len(self._cache) > self.capacity:
+                self._cache.popitem(last=False)
+
+    def _drop(self, user_id: int) -> None:
+        with self._lock:
+            self._cache.pop(user_id, None)
+
+    def _abandoned(self, state: FlowState) -> bool:
+        return state.updated_at is not None and state.updated_at < datetime.utcnow() - self.flow_ttl
+
+    def get(self, db: Session, user_id: int) -> Optional[FlowState]:
+        hit, state = self._cached(user_id)
+        if not hit:
+            row = crud.get_session_state(db, user_id)
+            state = None
+            if row is not None and row.flow:
+                state = FlowState(row.flow, row.step, json.loads(row.data_json or "{}"), row.updated_at)
+            elif row is not None:
+                # Leftover cleared state from older versions; drop it
+                crud.delete_session_state(db, user_id)
+            # Inside a transaction (several messages of a batch) cache only what has committed
+            loaded = state
+            on_commit(db, lambda: self._put(user_id, loaded))
+            self.maybe_prune(db)
+        if state is not None and self._abandoned(state):
+            self.clear(db, user_id)
+            return None
+        return state
+
+    def set(self, db: Session, user_id: int, flow: str, step: int, data: dict) -> FlowState:
+        state = FlowState(flow, step, dict(data), datetime.utcnow())
+        crud.upsert_session_state(db, user_id, flow=flow, step=step, data_json=json.dumps(data))
+        # Publish to the cache only once the write is durable
+        self._drop(user_id)
+        on_commit(db, lambda: self._put(user_id, state))
+        return state
+
+    def clear(self, db: Session, user_id: int) -> None:
+        crud.delete_session_state(db, user_id)
+        self._drop(user_id)
+        on_commit(db, lambda: self._put(user_id, None))
+
+    def prune(self, db: Session) -> int:
+        # Bulk-delete abandoned flows (e.g. from a periodic job)
+        return crud.delete_stale_session_states(db, datetime.utcnow() - self.flow_ttl)
+
+    def maybe_prune(self, db: Session) -> None:
+        now = time.monotonic()
+        if now - self._last_prune < self.prune_interval:
+            return
+        self._last_prune = now
+        self.prune(db)
+
+
+def _cache_ttl() -> float:
+    if settings.session_cache_ttl is not None:
+        return settings.session_cache_ttl
+    return 0.0 if settings.is_serverless else 300.0
+
+
+session_store = SessionStore(
+    capacity=settings.session_cache_size,
+    cache_ttl=_cache_ttl(),
+    flow_ttl=timedelta(minutes=settings.session_flow_ttl_minutes),
+    miss_ttl=settings.session_miss_ttl,
+)
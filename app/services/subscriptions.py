@@ -0,0 +1,87 @@
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+from sqlalchemy.orm import Session
+from .. import crud
+from ..config import settings
+
+Key = Tuple[str, str]
+
+
+def _key(commodity: str, region: str) -> Key:
+    return (commodity.strip().upper(), region.strip().upper())
+
+
+class SubscriptionIndex:
+    # (commodity, region) -> set of subscribed phones, plus each phone's role, so listing fan-out
+    # is a dict lookup instead of a users x opt_ins join. Warmed once from the DB, then updated
+    # incrementally after commit; refresh_interval bounds staleness when several processes write.
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self._phones_by_key: Dict[Key, Set[str]] = {}
+        self._keys_by_phone: Dict[str, Set[Key]] = {}
+        self._roles: Dict[str, str] = {}
+        self._warmed_at: Optional[float] = None
+        self._lock = threading.RLock()
+
+    @property
+    def warm(self) -> bool:
+        return self._warmed_at is not None
+
+    def load(self, db: Session) -> None:
+        phones_by_key: Dict[Key, Set[str]] = {}
+        keys_by_phone: Dict[str, Set[Key]] = {}
+        roles: Dict[str, str] = {}
+        for phone, role, commodity, region in crud.list_active_subscriptions(db):
+            key = _key(commodity, region)
+            phones_by_key.setdefault(key, set()).add(phone)
+            keys_by_phone.setdefault(phone, set()).add(key)
+            roles[phone] = role
+        with self._lock:
+            self._phones_by_key = phones_by_key
+            self._keys_by_phone = keys_by_phone
+            self._roles = roles
+            self._warmed_at = time.monotonic()
+
+    def ensure_warm(self, db: Session) -> None:
+        stale = self.warm and self.refresh_interval > 0 and time.monotonic() - self._warmed_at > self.refresh_interval
+        if not self.warm or stale:
+            self.load(db)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._warmed_at = None
+
+    def subscribe(self, phone: str, role: str, commodity: str, region: str) -> None:
+        with self._lock:
+            if not self.warm:
+                return
+            key = _key(commodity, region)
+            self._phones_by_key.setdefault(key, set()).add(phone)
+            self._keys_by_phone.setdefault(phone, set()).add(key)
+            self._roles[phone] = role
+
+    def set_role(self, phone: str, role: str) -> None:
+        with self._lock:
+            if phone in self._roles:
+                self._roles[phone] = role
+
+    def buyers_for(self, commodity: str, region: str) -> List[str]:
+        with self._lock:
+            phones = self._phones_by_key.get(_key(commodity, region), ())
+            return [p for p in phones if self._roles.get(p) == "buyer"]
+
+    def subscriptions_for(self, phone: str) -> List[Key]:
+        with self._lock:
+            return sorted(self._keys_by_phone.get(phone, ()))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "warm": self.warm,
+                "keys": len(self._phones_by_key),
+                "subscribers": len(self._roles),
+            }
+
+
+subscription_index = SubscriptionIndex(refresh_interval=settings.subscription_index_refresh)
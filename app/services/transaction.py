@@ -0,0 +1,20 @@
+from contextlib import contextmanager
+from sqlalchemy.orm import Session
+from .. import whatsapp as wa
+from ..db import in_unit_of_work, unit_of_work
+from . import outbox
+
+
+@contextmanager
+def transaction(db: Session):
+    # One DB transaction; WhatsApp sends made inside it are written to the outbox in that transaction
+    # or, with the outbox off, go out only after it commits
+    if in_unit_of_work(db):
+        # Nested (e.g. one message of a batch): the outer transaction commits and sends
+        yield db
+        return
+    with wa.deferred_sends() as pending:
+        with unit_of_work(db):
+            yield db
+            outbox.stage(db, pending)
+    wa.flush_sends(pending)
@@ -0,0 +1,185 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Iterator, List, Optional
+from .. import crud
+from .. import whatsapp as wa
+from ..broadcast import flush_concurrently
+from ..config import settings
+from ..db import SessionLocal, unit_of_work
+from .flows import handle_text_message
+from .dedup import DuplicateMessage, deduper
+from . import outbox
+from . import delivery
+from .inbound_limits import inbound_limiter, COOLDOWN_TEXT
+from .dispatcher import dispatcher, DispatcherFull
+from .transaction import transaction
+
+
+def _message_text(m: dict) -> Optional[str]:
+    mtype = m.get("type")
+    if mtype == "text":
+        return m.get("text", {}).get("body", "")
+    if mtype == "button":
+        # Handle interactive button postbacks if used later
+        return m.get("button", {}).get("text", "")
+    if mtype == "interactive":
+        # List/Reply selections can be mapped to text commands
+        interactive = m.get("interactive", {})
+        button_reply = interactive.get("button_reply")
+        list_reply = interactive.get("list_reply")
+        text = None
+        if button_reply:
+            text = button_reply.get("title")
+        if list_reply:
+            text = list_reply.get("title")
+        return text
+    return None
+
+
+def iter_text_messages(payload: dict) -> Iterator[dict]:
+    # Parse messages: entry -> changes -> value -> messages
+    for entry in payload.get("entry", []):
+        for change in entry.get("changes", []):
+            value = change.get("value", {})
+            for m in value.get("messages", []):
+                from_phone = m.get("from")
+                text = _message_text(m)
+                if from_phone and text is not None:
+                    if m.get("type") == "interactive" and not text:
+                        continue
+                    yield {"id": m.get("id"), "from": from_phone, "text": text}
+
+
+def handle_inbound(m: dict) -> bool:
+    # Runs on a dispatcher lane with its own DB session
+    db = SessionLocal()
+    try:
+        # Meta redelivers payloads; drop messages whose wamid was already handled
+        if not settings.db_unit_of_work:
+            if deduper.is_duplicate(db, m["id"]):
+                return False
+            try:
+                handle_text_message(db, m["from"], m["text"])
+            except Exception:
+                deduper.forget(db, m["id"])
+                raise
+            return True
+        try:
+            with transaction(db):
+                deduper.claim(db, [m["id"]])
+                handle_text_message(db, m["from"], m["text"])
+        except DuplicateMessage:
+            return False
+        deduper.maybe_prune(db)
+        return True
+    finally:
+        db.close()
+
+
+def handle_group(phone: str, user_id: int, messages: List[dict]) -> int:
+    # Batch path: all of one sender's messages from a payload in a single transaction, on the
+    # sender's dispatcher lane. Replies are staged in the outbox or, with it off, go out after the
+    # commit, different recipients in parallel. The wamids are claimed in the same transaction.
+    db = SessionLocal()
+    try:
+        user = crud.attach_user(db, user_id, phone)
+        try:
+            with wa.deferred_sends() as pending, unit_of_work(db):
+                deduper.claim(db, [m["id"] for m in messages])
+                for m in messages:
+                    handle_text_message(db, phone, m["text"], user=user)
+                outbox.stage(db, pending)
+        except DuplicateMessage:
+            # Raced with a redelivery of some of them: claim and handle them one by one
+            return sum(handle_inbound(m) for m in messages)
+        flush_concurrently(pending)
+        return len(messages)
+    finally:
+        db.close()
+
+
+def _batch_enabled(messages: List[dict]) -> bool:
+    return settings.webhook_batch and settings.db_unit_of_work and len(messages) > 1
+
+
+def _dispatch_each(messages: List[dict]) -> List[Future]:
+    return [dispatcher.submit(m["from"], handle_inbound, m) for m in messages]
+
+
+def _dispatch_batch(messages: List[dict]) -> List[Future]:
+    # One dedup round trip and one bulk user upsert for the whole payload, then one task per sender
+    db = SessionLocal()
+    try:
+        new = deduper.unseen(db, [m["id"] for m in messages])
+        groups: Dict[str, List[dict]] = OrderedDict()
+        for m in messages:
+            if m["id"] and m["id"] not in new:
+                continue
+            new.discard(m["id"])
+            groups.setdefault(m["from"], []).append(m)
+        user_ids = crud.get_or_create_users(db, groups.keys())
+        futures: List[Future] = []
+        pending = list(groups.items())
+        for phone, group in pending:
+            # DispatcherFull propagates: nothing was claimed, Meta's redelivery goes through
+            futures.append(dispatcher.submit(phone, handle_group, phone, user_ids[phone], group))
+        return futures
+    finally:
+        db.close()
+
+
+def _admit(messages: List[dict]) -> List[dict]:
+    # Per-sender rate limit and load shedding before any DB work for the message
+    if not settings.inbound_rate_limit or not messages:
+        return messages
+    admitted, cooldown = inbound_limiter.admit(messages, dispatcher.queue_depth())
+    for phone in cooldown:
+        try:
+            dispatcher.submit(phone, wa.send_text, phone, COOLDOWN_TEXT)
+        except DispatcherFull:
+            pass
+    return admitted
+
+
+def record_statuses(statuses: List[dict]) -> int:
+    db = SessionLocal()
+    try:
+        return delivery.ingest_statuses(db, statuses)
+    finally:
+        db.close()
+
+
+def _statuses(payload: dict) -> List[dict]:
+    return list(delivery.iter_statuses(payload)) if settings.delivery_tracking else []
+
+
+def dispatch_payload(payload: dict) -> List[Future]:
+    # Blocking entry point (queue workers): delivery receipts are recorded inline, then the messages
+    # are handed to the dispatcher; the caller waits on the returned futures
+    statuses = _statuses(payload)
+    if statuses:
+        record_statuses(statuses)
+    messages = _admit(list(iter_text_messages(payload)))
+    if _batch_enabled(messages):
+        return _dispatch_batch(messages)
+    return _dispatch_each(messages)
+
+
+async def process_payload_async(payload: dict) -> int:
+    # Event-loop friendly variant for the webhook: the blocking work runs on dispatcher threads
+    statuses = _statuses(payload)
+    if statuses:
+        await asyncio.to_thread(record_statuses, statuses)
+    messages = list(iter_text_messages(payload))
+    if inbound_limiter.backend == "db" and messages:
+        messages = await asyncio.to_thread(_admit, messages)
+    else:
+        messages = _admit(messages)
+    if _batch_enabled(messages):
+        # The bulk dedup/user queries block, so run them off the event loop too
+        futures = await asyncio.to_thread(_dispatch_batch, messages)
+    else:
+        futures = _dispatch_each(messages)
+    results = await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
+    return sum(int(r) for r in results)
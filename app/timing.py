@@ -0,0 +1,20 @@
+import sys
+import time
+
+# Cold-start timeline: milliseconds since this module was first imported (the start of app import).
+_started = time.perf_counter()
+_marks: dict = {}
+
+# Modules that the health check and webhook verification should not need to import
+HEAVY_MODULES = ("sqlalchemy", "httpx", "app.db", "app.whatsapp", "app.services.flows")
+
+
+def mark(name: str) -> None:
+    _marks.setdefault(name, round((time.perf_counter() - _started) * 1000, 2))
+
+
+def report() -> dict:
+    return {
+        "marks_ms": dict(_marks),
+        "loaded": {name: name in sys.modules for name in HEAVY_MODULES},
+    }
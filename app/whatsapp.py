@@ -1,29 +1,118 @@
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterable, List, Optional, Tuple
 import httpx
-from typing import Iterable
 from .config import settings
+from . import metrics
 
-GRAPH_BASE = "https://graph.facebook.com/v20.0"
+# Process-wide pooled clients: one TCP+TLS handshake is reused across sends.
+_client: Optional[httpx.Client] = None
+_client_lock = threading.Lock()
+
+# When set, sends are collected here instead of going out immediately (see deferred_sends).
+_deferred: ContextVar[Optional[List[Tuple[str, object, str]]]] = ContextVar("wa_deferred_sends", default=None)
 
 
 def _messages_url() -> str:
-    return f"{GRAPH_BASE}/{settings.wa_phone_number_id}/messages"
+    return f"{settings.wa_graph_base.rstrip('/')}/{settings.wa_phone_number_id}/messages"
+
+
+def _http2_available() -> bool:
+    # HTTP/2 needs the optional 'h2' package (pip install httpx[http2])
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _client_kwargs() -> dict:
+    return {
+        "timeout": httpx.Timeout(settings.wa_http_timeout, connect=5.0),
+        "limits": httpx.Limits(
+            max_connections=settings.wa_http_max_connections,
+            max_keepalive_connections=settings.wa_http_max_keepalive,
+            keepalive_expiry=settings.wa_http_keepalive_expiry,
+        ),
+        "http2": settings.wa_http2 and _http2_available(),
+        "headers": {
+            "Authorization": f"Bearer {settings.wa_access_token}",
+            "Content-Type": "application/json",
+        },
+        "event_hooks": metrics.http_event_hooks(),
+    }
+
+
+def get_client() -> httpx.Client:
+    global _client
+    if _client is None or _client.is_closed:
+        with _client_lock:
+            if _client is None or _client.is_closed:
+                _client = httpx.Client(**_client_kwargs())
+    return _client
+
+
+def use_transport(transport: httpx.BaseTransport) -> None:
+    # Route Graph API calls through a custom transport (benchmarks, local stand-ins)
+    global _client
+    kwargs = _client_kwargs()
+    kwargs.pop("http2")
+    with _client_lock:
+        _client = httpx.Client(transport=transport, **kwargs)
 
 
-def send_text(to_phone: str, body: str) -> None:
-    payload = {
+def close_clients() -> None:
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def _text_payload(to_phone: str, body: str) -> dict:
+    return {
         "messaging_product": "whatsapp",
         "to": to_phone,
         "type": "text",
         "text": {"preview_url": False, "body": body},
     }
-    headers = {
-        "Authorization": f"Bearer {settings.wa_access_token}",
-        "Content-Type": "application/json",
-    }
-    with httpx.Client(timeout=20.0) as client:
-        client.post(_messages_url(), headers=headers, json=payload)
 
 
-def broadcast_text(recipients: Iterable[str], body: str) -> None:
-    for phone in recipients:
-        send_text(phone, body)
\ No newline at end of file
+def send_text(to_phone: str, body: str) -> Optional[httpx.Response]:
+    pending = _deferred.get()
+    if pending is not None:
+        pending.append(("text", to_phone, body))
+        return None
+    return get_client().post(_messages_url(), json=_text_payload(to_phone, body))
+
+
+def broadcast_text(recipients: Iterable[str], body: str):
+    # Concurrent, rate-limited fan-out; returns a BroadcastSummary with per-recipient results
+    pending = _deferred.get()
+    if pending is not None:
+        pending.append(("broadcast", list(recipients), body))
+        return None
+    from .broadcast import broadcast
+
+    return broadcast(recipients, body)
+
+
+@contextmanager
+def deferred_sends():
+    # Collect outbound messages so they can be sent only after the DB transaction commits.
+    pending: List[Tuple[str, object, str]] = []
+    token = _deferred.set(pending)
+    try:
+        yield pending
+    finally:
+        _deferred.reset(token)
+
+
+def flush_sends(pending: List[Tuple[str, object, str]]) -> None:
+    for kind, to, body in pending:
+        if kind == "broadcast":
+            broadcast_text(to, body)
+        else:
+            send_text(to, body)
+    pending.clear()
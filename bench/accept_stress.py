@@ -0,0 +1,152 @@
+"""Concurrency stress test for BID / ACCEPT (optimistic listing versions).
+
+    python -m bench.accept_stress [--listings 50] [--bids-per-listing 40] [--accepts-per-listing 6] [--threads 16]
+
+Seeds sellers with open listings (a few bids each), then runs shuffled BID and ACCEPT
+commands from a thread pool, each with its own session, against SQLite WAL (or
+--database-url). Several ACCEPTs per listing race one another and the incoming bids.
+Replies go to an in-process stub transport and are classified. Reports commands/sec, the
+ACCEPT outcomes (accepted / version conflict / already closed) and checks the invariants:
+exactly one accepted bid per closed listing and no bid left 'placed' on a closed listing.
+Exits 1 when an invariant is broken.
+WARNING: with --database-url the app tables in that database are dropped and recreated.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+OUTCOMES = (
+    ("Accepted bid", "accepted"),
+    ("changed while you were accepting", "conflict"),
+    ("already closed", "closed"),
+    ("Bid placed", "bid placed"),
+    ("Listing not found or closed", "bid refused"),
+)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--listings", type=int, default=50)
+    parser.add_argument("--seed-bids", type=int, default=3, help="bids per listing before the run (ACCEPT targets)")
+    parser.add_argument("--bids-per-listing", type=int, default=40)
+    parser.add_argument("--accepts-per-listing", type=int, default=6)
+    parser.add_argument("--buyers", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--database-url", help="scratch database (default: a temporary SQLite file, WAL)")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    # Settings are read at import time
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{tempfile.mkdtemp(prefix='wa-accept-')}/accept.db"
+    os.environ.update(SQLITE_TUNING="true", SQLITE_WAL="true", OUTBOX="false", NOTIFY_DIGEST_WINDOW="0")
+    os.environ.setdefault("WA_ACCESS_TOKEN", "bench")
+    os.environ.setdefault("WA_PHONE_NUMBER_ID", "bench")
+
+    import httpx
+    from sqlalchemy import func, select
+    from app import crud, models, whatsapp as wa
+    from app.db import Base, SessionLocal, get_engine
+    from app.migrations import run_migrations
+    from app.services.flows import handle_text_message
+
+    engine = get_engine()
+    if not engine.url.drivername.startswith("sqlite"):
+        Base.metadata.drop_all(bind=engine)
+    run_migrations(engine)
+
+    outcomes = Counter()
+    lock = threading.Lock()
+
+    def stub(request: httpx.Request) -> httpx.Response:
+        body = request.read().decode()
+        for marker, outcome in OUTCOMES:
+            if marker in body:
+                with lock:
+                    outcomes[outcome] += 1
+                break
+        return httpx.Response(200, json={"messages": [{"id": "wamid.stress"}]})
+
+    wa.use_transport(httpx.MockTransport(stub))
+
+    rng = random.Random(args.seed)
+    db = SessionLocal()
+    buyers = [crud.get_or_create_user(db, f"2547{i:08d}").phone for i in range(args.buyers)]
+    buyer_ids = {phone: crud.get_or_create_user(db, phone).id for phone in buyers}
+    listings = []
+    for i in range(args.listings):
+        seller = crud.get_or_create_user(db, f"2541{i:08d}", default_role="seller")
+        listing = crud.create_listing(db, seller.id, "MAIZE", 100, "KG", "NAIROBI")
+        bid_ids = [
+            crud.create_bid(db, listing.id, buyer_ids[rng.choice(buyers)], 10 + j, 1, None).id for j in range(args.seed_bids)
+        ]
+        listings.append((listing.id, seller.phone, bid_ids))
+    db.close()
+
+    commands = []
+    for listing_id, seller_phone, bid_ids in listings:
+        commands += [(rng.choice(buyers), f"BID {listing_id} {rng.randint(10, 30)} 1") for _ in range(args.bids_per_listing)]
+        commands += [(seller_phone, f"ACCEPT {rng.choice(bid_ids)}") for _ in range(args.accepts_per_listing)]
+    rng.shuffle(commands)
+
+    errors = Counter()
+
+    def run(command) -> None:
+        phone, text = command
+        session = SessionLocal()
+        try:
+            handle_text_message(session, phone, text)
+        except Exception as exc:
+            with lock:
+                errors[type(exc).__name__] += 1
+        finally:
+            session.close()
+
+    print(f"{len(commands)} commands on {args.listings} listings, {args.threads} threads, {engine.url.drivername}")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(run, commands))
+    elapsed = time.perf_counter() - started
+
+    db = SessionLocal()
+    try:
+        accepted_per_listing = dict(
+            db.execute(
+                select(models.Bid.listing_id, func.count()).where(models.Bid.status == "accepted").group_by(models.Bid.listing_id)
+            ).all()
+        )
+        closed = set(db.execute(select(models.Listing.id).where(models.Listing.status == "closed")).scalars().all())
+        placed_on_closed = db.execute(
+            select(func.count()).select_from(models.Bid).where(models.Bid.status == "placed", models.Bid.listing_id.in_(closed))
+        ).scalar_one()
+    finally:
+        db.close()
+
+    attempts = outcomes["accepted"] + outcomes["conflict"] + outcomes["closed"]
+    print(f"  throughput        {len(commands) / elapsed:.1f} commands/sec ({elapsed:.2f}s)")
+    print(
+        f"  ACCEPT            {outcomes['accepted']} accepted, {outcomes['conflict']} version conflicts, "
+        f"{outcomes['closed']} already closed of {attempts} answered"
+    )
+    print(f"  conflict rate     {outcomes['conflict'] / attempts:.1%}" if attempts else "  conflict rate     n/a")
+    print(f"  BID               {outcomes['bid placed']} placed, {outcomes['bid refused']} refused (listing closed)")
+    print(f"  errors            {dict(errors) or 'none'}")
+
+    failures = []
+    if any(n != 1 for n in accepted_per_listing.values()) or set(accepted_per_listing) != closed:
+        failures.append("a closed listing does not have exactly one accepted bid")
+    if placed_on_closed:
+        failures.append(f"{placed_on_closed} bids still 'placed' on closed listings")
+    if failures:
+        print("FAIL: " + "; ".join(failures))
+        sys.exit(1)
+    print(f"OK: {len(closed)} listings closed, one accepted bid each")
+
+
+if __name__ == "__main__":
+    main()
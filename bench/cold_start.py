@@ -0,0 +1,109 @@
+"""Cold-start check for the Vercel entry point.
+
+    python -m bench.cold_start [--runs 5] [--budget-ms 1500]
+
+Each run imports api.index in a fresh interpreter (as a cold serverless instance would),
+then serves /health and the webhook verification GET through the raw ASGI interface.
+Fails (exit 1) when the median import time exceeds the budget or when those requests
+pulled in SQLAlchemy, httpx or the message flows - they must stay on the lazy path.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+async def _get(app, path: str, query: str = "") -> int:
+    messages = []
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 1),
+        "server": ("localhost", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    return next(m["status"] for m in messages if m["type"] == "http.response.start")
+
+
+def _child() -> dict:
+    started = time.perf_counter()
+    from api.index import app
+
+    import_ms = (time.perf_counter() - started) * 1000
+    from app import timing
+    from app.config import settings
+
+    statuses = [
+        asyncio.run(_get(app, "/health")),
+        asyncio.run(_get(app, "/webhook/whatsapp", f"hub.mode=subscribe&hub.verify_token={settings.wa_verify_token}&hub.challenge=1")),
+    ]
+    first_request_ms = (time.perf_counter() - started) * 1000 - import_ms
+    return {
+        "import_ms": round(import_ms, 1),
+        "first_requests_ms": round(first_request_ms, 1),
+        "statuses": statuses,
+        "loaded": [name for name, loaded in timing.report()["loaded"].items() if loaded],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=1500.0, help="median import time budget")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(_child()))
+        return
+
+    env = dict(os.environ, VERCEL="1", WA_VERIFY_TOKEN="cold-start")
+    results = []
+    for _ in range(args.runs):
+        out = subprocess.run(
+            [sys.executable, "-m", "bench.cold_start", "--child"], env=env, capture_output=True, text=True, check=True
+        )
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    median_import = statistics.median(r["import_ms"] for r in results)
+    median_requests = statistics.median(r["first_requests_ms"] for r in results)
+    loaded = sorted({name for r in results for name in r["loaded"]})
+    statuses = sorted({s for r in results for s in r["statuses"]})
+    print(f"import api.index   median {median_import:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    print(f"health + verify    median {median_requests:.1f} ms")
+    print(f"heavy modules      {', '.join(loaded) or 'none'}")
+
+    failures = []
+    if median_import > args.budget_ms:
+        failures.append(f"import time {median_import:.1f} ms over budget")
+    if loaded:
+        failures.append(f"eagerly loaded: {', '.join(loaded)}")
+    if statuses != [200]:
+        failures.append(f"unexpected statuses {statuses}")
+    if failures:
+        print("FAIL: " + "; ".join(failures))
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Micro-benchmark: inbound messages/sec for each DB pool profile.
+
+    python -m bench.db_profiles [--messages 2000] [--threads 8] [--postgres URL]
+
+Each profile runs in a fresh subprocess (settings are read at import time) against a
+fresh database: SQLite with default journaling, SQLite with WAL + tuned pragmas and,
+when --postgres points at a scratch database, NullPool vs QueuePool. Graph API calls
+go to an in-process stub transport, so only app + DB time is measured.
+WARNING: the Postgres runs drop and recreate all app tables in that database.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _child(messages: int, threads: int) -> dict:
+    import httpx
+    from app import crud, whatsapp as wa
+    from app.db import Base, SessionLocal, engine, resolve_pool_profile
+    from app.migrations import run_migrations
+    from app.services.webhook import handle_inbound
+
+    if not engine.url.drivername.startswith("sqlite"):
+        Base.metadata.drop_all(bind=engine)
+    run_migrations(engine)
+    wa.use_transport(httpx.MockTransport(lambda request: httpx.Response(200, json={"messages": [{"id": "wamid.bench"}]})))
+
+    db = SessionLocal()
+    seller = crud.get_or_create_user(db, "254700000000", default_role="seller")
+    listing = crud.create_listing(db, seller.id, "MAIZE", 100, "KG", "NAIROBI")
+    listing_id = listing.id
+    db.close()
+
+    def message(i: int) -> dict:
+        phone = f"2547{i % 500:08d}"
+        kind = i % 4
+        if kind == 0:
+            text = "SUBSCRIBE maize nairobi"
+        elif kind == 1:
+            text = f"BID {listing_id} {10 + i % 7} {1 + i % 5}"
+        elif kind == 2:
+            text = "LISTINGS"
+        else:
+            text = "HELP"
+        return {"id": f"wamid.bench.{i}", "from": phone, "text": text}
+
+    batch = [message(i) for i in range(messages)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(handle_inbound, batch))
+    elapsed = time.perf_counter() - started
+    profile = "sqlite" if engine.url.drivername.startswith("sqlite") else resolve_pool_profile()
+    return {
+        "profile": profile,
+        "sqlite_tuning": os.environ.get("SQLITE_TUNING"),
+        "messages": messages,
+        "seconds": round(elapsed, 3),
+        "msgs_per_sec": round(messages / elapsed, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--postgres", help="scratch Postgres URL to include the serverless/pooled profiles")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(_child(args.messages, args.threads)))
+        return
+
+    tmpdir = tempfile.mkdtemp(prefix="wa-bench-")
+    runs = [
+        ("sqlite-default", {"DATABASE_URL": f"sqlite:///{tmpdir}/default.db", "SQLITE_TUNING": "false"}),
+        ("sqlite-wal", {"DATABASE_URL": f"sqlite:///{tmpdir}/wal.db", "SQLITE_TUNING": "true"}),
+    ]
+    if args.postgres:
+        runs += [
+            ("postgres-serverless", {"DATABASE_URL": args.postgres, "DB_POOL_PROFILE": "serverless"}),
+            ("postgres-pooled", {"DATABASE_URL": args.postgres, "DB_POOL_PROFILE": "pooled"}),
+        ]
+    print(f"{'run':<22}{'messages':>10}{'seconds':>10}{'msgs/sec':>12}")
+    for name, env in runs:
+        child_env = dict(os.environ, **env, WA_ACCESS_TOKEN="bench", WA_PHONE_NUMBER_ID="bench", NOTIFY_DIGEST_WINDOW="0")
+        out = subprocess.run(
+            [sys.executable, "-m", "bench.db_profiles", "--child", "--messages", str(args.messages), "--threads", str(args.threads)],
+            env=child_env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        print(f"{name:<22}{result['messages']:>10}{result['seconds']:>10}{result['msgs_per_sec']:>12}")
+
+
+if __name__ == "__main__":
+    main()
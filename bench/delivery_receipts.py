@@ -0,0 +1,88 @@
+"""Check: delivery receipts are recorded the same way in both webhook modes.
+
+    python -m bench.delivery_receipts
+
+Posts one webhook payload carrying message statuses (a delivered and a failed receipt) to the app
+with WEBHOOK_MODE=sync and with WEBHOOK_MODE=queue, each in its own process against a temporary
+SQLite database. In queue mode it waits until the worker has drained the payload. It then counts
+the delivery_events and recipient_health rows. Exits 1 when a mode recorded nothing or the two
+modes disagree.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+PAYLOAD = {
+    "object": "whatsapp_business_account",
+    "entry": [{"changes": [{"value": {"statuses": [
+        {"id": "wamid.receipt-1", "status": "delivered", "recipient_id": "254700000001"},
+        {"id": "wamid.receipt-2", "status": "failed", "recipient_id": "254700000002", "errors": [{"code": 131026}]},
+    ]}}]}],
+}
+
+
+def run_mode(mode: str) -> dict:
+    # Settings are read at import time
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='wa-receipts-')}/receipts.db"
+    os.environ.update(WEBHOOK_MODE=mode, DELIVERY_TRACKING="true", OUTBOX="false", QUEUE_POLL_INTERVAL="0.05")
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import func, select
+    from app import models
+    from app.db import SessionLocal
+    from app.main import app
+
+    with TestClient(app) as client:
+        response = client.post("/webhook/whatsapp", json=PAYLOAD)
+        response.raise_for_status()
+        if mode == "queue":
+            from app.services import inbound_queue
+
+            deadline = time.monotonic() + 10
+            while time.monotonic() < deadline:
+                db = SessionLocal()
+                try:
+                    counts = inbound_queue.stats(db)
+                    if counts and not counts.get("pending") and not counts.get("processing"):
+                        break
+                finally:
+                    db.close()
+                time.sleep(0.05)
+        db = SessionLocal()
+        try:
+            return {
+                "delivery_events": db.execute(select(func.count()).select_from(models.DeliveryEvent)).scalar_one(),
+                "recipient_health": db.execute(select(func.count()).select_from(models.RecipientHealth)).scalar_one(),
+            }
+        finally:
+            db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("sync", "queue"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.mode:
+        print(json.dumps(run_mode(args.mode)))
+        return
+
+    counts = {}
+    for mode in ("sync", "queue"):
+        out = subprocess.run(
+            [sys.executable, "-W", "ignore", "-m", "bench.delivery_receipts", "--mode", mode],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        counts[mode] = json.loads(out.strip().splitlines()[-1])
+        print(f"  {mode:<6} {counts[mode]}")
+    if counts["sync"] != counts["queue"] or not all(counts["sync"].values()):
+        print("FAIL: receipts are not recorded the same in both modes")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
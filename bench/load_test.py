@@ -0,0 +1,394 @@
+"""Load test: POST /webhook/whatsapp throughput against a local Graph API stand-in.
+
+    python -m bench.load_test [--buyers 2000] [--listings 500] [--messages 3000] [--concurrency 32]
+    python -m bench.load_test --buyers 100000 --listings 10000 --messages 50000
+
+Seeds a fresh database (sellers, buyers with opt-ins, open listings with bids), starts a
+stub Graph server that adds --graph-latency-ms per send and answers --graph-429-rate of
+them with 429, then runs the app under uvicorn pointed at the stub (WA_GRAPH_BASE).
+Virtual users replay realistic scripts (JOIN/SUBSCRIBE/LISTINGS/BID, sellers running the
+LIST flow, BIDS and ACCEPT); each user has one message in flight, and several users'
+messages are batched into one webhook payload, as Meta does.
+Reports messages/sec, p50/p99 webhook latency, DB queries per message (from /metrics)
+and outbound sends per message. Exits 1 when a --min/--max threshold is missed.
+WARNING: with --database-url the app tables in that database are dropped and recreated.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+COMMODITIES = ["MAIZE", "BEANS", "RICE", "WHEAT", "SORGHUM", "COFFEE", "TEA", "POTATO"]
+REGIONS = ["NAIROBI", "NAKURU", "KISUMU", "ELDORET", "MOMBASA", "MERU"]
+PAIRS = [(c, r) for c in COMMODITIES for r in REGIONS]
+ADMIN_TOKEN = "load-test"
+CHUNK = 5000
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def seller_phone(i: int) -> str:
+    return f"25410{i:07d}"
+
+
+def buyer_phone(i: int) -> str:
+    return f"25470{i:07d}"
+
+
+def seed(database_url: str, sellers: int, buyers: int, listings: int, bids_per_listing: int) -> None:
+    # Bulk inserts with explicit ids so scripts can reference listings and bids
+    os.environ["DATABASE_URL"] = database_url
+    from sqlalchemy import insert
+    from app.db import Base, get_engine
+    from app.migrations import run_migrations
+    from app.models import Bid, Listing, OptIn, User
+
+    engine = get_engine()
+    if not engine.url.drivername.startswith("sqlite"):
+        Base.metadata.drop_all(bind=engine)
+    run_migrations(engine)
+    now = datetime.utcnow()
+
+    def bulk(model, rows):
+        with engine.begin() as conn:
+            for start in range(0, len(rows), CHUNK):
+                conn.execute(insert(model), rows[start:start + CHUNK])
+
+    bulk(User, [{"id": i + 1, "phone": seller_phone(i), "role": "seller", "status": "active", "created_at": now} for i in range(sellers)])
+    bulk(User, [{"id": sellers + i + 1, "phone": buyer_phone(i), "role": "buyer", "status": "active", "created_at": now} for i in range(buyers)])
+    bulk(OptIn, [
+        {"user_id": sellers + i + 1, "commodity": PAIRS[i % len(PAIRS)][0], "region": PAIRS[i % len(PAIRS)][1], "active": 1, "created_at": now}
+        for i in range(buyers)
+    ])
+    bulk(Listing, [
+        {
+            "id": i + 1,
+            "seller_id": i % sellers + 1,
+            "commodity": PAIRS[i % len(PAIRS)][0],
+            "location": PAIRS[i % len(PAIRS)][1],
+            "quantity": 100.0 + i % 50,
+            "unit": "KG",
+            "min_price": 10.0,
+            "status": "open",
+            "created_at": now - timedelta(seconds=listings - i),
+        }
+        for i in range(listings)
+    ])
+    bulk(Bid, [
+        {
+            "id": i * bids_per_listing + j + 1,
+            "listing_id": i + 1,
+            "buyer_id": sellers + (i * bids_per_listing + j) % buyers + 1,
+            "price_per_unit": 10.0 + j,
+            "quantity": 1.0 + j,
+            "status": "placed",
+            "created_at": now,
+        }
+        for i in range(listings)
+        for j in range(bids_per_listing)
+    ])
+    engine.dispose()
+
+
+def build_scripts(args, rng: random.Random) -> List[List[str]]:
+    # Per-user message sequences until --messages is reached
+    listings_by_seller: Dict[int, deque] = {s: deque() for s in range(args.sellers)}
+    for i in range(args.listings):
+        listings_by_seller[i % args.sellers].append(i + 1)
+    scripts: List[List[str]] = []
+    total = 0
+    new_users = 0
+    while total < args.messages:
+        roll = rng.random()
+        if roll < args.seller_share:
+            s = rng.randrange(args.sellers)
+            own = listings_by_seller[s]
+            c, r = rng.choice(PAIRS)
+            script = ["LIST", c, str(rng.randint(10, 500)), "KG", r, "skip", str(rng.randint(8, 15)), "skip"]
+            if own:
+                listing_id = own.popleft()
+                script += [f"BIDS {listing_id}", f"ACCEPT {(listing_id - 1) * args.bids_per_listing + 1}"]
+            scripts.append((seller_phone(s), script))
+        elif roll < args.seller_share + args.new_user_share:
+            c, r = rng.choice(PAIRS)
+            phone = f"25479{new_users:07d}"
+            new_users += 1
+            script = ["JOIN buyer", f"SUBSCRIBE {c} {r}", "LISTINGS", f"BID {rng.randint(1, args.listings)} {rng.randint(10, 20)} {rng.randint(1, 9)}"]
+            scripts.append((phone, script))
+        else:
+            b = rng.randrange(args.buyers)
+            c, r = rng.choice(PAIRS)
+            script = ["LISTINGS", "LISTINGS MORE", f"SUBSCRIBE {c} {r}"]
+            script += [f"BID {rng.randint(1, args.listings)} {rng.randint(10, 20)} {rng.randint(1, 9)}" for _ in range(rng.randint(1, 3))]
+            script.append("HELP")
+            scripts.append((buyer_phone(b), script))
+        total += len(scripts[-1][1])
+    # A phone may appear in several scripts; merge them so each sender stays strictly ordered
+    merged: Dict[str, List[str]] = {}
+    for phone, script in scripts:
+        merged.setdefault(phone, []).extend(script)
+    return list(merged.items())
+
+
+class GraphStub:
+    # Minimal stand-in for POST /<version>/<phone-id>/messages
+    def __init__(self, latency_ms: float, rate_429: float, retry_after: float, seed: int):
+        self.latency = latency_ms / 1000.0
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {"sent": 0, "throttled": 0}
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                with stub.lock:
+                    throttle = stub.rng.random() < stub.rate_429
+                    jitter = stub.rng.uniform(0.5, 1.5)
+                    stub.counts["throttled" if throttle else "sent"] += 1
+                    wamid = f"wamid.stub.{stub.counts['sent']}"
+                time.sleep(stub.latency * jitter)
+                if throttle:
+                    body = json.dumps({"error": {"code": 130429, "message": "rate limit hit"}}).encode()
+                    self.send_response(429)
+                    self.send_header("Retry-After", str(stub.retry_after))
+                else:
+                    body = json.dumps({"messages": [{"id": wamid}]}).encode()
+                    self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", _free_port()), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+
+    def start(self) -> None:
+        threading.Thread(target=self.server.serve_forever, name="graph-stub", daemon=True).start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+
+
+def _payload(messages: List[dict]) -> dict:
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "load-test", "changes": [{"field": "messages", "value": {"messaging_product": "whatsapp", "messages": messages}}]}],
+    }
+
+
+def _metric(text: str, name: str) -> float:
+    total = 0.0
+    for line in text.splitlines():
+        if line.startswith(name + " ") or line.startswith(name + "{"):
+            total += float(line.rsplit(" ", 1)[1])
+    return total
+
+
+async def drive(base_url: str, scripts, args, rng: random.Random) -> dict:
+    import httpx
+
+    ready = deque((phone, 0) for phone, _ in scripts)
+    texts = dict(scripts)
+    remaining = len(scripts)
+    latencies: List[float] = []
+    messages_sent = 0
+    wamid = 0
+    wake = asyncio.Event()
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120.0, limits=httpx.Limits(max_connections=args.concurrency)) as client:
+        before = (await client.get("/metrics", params={"token": ADMIN_TOKEN})).text
+
+        async def worker():
+            nonlocal remaining, messages_sent, wamid
+            while remaining > 0:
+                if not ready:
+                    wake.clear()
+                    await wake.wait()
+                    continue
+                batch = [ready.popleft() for _ in range(min(len(ready), rng.randint(1, args.batch_max)))]
+                messages = []
+                for phone, pos in batch:
+                    wamid += 1
+                    messages.append({
+                        "from": phone,
+                        "id": f"wamid.load.{wamid}",
+                        "timestamp": str(int(time.time())),
+                        "type": "text",
+                        "text": {"body": texts[phone][pos]},
+                    })
+                started = time.perf_counter()
+                resp = await client.post("/webhook/whatsapp", json=_payload(messages))
+                latencies.append(time.perf_counter() - started)
+                if resp.status_code != 200:
+                    raise RuntimeError(f"webhook returned {resp.status_code}: {resp.text[:200]}")
+                messages_sent += len(messages)
+                for phone, pos in batch:
+                    if pos + 1 < len(texts[phone]):
+                        ready.append((phone, pos + 1))
+                    else:
+                        remaining -= 1
+                wake.set()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        if args.mode == "queue":
+            while True:
+                counts = (await client.get("/admin/queue", params={"token": ADMIN_TOKEN})).json()["counts"]
+                if not counts.get("pending") and not counts.get("processing"):
+                    break
+                await asyncio.sleep(0.2)
+        while True:
+            # Replies and broadcasts staged in the outbox count once they have been sent
+            outbox = (await client.get("/admin/outbox", params={"token": ADMIN_TOKEN})).json()
+            if not outbox["enabled"] or not (outbox["counts"].get("pending") or outbox["counts"].get("sending")):
+                break
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - started
+        after = (await client.get("/metrics", params={"token": ADMIN_TOKEN})).text
+
+    latencies.sort()
+    return {
+        "messages": messages_sent,
+        "payloads": len(latencies),
+        "seconds": round(elapsed, 3),
+        "msgs_per_sec": round(messages_sent / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 1),
+        "db_queries": _metric(after, "wa_db_queries_total") - _metric(before, "wa_db_queries_total"),
+        "handled": _metric(after, "wa_command_duration_seconds_count") - _metric(before, "wa_command_duration_seconds_count"),
+    }
+
+
+def _wait_healthy(base_url: str, proc: subprocess.Popen, timeout: float = 30.0) -> None:
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("app exited during startup")
+        try:
+            if httpx.get(base_url + "/health", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("app did not become healthy")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--buyers", type=int, default=2000)
+    parser.add_argument("--sellers", type=int, default=50)
+    parser.add_argument("--listings", type=int, default=500)
+    parser.add_argument("--bids-per-listing", type=int, default=2)
+    parser.add_argument("--messages", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=32, help="webhook POSTs in flight")
+    parser.add_argument("--batch-max", type=int, default=5, help="max messages per webhook payload")
+    parser.add_argument("--seller-share", type=float, default=0.05, help="share of scripts that run the LIST flow (each broadcasts)")
+    parser.add_argument("--new-user-share", type=float, default=0.15)
+    parser.add_argument("--graph-latency-ms", type=float, default=30.0)
+    parser.add_argument("--graph-429-rate", type=float, default=0.01)
+    parser.add_argument("--graph-retry-after", type=float, default=0.1)
+    parser.add_argument("--mode", choices=("sync", "queue"), default="sync", help="WEBHOOK_MODE for the app")
+    parser.add_argument("--database-url", help="scratch database (default: a temporary SQLite file)")
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE", help="extra env for the app")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    parser.add_argument("--min-msgs-per-sec", type=float)
+    parser.add_argument("--max-p99-ms", type=float)
+    parser.add_argument("--max-queries-per-msg", type=float)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    database_url = args.database_url or f"sqlite:///{tempfile.mkdtemp(prefix='wa-load-')}/load.db"
+    print(f"seeding {args.sellers} sellers, {args.buyers} buyers, {args.listings} open listings ...", file=sys.stderr)
+    seed(database_url, args.sellers, args.buyers, args.listings, args.bids_per_listing)
+    scripts = build_scripts(args, rng)
+
+    stub = GraphStub(args.graph_latency_ms, args.graph_429_rate, args.graph_retry_after, args.seed)
+    stub.start()
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(
+        os.environ,
+        DATABASE_URL=database_url,
+        WA_GRAPH_BASE=f"http://127.0.0.1:{stub.port}/v20.0",
+        WA_ACCESS_TOKEN="load-test",
+        WA_PHONE_NUMBER_ID="load-test",
+        ADMIN_INIT_TOKEN=ADMIN_TOKEN,
+        WEBHOOK_MODE=args.mode,
+        METRICS_ENABLED="true",
+        # Scripted users send faster than real ones; pass --app-env INBOUND_RATE_LIMIT=true to include the limiter
+        INBOUND_RATE_LIMIT="false",
+        WA_RATE_LIMIT_PER_SEC=os.environ.get("WA_RATE_LIMIT_PER_SEC", "1000"),
+        WA_RATE_LIMIT_BURST=os.environ.get("WA_RATE_LIMIT_BURST", "1000"),
+    )
+    for item in args.app_env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning", "--no-access-log"],
+        env=env,
+    )
+    try:
+        _wait_healthy(base_url, proc)
+        result = asyncio.run(drive(base_url, scripts, args, rng))
+    finally:
+        proc.terminate()
+        proc.wait(30)
+        stub.stop()
+
+    messages = result["messages"]
+    result.update(
+        users=len(scripts),
+        db_queries_per_msg=round(result.pop("db_queries") / messages, 2),
+        sends_per_msg=round(stub.counts["sent"] / messages, 2),
+        graph_429s=stub.counts["throttled"],
+        mode=args.mode,
+    )
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print(f"mode {args.mode}: {messages} messages from {result['users']} users in {result['payloads']} payloads, {result['seconds']}s")
+        print(f"  throughput        {result['msgs_per_sec']} msgs/sec")
+        print(f"  webhook latency   p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms")
+        print(f"  DB queries/msg    {result['db_queries_per_msg']}")
+        print(f"  sends/msg         {result['sends_per_msg']} ({result['graph_429s']} injected 429s)")
+
+    failures = []
+    if args.min_msgs_per_sec is not None and result["msgs_per_sec"] < args.min_msgs_per_sec:
+        failures.append(f"throughput {result['msgs_per_sec']} < {args.min_msgs_per_sec}")
+    if args.max_p99_ms is not None and result["p99_ms"] > args.max_p99_ms:
+        failures.append(f"p99 {result['p99_ms']} ms > {args.max_p99_ms}")
+    if args.max_queries_per_msg is not None and result["db_queries_per_msg"] > args.max_queries_per_msg:
+        failures.append(f"{result['db_queries_per_msg']} queries/msg > {args.max_queries_per_msg}")
+    if failures:
+        print("FAIL: " + "; ".join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
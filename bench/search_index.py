@@ -0,0 +1,97 @@
+"""Micro-benchmark: SEARCH index build time and query latency.
+
+    python -m bench.search_index [--listings 100000] [--queries 5000] [--budget-ms 1.0]
+
+Seeds a temporary SQLite database with open listings (random commodities, regions, units,
+qualities, quantities and minimum prices), builds the index from it as the app does at
+startup, then times a mix of SEARCH queries: single and multi-term, prefixes, aliases and
+numeric filters. Exits 1 when the p99 query latency is over the budget.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+COMMODITIES = ["MAIZE", "BEANS", "RICE", "WHEAT", "SORGHUM", "MILLET", "POTATOES", "GRAMS", "COWPEAS", "SUNFLOWER", "SOYBEANS", "CASSAVA"]
+REGIONS = ["NAIROBI", "NAKURU", "MOMBASA", "KISUMU", "ELDORET", "KITALE", "MERU", "NYERI", "MACHAKOS", "KERICHO", "BUNGOMA", "GARISSA"]
+UNITS = ["KG", "BAG", "TON", "CRATE"]
+QUALITIES = [None, "GRADE 1", "GRADE 2", "DRY", "ORGANIC", "CERTIFIED"]
+QUERIES = [
+    "maize", "maize nairobi", "bean", "corn nak", "rice mombasa 50", "wheat 500 40", "ma", "organic", "grade 1 kisumu",
+    "sorghum eldoret 10 30", "kilo", "potatoes 1000", "0 5", "sunflower kericho organic", "mil",
+]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--listings", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=5000)
+    parser.add_argument("--budget-ms", type=float, default=1.0, help="p99 query latency budget")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='wa-search-')}/search.db"
+    from sqlalchemy import insert
+    from app import models
+    from app.db import SessionLocal, get_engine
+    from app.migrations import run_migrations
+    from app.services.search import SearchIndex, parse_query
+
+    run_migrations(get_engine())
+    rng = random.Random(args.seed)
+    db = SessionLocal()
+    db.execute(insert(models.User), [{"phone": f"2541{i:08d}", "role": "seller", "status": "active"} for i in range(1000)])
+    rows = [
+        {
+            "seller_id": 1 + i % 1000,
+            "commodity": rng.choice(COMMODITIES),
+            "quantity": float(rng.randint(1, 2000)),
+            "unit": rng.choice(UNITS),
+            "location": rng.choice(REGIONS),
+            "quality": rng.choice(QUALITIES),
+            "min_price": None if rng.random() < 0.3 else float(rng.randint(5, 80)),
+            "status": "open",
+            "version": 0,
+        }
+        for i in range(args.listings)
+    ]
+    for start in range(0, len(rows), 10000):
+        db.execute(insert(models.Listing), rows[start:start + 10000])
+    db.commit()
+
+    index = SearchIndex(refresh_interval=0)
+    started = time.perf_counter()
+    index.load(db)
+    build_s = time.perf_counter() - started
+    db.close()
+
+    parsed = [parse_query(q.split()) for q in QUERIES]
+    timings = {q: [] for q in QUERIES}
+    for i in range(args.queries):
+        query = QUERIES[i % len(QUERIES)]
+        terms, min_qty, max_price = parsed[i % len(QUERIES)]
+        started = time.perf_counter()
+        index.search(terms, min_qty, max_price, limit=10)
+        timings[query].append(time.perf_counter() - started)
+
+    everything = sorted(t for ts in timings.values() for t in ts)
+    p50 = statistics.median(everything) * 1000
+    p99 = everything[min(len(everything) - 1, int(len(everything) * 0.99))] * 1000
+    print(f"index over {args.listings} open listings built in {build_s:.2f}s ({index.stats()['tokens']} tokens)")
+    print(f"{'query':<30}{'matches':>9}{'p50 ms':>10}{'max ms':>10}")
+    for query, (terms, min_qty, max_price) in zip(QUERIES, parsed):
+        found, more = index.search(terms, min_qty, max_price, limit=10)
+        matches = f"{len(found)}{'+' if more else ''}"
+        print(f"{query:<30}{matches:>9}{statistics.median(timings[query]) * 1000:>10.3f}{max(timings[query]) * 1000:>10.3f}")
+    print(f"all queries        p50 {p50:.3f} ms, p99 {p99:.3f} ms (budget {args.budget_ms} ms)")
+    if p99 > args.budget_ms:
+        print("FAIL: p99 over budget")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()